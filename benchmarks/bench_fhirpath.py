@@ -0,0 +1,60 @@
+"""Per-resource cost of the compiled extraction rules versus hand-walked dicts.
+
+Run with `uv run python -m benchmarks.bench_fhirpath [resources]`.
+"""
+import random
+import sys
+import timeit
+
+from cdpmd.fhirpath import SUMMARY_RULES, compile_path
+
+
+def make_resources(count: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    codes = ['4548-4', '2339-0', '33914-3', '2093-3']
+    resources = []
+    for i in range(count):
+        resources.append({
+            'resourceType': 'Observation',
+            'id': str(i),
+            'status': 'final',
+            'code': {'coding': [{'system': 'http://loinc.org', 'code': rng.choice(codes)}]},
+            'valueQuantity': {'value': round(rng.uniform(4, 12), 1), 'unit': '%'},
+            'effectiveDateTime': f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+        })
+        if i % 10 == 0:
+            resources.append({
+                'resourceType': 'Condition',
+                'id': f'c{i}',
+                'code': {'text': 'Type 2 diabetes mellitus'},
+            })
+    return resources
+
+def hand_walked(resources: list[dict]) -> list:
+    values = []
+    for obs in resources:
+        if obs.get('resourceType') != 'Observation':
+            continue
+        for coding in obs.get('code', {}).get('coding', []):
+            if coding.get('code') == '4548-4':
+                value = obs.get('valueQuantity', {}).get('value')
+                if value is not None:
+                    values.append(value)
+    return values
+
+def main(count: int = 10_000, repeat: int = 5):
+    resources = make_resources(count)
+    _, hba1c = compile_path('Observation.where(code=4548-4).valueQuantity.value')
+    cases = {
+        'hand-walked HbA1c loop': lambda: hand_walked(resources),
+        'compiled HbA1c rule': lambda: [value for r in resources if r['resourceType'] == 'Observation' for value in hba1c(r)],
+        f'SUMMARY_RULES ({len(SUMMARY_RULES.rules)} rules, one pass)': lambda: SUMMARY_RULES.run(resources),
+    }
+    print(f'{len(resources)} resources, best of {repeat}')
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=1, repeat=repeat))
+        print(f'{name:<45} {best * 1e3:8.2f} ms  {best / len(resources) * 1e6:6.2f} us/resource')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
@@ -0,0 +1,199 @@
+"""Concurrent load driver for the main routes, reporting throughput and latency percentiles.
+
+Run everything locally (mock FHIR server, mock LLM and the app in a fresh
+working directory, so caches start cold) with
+
+    uv run python -m benchmarks.load --spawn --concurrency 16 --duration 30
+
+or drive an already running app with `--app http://127.0.0.1:5001 --fhir http://127.0.0.1:8081`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ('index', 'patient', 'actions', 'cds')
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)]
+
+
+async def wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f'{url} did not come up within {timeout}s')
+                await asyncio.sleep(0.2)
+
+def spawn(args) -> List[subprocess.Popen]:
+    """Start the mock FHIR server, the mock LLM and the app as subprocesses."""
+    env = {
+        **os.environ,
+        'DEEPSEEK_BASE_URL': f'http://127.0.0.1:{args.llm_port}',
+        'DEEPSEEK_API_KEY': 'benchmark',
+        'LOGFIRE_IGNORE_NO_CONFIG': '1',
+        'LOGFIRE_CONSOLE': 'false',
+        'PYTHONPATH': ROOT,
+    }
+    workdir = tempfile.mkdtemp(prefix='cdpmd-bench-')
+    commands = [
+        [sys.executable, '-m', 'benchmarks.mock_fhir', '--port', str(args.fhir_port),
+         '--patients', str(args.patients), '--latency', str(args.fhir_latency)],
+        [sys.executable, '-m', 'benchmarks.mock_llm', '--port', str(args.llm_port),
+         '--tokens-per-second', str(args.tokens_per_second), '--first-token', str(args.first_token)],
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--app-dir', ROOT, '--port', str(args.app_port),
+         '--log-level', 'warning'],
+    ]
+    return [subprocess.Popen(command, cwd=workdir if 'main:app' in command else ROOT, env=env) for command in commands]
+
+
+class LoadDriver:
+    def __init__(self, app_url: str, fhir_url: str, concurrency: int, routes: List[str], seed: int = 0):
+        self.app_url = app_url.rstrip('/')
+        self.fhir_url = fhir_url.rstrip('/')
+        self.concurrency = concurrency
+        self.routes = routes
+        self.rng = random.Random(seed)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.patient_ids: List[str] = []
+        self.prefetch: Dict[str, dict] = {}
+
+    async def setup(self, fhir: httpx.AsyncClient):
+        bundle = (await fhir.get('/Patient')).json()
+        self.patient_ids = [entry['resource']['id'] for entry in bundle.get('entry', [])]
+        if not self.patient_ids:
+            raise RuntimeError(f'No patients on {self.fhir_url}')
+        if 'cds' in self.routes:
+            types = {
+                'conditions': 'Condition', 'medications': 'MedicationRequest', 'observations': 'Observation',
+                'encounters': 'Encounter', 'diagnosticReports': 'DiagnosticReport',
+                'riskAssessments': 'RiskAssessment', 'carePlans': 'CarePlan',
+            }
+            for patient_id in self.patient_ids[:20]:
+                prefetch = {'patient': (await fhir.get(f'/Patient/{patient_id}')).json()}
+                for key, resource_type in types.items():
+                    prefetch[key] = (await fhir.get(f'/{resource_type}', params={'patient': patient_id})).json()
+                self.prefetch[patient_id] = prefetch
+
+    def request(self, route: str) -> dict:
+        patient_id = self.rng.choice(self.patient_ids)
+        if route == 'index':
+            return {'method': 'GET', 'url': '/'}
+        if route == 'patient':
+            return {'method': 'GET', 'url': f'/patients/{patient_id}'}
+        if route == 'actions':
+            return {
+                'method': 'POST',
+                'url': f'/actions/{patient_id}',
+                'data': {
+                    'action_type': 'create',
+                    'description': 'Benchmark follow-up',
+                    'resourceId': f'bench-{self.rng.randrange(10 ** 9)}',
+                    'resource_type': 'ServiceRequest',
+                },
+            }
+        patient_id = self.rng.choice(list(self.prefetch))
+        return {
+            'method': 'POST',
+            'url': '/cds-services/predictor',
+            'content': json.dumps({
+                'hook': 'patient-view',
+                'context': {'patientId': patient_id},
+                'prefetch': self.prefetch[patient_id],
+            }),
+        }
+
+    async def worker(self, client: httpx.AsyncClient, deadline: float):
+        while time.monotonic() < deadline:
+            route = self.rng.choice(self.routes)
+            started = time.perf_counter()
+            try:
+                response = await client.request(**self.request(route))
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                self.latencies[route].append(time.perf_counter() - started)
+            else:
+                self.errors[route] += 1
+
+    async def run(self, duration: float) -> float:
+        async with httpx.AsyncClient(base_url=self.fhir_url) as fhir:
+            await self.setup(fhir)
+        cookies = {'access_token': 'benchmark', 'meldrx_base_url': self.fhir_url}
+        limits = httpx.Limits(max_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.app_url, cookies=cookies, limits=limits, timeout=120) as client:
+            started = time.perf_counter()
+            deadline = time.monotonic() + duration
+            await asyncio.gather(*(self.worker(client, deadline) for _ in range(self.concurrency)))
+            return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> str:
+        lines = [f'{"route":<10} {"requests":>8} {"errors":>6} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}']
+        for route in self.routes:
+            latencies = self.latencies[route]
+            lines.append(
+                f'{route:<10} {len(latencies):>8} {self.errors[route]:>6} {len(latencies) / elapsed:>8.1f} '
+                f'{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} '
+                f'{percentile(latencies, 99) * 1000:>8.1f}'
+            )
+        return '\n'.join(lines)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--spawn', action='store_true', help='Start mock servers and the app locally')
+    parser.add_argument('--app', default=None, help='App URL (default: the spawned app)')
+    parser.add_argument('--fhir', default=None, help='FHIR server URL (default: the spawned mock)')
+    parser.add_argument('--app-port', type=int, default=5051)
+    parser.add_argument('--fhir-port', type=int, default=8081)
+    parser.add_argument('--llm-port', type=int, default=8082)
+    parser.add_argument('--patients', type=int, default=50)
+    parser.add_argument('--fhir-latency', type=float, default=0.05)
+    parser.add_argument('--tokens-per-second', type=float, default=50.0)
+    parser.add_argument('--first-token', type=float, default=0.5)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--routes', default=','.join(ROUTES), help=f'Comma separated subset of {", ".join(ROUTES)}')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    app_url = args.app or f'http://127.0.0.1:{args.app_port}'
+    fhir_url = args.fhir or f'http://127.0.0.1:{args.fhir_port}'
+    processes = spawn(args) if args.spawn else []
+    try:
+        await wait_until_up(f'{fhir_url}/Patient')
+        await wait_until_up(f'{app_url}/about')
+        driver = LoadDriver(app_url, fhir_url, args.concurrency, args.routes.split(','), args.seed)
+        elapsed = await driver.run(args.duration)
+        print(driver.report(elapsed))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
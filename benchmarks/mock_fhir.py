@@ -0,0 +1,186 @@
+"""Stand-in FHIR server serving synthetic diabetic patients with configurable latency.
+
+Run with `uv run python -m benchmarks.mock_fhir [--port 8081] [--patients 50] [--latency 0.05]`,
+or serve files written by `benchmarks.synthetic` with `--data <dir>`.
+Supports the reads and writes cdpmd makes: `GET /Patient`, `GET /Patient/{id}`,
+`GET /{type}?patient={id}`, `POST /Task`, `PUT /Task/{id}` and `DELETE /Task/{id}`,
+plus a bulk `GET /Patient/$export` (or `/Group/{id}/$export`) serving NDJSON files.
+"""
+import argparse
+import asyncio
+import json
+import random
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from benchmarks.synthetic import generate, load
+
+
+class MockFhirServer:
+    """In-memory FHIR store indexed by (resource type, patient id)."""
+
+    def __init__(self, resources: Iterable[dict], latency: float = 0.0, jitter: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.by_id: Dict[str, Dict[str, dict]] = defaultdict(dict)
+        self.by_patient: Dict[str, Dict[str, Dict[str, dict]]] = defaultdict(lambda: defaultdict(dict))
+        self.exports: Dict[str, dict] = {}
+        for resource in resources:
+            self.store(resource)
+
+    def store(self, resource: dict):
+        resource_type = resource['resourceType']
+        self.by_id[resource_type][resource['id']] = resource
+        reference = (resource.get('subject') or resource.get('for') or {}).get('reference', '')
+        if reference.startswith('Patient/'):
+            self.by_patient[resource_type][reference.split('/', 1)[1]][resource['id']] = resource
+
+    def remove(self, resource_type: str, resource_id: str) -> bool:
+        resource = self.by_id[resource_type].pop(resource_id, None)
+        for resources in self.by_patient[resource_type].values():
+            resources.pop(resource_id, None)
+        return resource is not None
+
+    async def delay(self):
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(self.latency + self.rng.uniform(-self.jitter, self.jitter), 0))
+
+    @staticmethod
+    def bundle(resources: List[dict]) -> dict:
+        return {
+            'resourceType': 'Bundle',
+            'type': 'searchset',
+            'total': len(resources),
+            'entry': [{'resource': resource} for resource in resources],
+        }
+
+    async def search(self, request: Request):
+        await self.delay()
+        resource_type = request.path_params['resource_type']
+        patient_id = request.query_params.get('patient')
+        if patient_id:
+            resources = list(self.by_patient[resource_type][patient_id].values())
+        else:
+            resources = list(self.by_id[resource_type].values())
+        count = request.query_params.get('_count')
+        if not count:
+            return JSONResponse(self.bundle(resources))
+        # Offset paging with a Bundle `next` link, like HAPI's _getpagesoffset
+        count, offset = int(count), int(request.query_params.get('_offset', 0))
+        bundle = self.bundle(resources[offset:offset + count])
+        bundle['total'] = len(resources)
+        if offset + count < len(resources):
+            bundle['link'] = [{'relation': 'next', 'url': str(request.url.include_query_params(_offset=offset + count))}]
+        return JSONResponse(bundle)
+
+    async def read(self, request: Request):
+        await self.delay()
+        resource = self.by_id[request.path_params['resource_type']].get(request.path_params['resource_id'])
+        if resource is None:
+            return JSONResponse({'resourceType': 'OperationOutcome'}, status_code=404)
+        return JSONResponse(resource)
+
+    async def create(self, request: Request):
+        await self.delay()
+        resource = await request.json()
+        resource['resourceType'] = request.path_params['resource_type']
+        resource['id'] = str(uuid.uuid4())
+        resource['meta'] = {'versionId': '1'}
+        self.store(resource)
+        return JSONResponse(resource, status_code=201)
+
+    async def update(self, request: Request):
+        await self.delay()
+        resource = await request.json()
+        resource['resourceType'] = request.path_params['resource_type']
+        resource['id'] = request.path_params['resource_id']
+        previous = self.by_id[resource['resourceType']].get(resource['id'], {})
+        version = int((previous.get('meta') or {}).get('versionId', 0)) + 1
+        resource['meta'] = {'versionId': str(version)}
+        self.store(resource)
+        return JSONResponse(resource, status_code=200 if previous else 201)
+
+    async def delete(self, request: Request):
+        await self.delay()
+        self.remove(request.path_params['resource_type'], request.path_params['resource_id'])
+        return Response(status_code=204)
+
+    async def export(self, request: Request):
+        await self.delay()
+        job = uuid.uuid4().hex
+        types = request.query_params.get('_type')
+        self.exports[job] = {
+            'types': types.split(',') if types else list(self.by_id),
+            'polls': 0,
+            'request': str(request.url),
+        }
+        return Response(status_code=202, headers={'Content-Location': str(request.url_for('export_status', job=job))})
+
+    async def export_status(self, request: Request):
+        await self.delay()
+        export = self.exports.get(request.path_params['job'])
+        if export is None:
+            return JSONResponse({'resourceType': 'OperationOutcome'}, status_code=404)
+        export['polls'] += 1
+        if export['polls'] == 1:
+            return Response(status_code=202, headers={'Retry-After': '1', 'X-Progress': 'in progress'})
+        return JSONResponse({
+            'transactionTime': '2025-01-01T00:00:00Z',
+            'request': export['request'],
+            'requiresAccessToken': True,
+            'output': [
+                {'type': resource_type, 'url': str(request.url_for('export_file', job=request.path_params['job'], resource_type=resource_type))}
+                for resource_type in export['types'] if self.by_id.get(resource_type)
+            ],
+            'error': [],
+        })
+
+    async def export_file(self, request: Request):
+        resources = list(self.by_id.get(request.path_params['resource_type'], {}).values())
+
+        async def lines():
+            for start in range(0, len(resources), 1000):
+                yield ''.join(json.dumps(resource) + '\n' for resource in resources[start:start + 1000])
+
+        return StreamingResponse(lines(), media_type='application/fhir+ndjson')
+
+    def app(self) -> Starlette:
+        return Starlette(routes=[
+            Route('/Patient/$export', self.export, methods=['GET']),
+            Route('/Group/{group_id}/$export', self.export, methods=['GET']),
+            Route('/$export-status/{job}', self.export_status, methods=['GET'], name='export_status'),
+            Route('/$export-files/{job}/{resource_type}.ndjson', self.export_file, methods=['GET'], name='export_file'),
+            Route('/{resource_type}', self.search, methods=['GET']),
+            Route('/{resource_type}', self.create, methods=['POST']),
+            Route('/{resource_type}/{resource_id}', self.read, methods=['GET']),
+            Route('/{resource_type}/{resource_id}', self.update, methods=['PUT']),
+            Route('/{resource_type}/{resource_id}', self.delete, methods=['DELETE']),
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--patients', type=int, default=50)
+    parser.add_argument('--cgm-days', type=float, default=0.0, help='Days of CGM readings per generated patient')
+    parser.add_argument('--data', help='Directory or file written by benchmarks.synthetic instead of generating')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Uniform +/- seconds around --latency')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    resources = load(args.data) if args.data else generate(args.patients, args.seed, cgm_days=args.cgm_days)
+    server = MockFhirServer(resources, args.latency, args.jitter, args.seed)
+    uvicorn.run(server.app(), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
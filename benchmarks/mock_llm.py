@@ -0,0 +1,236 @@
+"""Mock OpenAI-compatible chat completions endpoint with a configurable token rate.
+
+Run with `uv run python -m benchmarks.mock_llm [--port 8082] [--tokens-per-second 50]`
+and point the app at it with `DEEPSEEK_BASE_URL=http://127.0.0.1:8082`.
+Every completion answers the structured-result tool call with the dummy
+predictor cards, streamed or not, after `--first-token` seconds. Batch
+schema requests get one report per `Patient <id>:` line of the prompt.
+The `/v1/files` and `/v1/batches` endpoints run uploaded batches at once,
+for `LLM_BATCH_API=true` with `LLM_BATCH_BASE_URL` pointing here.
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+import uuid
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from cdpmd.schemas import predictor_dummy_data
+
+
+CHARS_PER_TOKEN = 4
+BATCH_PATIENT = re.compile(r'^Patient (\S+?): ', re.MULTILINE)
+
+
+class MockLLM:
+    """Answers chat completions at `tokens_per_second`, roughly 4 characters per token."""
+
+    def __init__(self, tokens_per_second: float = 50.0, first_token: float = 0.5):
+        self.tokens_per_second = tokens_per_second
+        self.first_token = first_token
+        # Uploaded and generated files by id, and batch objects by id
+        self.files: dict[str, dict] = {}
+        self.batches: dict[str, dict] = {}
+
+    @staticmethod
+    def reports(messages: list) -> str:
+        """Batch reply with the dummy cards for every patient id in the last user message."""
+        prompt = next((message.get('content') or '' for message in reversed(messages) if message.get('role') == 'user'), '')
+        cards = json.loads(predictor_dummy_data.model_dump_json(exclude={'cards': {'__all__': {'source'}}}))['cards']
+        return json.dumps({'reports': [
+            {'patient_id': patient_id, 'cards': cards} for patient_id in BATCH_PATIENT.findall(prompt)
+        ]})
+
+    @classmethod
+    def arguments(cls, tools: list, messages: list) -> tuple[str, str]:
+        """Name and JSON arguments of the result tool call for the request's tools."""
+        function = (tools[0] if tools else {'function': {'name': 'final_result'}})['function']
+        properties = (function.get('parameters') or {}).get('properties') or {}
+        if 'reports' in properties:
+            return function['name'], cls.reports(messages)
+        return function['name'], predictor_dummy_data.model_dump_json(exclude={'cards': {'__all__': {'source'}}})
+
+    def usage(self, body: dict, completion: str) -> dict:
+        prompt_tokens = len(json.dumps(body.get('messages', []))) // CHARS_PER_TOKEN
+        completion_tokens = max(len(completion) // CHARS_PER_TOKEN, 1)
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        }
+
+    async def completions(self, request: Request):
+        body = await request.json()
+        name, arguments = self.arguments(body.get('tools') or [], body.get('messages') or [])
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        created = int(time.time())
+        usage = self.usage(body, arguments)
+        if body.get('stream'):
+            return StreamingResponse(
+                self._stream(body['model'], completion_id, created, name, arguments, usage),
+                media_type='text/event-stream'
+            )
+
+        await asyncio.sleep(self.first_token + usage['completion_tokens'] / self.tokens_per_second)
+        return JSONResponse({
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': created,
+            'model': body['model'],
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'tool_calls',
+                'message': {
+                    'role': 'assistant',
+                    'content': None,
+                    'tool_calls': [{
+                        'id': f'call_{uuid.uuid4().hex[:8]}',
+                        'type': 'function',
+                        'function': {'name': name, 'arguments': arguments},
+                    }],
+                },
+            }],
+            'usage': usage,
+        })
+
+    async def _stream(self, model: str, completion_id: str, created: int, name: str, arguments: str, usage: dict):
+        def chunk(delta: dict, finish_reason=None, **extra) -> str:
+            data = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+                **extra,
+            }
+            return f'data: {json.dumps(data)}\n\n'
+
+        await asyncio.sleep(self.first_token)
+        yield chunk({
+            'role': 'assistant',
+            'tool_calls': [{
+                'index': 0,
+                'id': f'call_{uuid.uuid4().hex[:8]}',
+                'type': 'function',
+                'function': {'name': name, 'arguments': ''},
+            }],
+        })
+        # Ten tokens per chunk keeps the event count low at high token rates
+        step = 10 * CHARS_PER_TOKEN
+        for start in range(0, len(arguments), step):
+            await asyncio.sleep(10 / self.tokens_per_second)
+            yield chunk({'tool_calls': [{'index': 0, 'function': {'arguments': arguments[start:start + step]}}]})
+        yield chunk({}, finish_reason='tool_calls', usage=usage)
+        yield 'data: [DONE]\n\n'
+
+    def _file(self, content: bytes, filename: str, purpose: str) -> dict:
+        file = {
+            'id': f'file-{uuid.uuid4().hex}',
+            'object': 'file',
+            'bytes': len(content),
+            'created_at': int(time.time()),
+            'filename': filename,
+            'purpose': purpose,
+            'status': 'processed',
+        }
+        self.files[file['id']] = {**file, 'content': content}
+        return file
+
+    async def upload_file(self, request: Request):
+        form = await request.form()
+        upload = form['file']
+        return JSONResponse(self._file(await upload.read(), upload.filename or 'upload.jsonl', form.get('purpose', 'batch')))
+
+    async def file_content(self, request: Request):
+        file = self.files.get(request.path_params['file_id'])
+        if file is None:
+            return JSONResponse({'error': {'message': 'No such file'}}, status_code=404)
+        return PlainTextResponse(file['content'])
+
+    def _batch_line(self, line: str) -> str:
+        item = json.loads(line)
+        body = item.get('body') or {}
+        content = self.reports(body.get('messages') or [])
+        return json.dumps({
+            'id': f'batch_req_{uuid.uuid4().hex}',
+            'custom_id': item.get('custom_id'),
+            'response': {
+                'status_code': 200,
+                'request_id': uuid.uuid4().hex,
+                'body': {
+                    'id': f'chatcmpl-{uuid.uuid4().hex}',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': body.get('model'),
+                    'choices': [{
+                        'index': 0,
+                        'finish_reason': 'stop',
+                        'message': {'role': 'assistant', 'content': content},
+                    }],
+                    'usage': self.usage(body, content),
+                },
+            },
+            'error': None,
+        })
+
+    async def create_batch(self, request: Request):
+        body = await request.json()
+        file = self.files.get(body.get('input_file_id'))
+        if file is None:
+            return JSONResponse({'error': {'message': 'No such file'}}, status_code=404)
+        lines = [self._batch_line(line) for line in file['content'].decode().splitlines() if line.strip()]
+        output = self._file('\n'.join(lines).encode(), 'batch_output.jsonl', 'batch_output')
+        now = int(time.time())
+        batch = {
+            'id': f'batch_{uuid.uuid4().hex}',
+            'object': 'batch',
+            'endpoint': body.get('endpoint'),
+            'input_file_id': file['id'],
+            'completion_window': body.get('completion_window', '24h'),
+            'status': 'completed',
+            'output_file_id': output['id'],
+            'error_file_id': None,
+            'created_at': now,
+            'completed_at': now,
+            'request_counts': {'total': len(lines), 'completed': len(lines), 'failed': 0},
+        }
+        self.batches[batch['id']] = batch
+        return JSONResponse(batch)
+
+    async def retrieve_batch(self, request: Request):
+        batch = self.batches.get(request.path_params['batch_id'])
+        if batch is None:
+            return JSONResponse({'error': {'message': 'No such batch'}}, status_code=404)
+        return JSONResponse(batch)
+
+    def app(self) -> Starlette:
+        routes = []
+        for prefix in ('', '/v1'):
+            routes += [
+                Route(f'{prefix}/chat/completions', self.completions, methods=['POST']),
+                Route(f'{prefix}/files', self.upload_file, methods=['POST']),
+                Route(f'{prefix}/files/{{file_id}}/content', self.file_content),
+                Route(f'{prefix}/batches', self.create_batch, methods=['POST']),
+                Route(f'{prefix}/batches/{{batch_id}}', self.retrieve_batch),
+            ]
+        return Starlette(routes=routes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--tokens-per-second', type=float, default=50.0)
+    parser.add_argument('--first-token', type=float, default=0.5, help='Seconds before the first token')
+    args = parser.parse_args()
+    uvicorn.run(MockLLM(args.tokens_per_second, args.first_token).app(), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Send a FHIR Subscription rest-hook notification to a running app, as a FHIR server would.
+
+Run with `uv run python -m benchmarks.send_notification --patient patient-1 [--type Observation]`
+to post a new resource for that patient to `/subscriptions/notify`; the
+response lists the cache entries that were invalidated.
+"""
+import argparse
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+
+def notification(resource_type: str, patient_id: str) -> dict:
+    """A minimal changed resource of `resource_type` for `patient_id`."""
+    reference = {'reference': f'Patient/{patient_id}'}
+    resource = {'resourceType': resource_type, 'id': str(uuid.uuid4()), 'meta': {'versionId': '1'}}
+    if resource_type == 'Task':
+        return {**resource, 'status': 'accepted', 'intent': 'order', 'for': reference, 'description': 'Notification test'}
+    if resource_type == 'Observation':
+        return {
+            **resource,
+            'status': 'final',
+            'subject': reference,
+            'code': {'coding': [{'system': 'http://loinc.org', 'code': '4548-4'}], 'text': 'Hemoglobin A1c'},
+            'valueQuantity': {'value': 8.4, 'unit': '%'},
+            'effectiveDateTime': datetime.now(timezone.utc).isoformat(),
+        }
+    return {**resource, 'subject': reference}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--app', default='http://127.0.0.1:5001')
+    parser.add_argument('--patient', required=True)
+    parser.add_argument('--type', default='Observation', choices=('Observation', 'Condition', 'MedicationRequest', 'Task'))
+    parser.add_argument('--secret', default=os.getenv('SUBSCRIPTION_SECRET'))
+    parser.add_argument('--empty', action='store_true', help='Send a payload-less (id-only) notification')
+    args = parser.parse_args()
+
+    headers = {'Content-Type': 'application/fhir+json'}
+    if args.secret:
+        headers['Authorization'] = f'Bearer {args.secret}'
+    body = b'' if args.empty else json.dumps(notification(args.type, args.patient)).encode()
+    response = httpx.post(f'{args.app.rstrip("/")}/subscriptions/notify', content=body, headers=headers)
+    print(response.status_code, response.text)
+
+
+if __name__ == '__main__':
+    main()
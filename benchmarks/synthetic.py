@@ -0,0 +1,320 @@
+"""Seeded synthetic diabetic patients as FHIR resources, for stressing hot paths at scale.
+
+Run with `uv run python -m benchmarks.synthetic --patients 10 --out data/synthetic`
+(searchset Bundle per resource type) or `--format ndjson` (one NDJSON file
+per resource type, as produced by a bulk `$export`). Output streams to disk,
+so `--patients 1000 --cgm-days 3.5` (about a million Observations) does not
+have to fit in memory.
+"""
+import argparse
+import json
+import os
+import random
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, Optional
+
+LOINC = 'http://loinc.org'
+SNOMED = 'http://snomed.info/sct'
+RXNORM = 'http://www.nlm.nih.gov/research/umls/rxnorm'
+
+RESOURCE_TYPES = (
+    'Patient', 'Condition', 'Observation', 'MedicationRequest', 'Encounter',
+    'DiagnosticReport', 'RiskAssessment', 'CarePlan', 'Task',
+)
+
+CONDITIONS = (
+    ('44054006', 'Type 2 diabetes mellitus'),
+    ('38341003', 'Hypertensive disorder'),
+    ('55822004', 'Hyperlipidemia'),
+    ('431855005', 'Chronic kidney disease stage 1'),
+    ('127013003', 'Diabetic nephropathy'),
+    ('302866003', 'Hypoglycemia'),
+    ('162864005', 'Body mass index 30+ - obesity'),
+)
+MEDICATIONS = (
+    ('860975', 'Metformin hydrochloride 500 MG Oral Tablet'),
+    ('274783', 'Insulin glargine 100 UNT/ML Injectable Solution'),
+    ('310489', 'Glipizide 5 MG Oral Tablet'),
+    ('1545658', 'Empagliflozin 10 MG Oral Tablet'),
+    ('897122', 'Liraglutide 6 MG/ML Pen Injector'),
+    ('314076', 'Lisinopril 10 MG Oral Tablet'),
+    ('617310', 'Atorvastatin 20 MG Oral Tablet'),
+)
+LABS = (
+    # code, display, unit, mean, spread
+    ('2093-3', 'Cholesterol [Mass/volume] in Serum or Plasma', 'mg/dL', 195.0, 35.0),
+    ('2571-8', 'Triglyceride [Mass/volume] in Serum or Plasma', 'mg/dL', 160.0, 60.0),
+    ('2085-9', 'HDL Cholesterol', 'mg/dL', 45.0, 10.0),
+    ('18262-6', 'LDL Cholesterol [Mass/volume] in Serum or Plasma by Direct assay', 'mg/dL', 115.0, 30.0),
+    ('33914-3', 'Glomerular filtration rate/1.73 sq M.predicted', 'mL/min/{1.73_m2}', 70.0, 20.0),
+)
+HBA1C = ('4548-4', 'Hemoglobin A1c/Hemoglobin.total in Blood', '%')
+CGM_GLUCOSE = ('99504-3', 'Glucose [Mass/volume] in Interstitial fluid', 'mg/dL')
+GIVEN = ('Ada', 'Kwame', 'Mei', 'Tomas', 'Amara', 'Ivan', 'Priya', 'Sam', 'Noor', 'Lena')
+FAMILY = ('Okafor', 'Silva', 'Chen', 'Novak', 'Haddad', 'Larsen', 'Mensah', 'Rossi', 'Kim', 'Patel')
+
+
+def concept(system: str, code: str, display: str) -> dict:
+    return {'coding': [{'system': system, 'code': code, 'display': display}], 'text': display}
+
+def quantity(value: float, unit: str) -> dict:
+    return {'value': value, 'unit': unit, 'system': 'http://unitsofmeasure.org', 'code': unit}
+
+
+class PatientGenerator:
+    """Resources for one patient, deterministic for a given seed and index.
+
+    Each patient gets a glycaemic trajectory (baseline HbA1c and a yearly
+    drift) that the HbA1c series, CGM glucose and complications follow.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        years: int = 5,
+        cgm_days: float = 0.0,
+        cgm_interval_minutes: int = 5,
+        today: date = date(2025, 1, 1),
+    ):
+        """
+        Args:
+            seed: Base seed; patient `i` always gets the same resources.
+            years: Years of history before `today`.
+            cgm_days: Days of CGM readings per patient; dominates Observation volume.
+            cgm_interval_minutes: Minutes between CGM readings.
+            today: End of the generated history.
+        """
+        self.seed = seed
+        self.years = years
+        self.cgm_days = cgm_days
+        self.cgm_interval_minutes = cgm_interval_minutes
+        self.today = today
+
+    def _date(self, rng: random.Random, start: date) -> date:
+        return start + timedelta(days=rng.randint(0, max((self.today - start).days, 0)))
+
+    def resources(self, index: int) -> Iterator[dict]:
+        rng = random.Random(f'{self.seed}-{index}')
+        patient_id = f'patient-{index}'
+        subject = {'reference': f'Patient/{patient_id}'}
+        start = self.today - timedelta(days=365 * self.years)
+        baseline = rng.uniform(6.0, 10.5)
+        drift = rng.uniform(-0.4, 0.6)
+
+        yield {
+            'resourceType': 'Patient',
+            'id': patient_id,
+            'gender': rng.choice(('male', 'female')),
+            'birthDate': (self.today - timedelta(days=rng.randint(30 * 365, 85 * 365))).isoformat(),
+            'name': [{'use': 'official', 'prefix': [rng.choice(('Mr.', 'Ms.', 'Mx.'))], 'given': [rng.choice(GIVEN)], 'family': rng.choice(FAMILY)}],
+        }
+
+        conditions = [CONDITIONS[0]] + rng.sample(CONDITIONS[1:], rng.randint(0, 3))
+        if baseline + drift * self.years > 9.5 and CONDITIONS[5] not in conditions:
+            conditions.append(CONDITIONS[5])
+        for number, (code, display) in enumerate(conditions):
+            yield {
+                'resourceType': 'Condition',
+                'id': f'{patient_id}-condition-{number}',
+                'subject': subject,
+                'clinicalStatus': concept('http://terminology.hl7.org/CodeSystem/condition-clinical', 'active', 'Active'),
+                'code': concept(SNOMED, code, display),
+                'onsetDateTime': self._date(rng, start).isoformat(),
+            }
+
+        medications = [MEDICATIONS[0]] + rng.sample(MEDICATIONS[1:], rng.randint(0, 3))
+        for number, (code, display) in enumerate(medications):
+            yield {
+                'resourceType': 'MedicationRequest',
+                'id': f'{patient_id}-medication-request-{number}',
+                'status': 'active',
+                'intent': 'order',
+                'subject': subject,
+                'medicationCodeableConcept': concept(RXNORM, code, display),
+                'authoredOn': self._date(rng, start).isoformat(),
+            }
+
+        visits = sorted(self._date(rng, start) for _ in range(self.years * 3))
+        observation = 0
+        for number, visit in enumerate(visits):
+            encounter_id = f'{patient_id}-encounter-{number}'
+            yield {
+                'resourceType': 'Encounter',
+                'id': encounter_id,
+                'status': 'finished',
+                'class': {'system': 'http://terminology.hl7.org/CodeSystem/v3-ActCode', 'code': 'AMB'},
+                'type': [concept(SNOMED, '185349003', 'Encounter for check up')],
+                'subject': subject,
+                'period': {'start': f'{visit.isoformat()}T09:00:00Z', 'end': f'{visit.isoformat()}T09:30:00Z'},
+            }
+            years_in = (visit - start).days / 365
+            results = []
+            hba1c = round(min(max(baseline + drift * years_in + rng.gauss(0, 0.3), 4.8), 14.0), 1)
+            labs = [(HBA1C[0], HBA1C[1], HBA1C[2], hba1c)]
+            if number % 3 == 0:
+                for code, display, unit, mean, spread in LABS:
+                    labs.append((code, display, unit, round(max(rng.gauss(mean, spread), 1.0), 1)))
+            for code, display, unit, value in labs:
+                observation_id = f'{patient_id}-observation-{observation}'
+                observation += 1
+                results.append({'reference': f'Observation/{observation_id}'})
+                yield {
+                    'resourceType': 'Observation',
+                    'id': observation_id,
+                    'status': 'final',
+                    'category': [concept('http://terminology.hl7.org/CodeSystem/observation-category', 'laboratory', 'Laboratory')],
+                    'code': concept(LOINC, code, display),
+                    'subject': subject,
+                    'encounter': {'reference': f'Encounter/{encounter_id}'},
+                    'effectiveDateTime': f'{visit.isoformat()}T09:15:00Z',
+                    'valueQuantity': quantity(value, unit),
+                }
+            yield {
+                'resourceType': 'DiagnosticReport',
+                'id': f'{patient_id}-diagnostic-report-{number}',
+                'status': 'final',
+                'code': concept(LOINC, '24323-8', 'Comprehensive metabolic 2000 panel - Serum or Plasma'),
+                'subject': subject,
+                'encounter': {'reference': f'Encounter/{encounter_id}'},
+                'effectiveDateTime': f'{visit.isoformat()}T09:15:00Z',
+                'result': results,
+            }
+
+        readings = int(self.cgm_days * 24 * 60 / self.cgm_interval_minutes)
+        # Mean glucose from the latest HbA1c (ADAG: eAG = 28.7 * A1c - 46.7)
+        mean_glucose = 28.7 * (baseline + drift * self.years) - 46.7
+        when = datetime.combine(self.today, datetime.min.time()) - timedelta(days=self.cgm_days)
+        for reading in range(readings):
+            when += timedelta(minutes=self.cgm_interval_minutes)
+            hour = when.hour + when.minute / 60
+            # Post-meal peaks around 08:00, 13:00 and 19:00
+            meals = sum(45 * max(0.0, 1 - abs(hour - meal) / 2) for meal in (8, 13, 19))
+            value = round(max(mean_glucose - 20 + meals + rng.gauss(0, 15), 40.0))
+            yield {
+                'resourceType': 'Observation',
+                'id': f'{patient_id}-cgm-{reading}',
+                'status': 'final',
+                'code': concept(LOINC, *CGM_GLUCOSE[:2]),
+                'subject': subject,
+                'effectiveDateTime': when.isoformat() + 'Z',
+                'valueQuantity': quantity(value, CGM_GLUCOSE[2]),
+                'device': {'display': 'Continuous glucose monitor'},
+            }
+
+        yield {
+            'resourceType': 'RiskAssessment',
+            'id': f'{patient_id}-risk-assessment-0',
+            'status': 'final',
+            'subject': subject,
+            'occurrenceDateTime': visits[-1].isoformat() if visits else self.today.isoformat(),
+            'prediction': [{
+                'outcome': concept(SNOMED, '127013003', 'Diabetic nephropathy'),
+                'probabilityDecimal': round(min(max((baseline - 6) / 10 + rng.uniform(0, 0.2), 0.01), 0.95), 2),
+            }],
+        }
+        yield {
+            'resourceType': 'CarePlan',
+            'id': f'{patient_id}-care-plan-0',
+            'status': 'active',
+            'intent': 'plan',
+            'subject': subject,
+            'category': [concept(SNOMED, '698360004', 'Diabetes self management plan')],
+            'period': {'start': start.isoformat()},
+        }
+        for number in range(rng.randint(0, 3)):
+            yield {
+                'resourceType': 'Task',
+                'id': f'{patient_id}-task-{number}',
+                'status': 'accepted',
+                'intent': 'order',
+                'description': rng.choice((
+                    'Schedule retinal screening',
+                    'Repeat HbA1c in 3 months',
+                    'Refer to diabetes educator',
+                    'Order urine albumin-to-creatinine ratio',
+                )),
+                'for': subject,
+                'focus': {'reference': f'ServiceRequest/{patient_id}-service-request-{number}'},
+                'meta': {'versionId': '1'},
+            }
+
+
+def generate(patients: int, seed: int = 0, **kwargs) -> Iterator[dict]:
+    """Resources of `patients` synthetic patients; kwargs go to `PatientGenerator`."""
+    generator = PatientGenerator(seed, **kwargs)
+    for index in range(patients):
+        yield from generator.resources(index)
+
+def write(resources: Iterator[dict], out: str, format: str = 'bundle') -> Dict[str, int]:
+    """Stream resources to one file per resource type.
+
+    Args:
+        resources: Resources to write.
+        out: Output directory.
+        format: `bundle` for `<Type>.json` searchset Bundles, `ndjson` for `<Type>.ndjson`.
+
+    Returns:
+        Resource type -> number of resources written.
+    """
+    os.makedirs(out, exist_ok=True)
+    files, counts = {}, {}
+    try:
+        for resource in resources:
+            resource_type = resource['resourceType']
+            file = files.get(resource_type)
+            if file is None:
+                extension = 'ndjson' if format == 'ndjson' else 'json'
+                file = files[resource_type] = open(os.path.join(out, f'{resource_type}.{extension}'), 'w')
+                counts[resource_type] = 0
+                if format != 'ndjson':
+                    file.write('{"resourceType": "Bundle", "type": "searchset", "entry": [\n')
+            if format == 'ndjson':
+                file.write(json.dumps(resource, separators=(',', ':')) + '\n')
+            else:
+                file.write((',\n' if counts[resource_type] else '') + json.dumps({'resource': resource}))
+            counts[resource_type] += 1
+    finally:
+        for resource_type, file in files.items():
+            if format != 'ndjson':
+                file.write(f'\n], "total": {counts[resource_type]}}}\n')
+            file.close()
+    return counts
+
+def load(path: str) -> Iterator[dict]:
+    """Resources from a directory written by `write`, or from a single Bundle/NDJSON file."""
+    paths = [os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+    for file_path in paths:
+        with open(file_path) as file:
+            if file_path.endswith('.ndjson'):
+                for line in file:
+                    if line.strip():
+                        yield json.loads(line)
+            elif file_path.endswith('.json'):
+                data = json.load(file)
+                if data.get('resourceType') == 'Bundle':
+                    yield from (entry['resource'] for entry in data.get('entry', []))
+                else:
+                    yield data
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--patients', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--years', type=int, default=5, help='Years of visit history per patient')
+    parser.add_argument('--cgm-days', type=float, default=0.0, help='Days of 5-minute CGM readings per patient')
+    parser.add_argument('--format', choices=('bundle', 'ndjson'), default='bundle')
+    parser.add_argument('--out', default='data/synthetic')
+    args = parser.parse_args(argv)
+    counts = write(
+        generate(args.patients, args.seed, years=args.years, cgm_days=args.cgm_days),
+        args.out,
+        args.format
+    )
+    for resource_type in RESOURCE_TYPES:
+        if resource_type in counts:
+            print(f'{resource_type:<18} {counts[resource_type]:>10}')
+
+
+if __name__ == '__main__':
+    main()
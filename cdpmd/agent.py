@@ -1,35 +1,382 @@
 from pprint import pprint
 import os
 import functools
+import hashlib
 import json
+import asyncio
+import heapq
+import itertools
+import re
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
 
+import httpx
+import logfire
+from openai import APIStatusError, AsyncOpenAI
 from pydantic_ai import Agent, RunContext, Tool
 from pydantic_ai.models.gemini import GeminiModel
 from pydantic_ai.models.openai import OpenAIModel
+from pydantic_ai._agent_graph import ModelRequestNode
+from pydantic_graph import End
 
-from cdpmd.schemas import ResourceType, PredictorAgentResponseSchema
-from cdpmd.utils import AsyncCache
+from cdpmd.schemas import (
+    ResourceType, PredictorAgentResponseSchema, Priority,
+    BatchPredictorAgentResponseSchema, LLMCallRecord
+)
+from cdpmd.utils import AsyncCache, generate_clinical_summary
+from cdpmd.metrics import stage, add_collector, Gauge, Histogram, Counter
+from cdpmd.cassette import cassette_transport
+from cdpmd.offload import run_cpu, OFFLOAD_MIN_ITEMS
+
+
+class RateLimitedError(Exception):
+    """Raised when the provider keeps answering 429 after all retries."""
+
+
+class LLMScheduler:
+    """Central gate for every `cdpmd_agent` run.
+
+    Requests wait in a priority queue (interactive before prefetch before
+    batch) and are released while the global concurrency limit and the
+    tokens-per-minute budget allow. Rate-limit headers seen on provider
+    responses pause dispatching until the provider says it is safe again.
+    """
+
+    _RANKS = {
+        Priority.interactive: 0,
+        Priority.prefetch: 1,
+        Priority.batch: 2,
+    }
+    _DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+    _UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        tokens_per_minute: Optional[int] = None,
+        max_retries: int = 3,
+        completion_tokens: int = 1500,
+    ):
+        """
+        Args:
+            max_concurrency: Maximum number of runs in flight at once.
+            tokens_per_minute: Token budget over a sliding 60s window.
+                None means no budget.
+            max_retries: Retries for a run rejected with HTTP 429.
+            completion_tokens: Completion size assumed when reserving budget.
+        """
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.tokens_per_minute = int(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = int(max_retries)
+        self.completion_tokens = completion_tokens
+        self._queue: list = []
+        self._counter = itertools.count()
+        self._in_flight = 0
+        self._window: deque = deque()
+        self._backoff_until = 0.0
+        self._backoff_streak = 0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self.metrics: Dict[str, Dict[str, float]] = {
+            priority.value: {
+                'requests': 0,
+                'wait_seconds_total': 0.0,
+                'wait_seconds_max': 0.0,
+                'rate_limited': 0,
+            } for priority in Priority
+        }
+
+    # Public API ---------------------------------------------------------------
+    async def run(
+        self,
+        agent: Agent,
+        prompt: str,
+        priority: Priority = Priority.interactive,
+        record: Optional[LLMCallRecord] = None,
+        **kwargs
+    ):
+        """Run `agent` with `prompt` once the scheduler grants a slot.
+
+        Timings, token usage and retries are written to `record` when given.
+        """
+        estimate = self.estimate_tokens(prompt) + self.completion_tokens
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.perf_counter()
+            entry = await self._acquire(priority, estimate)
+            if record:
+                record.queue_seconds += time.perf_counter() - queued_at
+            try:
+                with stage('llm.model', priority=priority.value, attempt=attempt):
+                    result = await self._run_streamed(agent, prompt, record, **kwargs)
+            except APIStatusError as e:
+                if e.status_code != 429:
+                    raise
+                self.metrics[priority.value]['rate_limited'] += 1
+                if record:
+                    record.rate_limit_retries += 1
+                self._back_off(e.response.headers)
+                if attempt == self.max_retries:
+                    raise RateLimitedError(
+                        f'LLM provider rate limit persisted after {self.max_retries} retries'
+                    ) from e
+            else:
+                self._backoff_streak = 0
+                entry[1] = result.usage().total_tokens or estimate
+                return result
+            finally:
+                self._release()
+
+    async def _run_streamed(self, agent: Agent, prompt: str, record: Optional[LLMCallRecord], **kwargs):
+        """`agent.run` with each model request streamed, so the first token can be timed."""
+        started = time.perf_counter()
+        async with agent.iter(prompt, **kwargs) as agent_run:
+            node = agent_run.next_node
+            while not isinstance(node, End):
+                if isinstance(node, ModelRequestNode):
+                    request_started = time.perf_counter()
+                    async with node.stream(agent_run.ctx) as stream:
+                        async for _ in stream:
+                            if record and record.time_to_first_token is None:
+                                record.time_to_first_token = time.perf_counter() - started
+                    if record:
+                        elapsed = time.perf_counter() - request_started
+                        # Requests after the first are result validation retries
+                        if record.model_requests == 0:
+                            record.model_seconds = elapsed
+                        else:
+                            record.retry_seconds += elapsed
+                        record.model_requests += 1
+                node = await agent_run.next(node)
+        return agent_run.result
+
+    async def observe_response(self, response: httpx.Response):
+        """httpx response hook feeding provider rate-limit headers back into dispatching."""
+        headers = response.headers
+        if response.status_code == 429:
+            self._back_off(headers)
+            return
+        remaining = headers.get('x-ratelimit-remaining-tokens') or headers.get('x-ratelimit-remaining-requests')
+        if remaining is not None and remaining.isdigit() and int(remaining) == 0:
+            reset = self._parse_reset(headers)
+            if reset:
+                self._pause(reset)
+
+    def snapshot(self) -> dict:
+        """Current queue depth per priority plus cumulative wait statistics."""
+        depth = {priority.value: 0 for priority in Priority}
+        for _, _, priority, _, _, _ in self._queue:
+            depth[priority.value] += 1
+        return {
+            'in_flight': self._in_flight,
+            'queue_depth': depth,
+            'tokens_last_minute': self._tokens_in_window(time.monotonic()),
+            'backoff_seconds': max(0.0, self._backoff_until - time.monotonic()),
+            'priorities': self.metrics,
+        }
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Rough token count (~4 characters per token)."""
+        return len(text) // 4 + 1
+
+    # Dispatching --------------------------------------------------------------
+    async def _acquire(self, priority: Priority, estimate: int) -> list:
+        future = asyncio.get_running_loop().create_future()
+        enqueued_at = time.monotonic()
+        heapq.heappush(
+            self._queue,
+            (self._RANKS[priority], next(self._counter), priority, estimate, enqueued_at, future)
+        )
+        self._dispatch()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()
+            else:
+                self._queue = [item for item in self._queue if item[-1] is not future]
+                heapq.heapify(self._queue)
+            raise
+
+    def _dispatch(self):
+        now = time.monotonic()
+        delay = None
+        while self._queue and self._in_flight < self.max_concurrency:
+            rank, _, priority, estimate, enqueued_at, future = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            if now < self._backoff_until:
+                delay = self._backoff_until - now
+                break
+            # Keep the last free slot for clinicians waiting on a page
+            if rank > 0 and self._in_flight >= self.max_concurrency - 1 and self.max_concurrency > 1:
+                break
+            used = self._tokens_in_window(now)
+            if self.tokens_per_minute and used and used + estimate > self.tokens_per_minute:
+                delay = self._window[0][0] + 60 - now
+                break
+            heapq.heappop(self._queue)
+            entry = [now, estimate]
+            self._window.append(entry)
+            self._in_flight += 1
+            waited = now - enqueued_at
+            stats = self.metrics[priority.value]
+            stats['requests'] += 1
+            stats['wait_seconds_total'] += waited
+            stats['wait_seconds_max'] = max(stats['wait_seconds_max'], waited)
+            logfire.info(
+                'llm scheduler dispatch',
+                priority=priority.value,
+                wait_seconds=waited,
+                queue_depth=len(self._queue)
+            )
+            future.set_result(entry)
+        if delay is not None and self._wakeup is None:
+            self._wakeup = asyncio.get_running_loop().call_later(max(delay, 0.01), self._wake)
+
+    def _wake(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def _release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    def _tokens_in_window(self, now: float) -> int:
+        while self._window and self._window[0][0] < now - 60:
+            self._window.popleft()
+        return sum(tokens for _, tokens in self._window)
 
+    # Back-off -----------------------------------------------------------------
+    def _back_off(self, headers: httpx.Headers):
+        self._backoff_streak += 1
+        fallback = min(2 ** self._backoff_streak, 60)
+        self._pause(self._parse_reset(headers) or fallback)
+
+    def _pause(self, seconds: float):
+        until = time.monotonic() + seconds
+        if until > self._backoff_until:
+            self._backoff_until = until
+            logfire.warn('llm scheduler backing off', seconds=seconds)
+
+    def _parse_reset(self, headers: httpx.Headers) -> Optional[float]:
+        if 'retry-after-ms' in headers:
+            try:
+                return float(headers['retry-after-ms']) / 1000
+            except ValueError:
+                pass
+        if 'retry-after' in headers:
+            try:
+                return float(headers['retry-after'])
+            except ValueError:
+                pass
+        resets = [
+            self._parse_duration(headers[name])
+            for name in ('x-ratelimit-reset-tokens', 'x-ratelimit-reset-requests')
+            if name in headers
+        ]
+        resets = [reset for reset in resets if reset]
+        return max(resets) if resets else None
+
+    def _parse_duration(self, value: str) -> Optional[float]:
+        parts = self._DURATION.findall(value)
+        if not parts:
+            return None
+        return sum(float(amount) * self._UNITS[unit] for amount, unit in parts)
+
+
+scheduler = LLMScheduler(
+    max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', 4)),
+    tokens_per_minute=os.getenv('LLM_TOKENS_PER_MINUTE'),
+    max_retries=int(os.getenv('LLM_MAX_RETRIES', 3)),
+)
+
+class LLMCallLog:
+    """Recent LLM call records, queryable per patient."""
+
+    def __init__(self, max_records: int = 10000, log_file: Optional[str] = None):
+        """
+        Args:
+            max_records: Records kept in memory; older ones are dropped.
+            log_file: Optional JSON-lines file every record is appended to.
+        """
+        self.records: deque = deque(maxlen=max_records)
+        self.log_file = log_file
+
+    def add(self, record: LLMCallRecord):
+        self.records.append(record)
+        for phase in ('time_to_first_token', 'model_seconds', 'retry_seconds', 'total_seconds'):
+            value = getattr(record, phase)
+            if value is not None and record.cache_outcome == 'miss':
+                LLM_CALL_SECONDS.observe(value, phase=phase)
+        LLM_TOKENS.inc(record.input_tokens or 0, direction='input')
+        LLM_TOKENS.inc(record.output_tokens or 0, direction='output')
+        LLM_CALLS.inc(cache_outcome=record.cache_outcome)
+        logfire.info('llm call {patient_id} ({cache_outcome})', **record.model_dump())
+        if self.log_file:
+            with open(self.log_file, 'a') as file:
+                file.write(record.model_dump_json() + '\n')
+
+    def query(self, patient_id: Optional[str] = None, limit: int = 100) -> List[LLMCallRecord]:
+        """Most recent records first, optionally for one patient."""
+        records = [record for record in reversed(self.records) if patient_id is None or record.patient_id == patient_id]
+        return records[:limit]
+
+LLM_CALL_SECONDS = Histogram('cdpmd_llm_call_seconds', 'LLM call latency by phase.', ('phase',))
+LLM_TOKENS = Counter('cdpmd_llm_tokens_total', 'LLM tokens used.', ('direction',))
+LLM_CALLS = Counter('cdpmd_llm_calls_total', 'Predictor queries by cache outcome.', ('cache_outcome',))
+llm_calls = LLMCallLog(int(os.getenv('LLM_TELEMETRY_RECORDS', 10000)), os.getenv('LLM_TELEMETRY_FILE'))
+
+
+def _collect_scheduler_metrics():
+    snapshot = scheduler.snapshot()
+    LLM_IN_FLIGHT.set(snapshot['in_flight'])
+    for priority, depth in snapshot['queue_depth'].items():
+        LLM_QUEUE_DEPTH.set(depth, priority=priority)
+    for priority, stats in snapshot['priorities'].items():
+        LLM_WAIT_SECONDS.set(stats['wait_seconds_total'], priority=priority)
+        LLM_RATE_LIMITED.set(stats['rate_limited'], priority=priority)
+
+LLM_IN_FLIGHT = Gauge('cdpmd_llm_in_flight', 'LLM runs currently in flight.')
+LLM_QUEUE_DEPTH = Gauge('cdpmd_llm_queue_depth', 'LLM runs waiting for the scheduler.', ('priority',))
+LLM_WAIT_SECONDS = Gauge('cdpmd_llm_wait_seconds', 'Cumulative scheduler wait time.', ('priority',))
+LLM_RATE_LIMITED = Gauge('cdpmd_llm_rate_limited', 'LLM runs rejected with HTTP 429.', ('priority',))
+add_collector(_collect_scheduler_metrics)
 
 cache = AsyncCache(ttl=os.getenv('CACHE_TTL'))
+# Last full or delta analysis per patient, kept past CACHE_TTL for incremental re-analysis
+analysis_cache = AsyncCache(os.getenv('ANALYSIS_CACHE_TTL') or None, 'analysis_cache.json')
+INCREMENTAL_ANALYSIS = os.getenv('INCREMENTAL_ANALYSIS', 'true').lower() == 'true'
+INCREMENTAL_MAX_DELTA = float(os.getenv('INCREMENTAL_MAX_DELTA', 0.2))
 model = OpenAIModel(
     'deepseek-chat',
     base_url=os.getenv('DEEPSEEK_BASE_URL'),
-    api_key=os.getenv('DEEPSEEK_API_KEY')
+    api_key=os.getenv('DEEPSEEK_API_KEY'),
+    http_client=httpx.AsyncClient(
+        timeout=httpx.Timeout(600.0),
+        event_hooks={'response': [scheduler.observe_response]},
+        transport=cassette_transport('llm')
+    )
+)
+SYSTEM_PROMPT = (
+    "You are an advanced predictive decision support intervention model designed specifically for diabetes management and treatment. "
+    "Your role is to assist healthcare providers by analyzing patient data, generating insights, and recommending evidence-based interventions. "
+    "Ensure your responses are accurate, concise, and tailored to the clinical context. "
+    "When making recommendations, prioritize guidelines from recognized medical authorities such as the ADA (American Diabetes Association). "
+    "Always verify the availability and relevance of patient data before providing recommendations."
 )
 cdpmd_agent = Agent(
     model,
     result_type=PredictorAgentResponseSchema,
-    system_prompt=(
-        "You are an advanced predictive decision support intervention model designed specifically for diabetes management and treatment. "
-        "Your role is to assist healthcare providers by analyzing patient data, generating insights, and recommending evidence-based interventions. "
-        "Ensure your responses are accurate, concise, and tailored to the clinical context. "
-        "When making recommendations, prioritize guidelines from recognized medical authorities such as the ADA (American Diabetes Association). "
-        "Always verify the availability and relevance of patient data before providing recommendations."
-    )
+    system_prompt=SYSTEM_PROMPT
+)
+batch_agent = Agent(
+    model,
+    result_type=BatchPredictorAgentResponseSchema,
+    system_prompt=SYSTEM_PROMPT
 )
 
-@cache
 async def predictor_query(
     patient: dict,
     conditions: dict,
@@ -39,22 +386,127 @@ async def predictor_query(
     diagnosticReports: dict,
     riskAssessments: dict,
     carePlans: dict,
+    priority: Priority = Priority.interactive,
+    shared: bool = True,
 ) -> dict:
-    result = await cdpmd_agent.run(
-        f"""Act as an advanced predictive model for diabetes progression. Analyze the patient's 
+    """Predict for a patient's resources.
+
+    With `shared` False, the per-patient prediction and analysis caches are
+    neither read nor written, for inputs that do not come from the
+    clinician's own FHIR session.
+    """
+    record = LLMCallRecord(patient_id=(patient or {}).get('id'), priority=priority.value)
+    started = time.perf_counter()
+    query = _predictor_query if shared else _predictor_query.__wrapped__
+    try:
+        return await query(
+            patient,
+            conditions,
+            medications,
+            observations,
+            encounters,
+            diagnosticReports,
+            riskAssessments,
+            carePlans,
+            priority=priority,
+            record=record,
+            incremental=shared and INCREMENTAL_ANALYSIS
+        )
+    finally:
+        record.total_seconds = time.perf_counter() - started
+        llm_calls.add(record)
+
+@cache
+async def _predictor_query(
+    patient: dict,
+    conditions: dict,
+    medications: dict,
+    observations: dict,
+    encounters: dict,
+    diagnosticReports: dict,
+    riskAssessments: dict,
+    carePlans: dict,
+    priority: Priority = Priority.interactive,
+    record: Optional[LLMCallRecord] = None,
+    incremental: bool = INCREMENTAL_ANALYSIS,
+) -> dict:
+    inputs = {
+        'patient': [patient] if patient else [],
+        'conditions': conditions or [],
+        'observations': observations or [],
+        'medications': medications or [],
+        'encounters': encounters or [],
+        'diagnosticReports': diagnosticReports or [],
+        'riskAssessments': riskAssessments or [],
+        'carePlans': carePlans or [],
+    }
+    size = sum(len(resources) for resources in inputs.values())
+    fingerprints = await run_cpu(fingerprint_resources, inputs, size=size, threshold=OFFLOAD_MIN_ITEMS)
+    previous = analysis_cache.get(patient['id']) if incremental else None
+    delta = resource_delta(previous['fingerprints'], fingerprints, inputs) if previous else None
+    changed = sum(len(changes['changed']) + len(changes['removed']) for changes in delta.values()) if delta else None
+    if record:
+        record.cache_outcome = 'miss'
+        record.changed_resources = changed
+
+    if delta is not None and changed == 0:
+        if record:
+            record.analysis = 'unchanged'
+        return previous['response']
+    if delta is not None and changed <= INCREMENTAL_MAX_DELTA * max(size, 1):
+        sections = {
+            name: str(changes) for name, changes in delta.items() if changes['changed'] or changes['removed']
+        }
+        prompt = DELTA_PROMPT.format(
+            previous=json.dumps(previous['response']),
+            changes='\n'.join(f'- {name} = {text}' for name, text in sections.items())
+        )
+        analysis = 'delta'
+    else:
+        sections = {
+            'patient': str(patient),
+            'conditions': str(conditions),
+            'observations': str(observations),
+            'medications': str(medications),
+            'encounters': str(encounters),
+            'diagnosticReports': str(diagnosticReports),
+            'riskAssessments': str(riskAssessments),
+            'carePlans': str(carePlans),
+        }
+        prompt = full_prompt(sections)
+        analysis = 'full'
+    if record:
+        record.analysis = analysis
+        record.prompt_chars = len(prompt)
+        record.prompt_tokens_estimate = scheduler.estimate_tokens(prompt)
+        record.section_chars = {name: len(text) for name, text in sections.items()}
+        record.section_tokens_estimate = {name: scheduler.estimate_tokens(text) for name, text in sections.items()}
+    result = await scheduler.run(cdpmd_agent, prompt, priority=priority, record=record)
+    if record:
+        usage = result.usage()
+        record.input_tokens = usage.request_tokens
+        record.output_tokens = usage.response_tokens
+    response = result.data.dict()
+    if incremental:
+        await analysis_cache.put_async(patient['id'], {'fingerprints': fingerprints, 'response': response})
+    return response
+
+def full_prompt(sections: Dict[str, str]) -> str:
+    """Prompt for a full analysis of one patient's record, one text per section."""
+    return f"""Act as an advanced predictive model for diabetes progression. Analyze the patient's 
         clinical data and produce an integrated risk and treatment recommendation report based 
         on ADA/EASD guidelines.
 
         Using the provided data below, perform the following tasks without using any formatting 
         or bullet points::
-        - Patient Details = {patient}
-        - Conditions = {conditions}
-        - Observations = {observations}
-        - medications = {medications}
-        - encounters = {encounters}
-        - diagnosticReports = {diagnosticReports}
-        - riskAssessments = {riskAssessments}
-        - carePlans = {carePlans}
+        - Patient Details = {sections['patient']}
+        - Conditions = {sections['conditions']}
+        - Observations = {sections['observations']}
+        - medications = {sections['medications']}
+        - encounters = {sections['encounters']}
+        - diagnosticReports = {sections['diagnosticReports']}
+        - riskAssessments = {sections['riskAssessments']}
+        - carePlans = {sections['carePlans']}
 
         First, generate a concise clinical summary that highlights three to five key observations 
         regarding the patient's current glycemic control, trends in HbA1c and continuous glucose 
@@ -67,5 +519,189 @@ async def predictor_query(
         if filled, could enhance the accuracy of predictions and decision support. Base your recommendations 
         on specific patient data points referenced from the supplied data, and integrate social determinants 
         of health where available to ensure a personalized analysis."""
+
+DELTA_PROMPT = """Act as an advanced predictive model for diabetes progression. You previously produced
+the risk and treatment recommendation report below for this patient, based on ADA/EASD guidelines.
+Since then only the resources listed under changes were added, modified or removed; everything
+else in the record is unchanged. Update the report to reflect these changes, without using any
+formatting or bullet points: revise the clinical summary, risk stratification, intervention plan
+and data gaps where the new data affects them, keep the cards that still hold unchanged, and
+return the complete updated report.
+
+Previous report = {previous}
+
+Changes:
+{changes}"""
+
+def _resource_key(resource: dict, index: int) -> str:
+    return f"{resource.get('resourceType')}/{resource.get('id', f'#{index}')}"
+
+def fingerprint_resources(inputs: Dict[str, List[dict]]) -> Dict[str, Dict[str, str]]:
+    """Content hash of every resource, keyed by section and `<resourceType>/<id>`."""
+    return {
+        name: {
+            _resource_key(resource, index): hashlib.sha1(
+                json.dumps(resource, sort_keys=True, default=str).encode()
+            ).hexdigest()
+            for index, resource in enumerate(resources)
+        }
+        for name, resources in inputs.items()
+    }
+
+def resource_delta(
+    previous: Dict[str, Dict[str, str]],
+    current: Dict[str, Dict[str, str]],
+    inputs: Dict[str, List[dict]]
+) -> Dict[str, dict]:
+    """Per section, the resources added or modified since `previous` and the keys removed."""
+    delta = {}
+    for name, fingerprints in current.items():
+        before = previous.get(name, {})
+        delta[name] = {
+            'changed': [
+                resource for index, resource in enumerate(inputs[name])
+                if before.get(_resource_key(resource, index)) != fingerprints[_resource_key(resource, index)]
+            ],
+            'removed': [key for key in before if key not in fingerprints],
+        }
+    return delta
+
+BATCH_PROMPT = """Act as an advanced predictive model for diabetes progression. For every patient
+below, produce an integrated risk and treatment recommendation report based on ADA/EASD
+guidelines, written without any formatting or bullet points. Each patient is introduced by
+its id followed by a compact clinical summary. Return exactly one report per patient and
+copy the patient id verbatim into `patient_id`. For each patient highlight the key findings on
+glycemic control and comorbidities, stratify acute and chronic complication risk, propose an
+evidence-based intervention plan and name the data gaps that would improve the prediction.
+
+{patients}"""
+
+
+async def compact_patient_summary(
+    patient: dict,
+    conditions: list,
+    observations: list,
+    medications: list,
+    encounters: list,
+    diagnostic_reports: list,
+    risk_assessments: list,
+    care_plans: list,
+) -> str:
+    """Condense one `get_resources` record into the short text used for batch prompts."""
+    return await generate_clinical_summary({
+        'patient': patient or {},
+        'conditions': {'entry': conditions or []},
+        'medications': {'entry': medications or []},
+        'observations': {'entry': observations or []},
+        'encounters': encounters or [],
+        'diagnosticReports': diagnostic_reports or [],
+        'riskAssessments': risk_assessments or [],
+        'carePlans': care_plans or [],
+    })
+
+
+async def predictor_batch_query(
+    records: List[list],
+    batch_size: int = int(os.getenv('LLM_BATCH_SIZE', 10)),
+    use_batch_api: bool = os.getenv('LLM_BATCH_API', 'false').lower() == 'true',
+    client: Optional[AsyncOpenAI] = None,
+    priority: Priority = Priority.batch,
+) -> Dict[str, PredictorAgentResponseSchema]:
+    """Score many patients with one LLM request per `batch_size` patients.
+
+    Args:
+        records: `get_resources` results, one per patient.
+        batch_size: Number of patient summaries packed into each request.
+        use_batch_api: Submit the requests through an OpenAI-compatible
+            `/v1/batches` endpoint instead of calling the model directly.
+        client: OpenAI client used for the batch endpoint. Defaults to one
+            built from `LLM_BATCH_BASE_URL` (falling back to the DeepSeek settings).
+        priority: Scheduler priority for direct calls.
+
+    Returns:
+        Response per patient id; patients the model skipped are absent.
+        Every returned response is also stored in the `predictor_query` cache.
+    """
+    summaries = {}
+    for record in records:
+        patient = record[0] or {}
+        if patient.get('id'):
+            summaries[patient['id']] = await compact_patient_summary(*record)
+    ids = list(summaries)
+    chunks = [
+        BATCH_PROMPT.format(patients='\n'.join(
+            f'Patient {patient_id}: {summaries[patient_id]}' for patient_id in ids[i:i + batch_size]
+        ))
+        for i in range(0, len(ids), batch_size)
+    ]
+
+    if use_batch_api:
+        batches = await _run_batch_endpoint(chunks, client)
+    else:
+        results = await asyncio.gather(*[
+            scheduler.run(batch_agent, prompt, priority=priority) for prompt in chunks
+        ])
+        batches = [result.data for result in results]
+
+    responses = {}
+    for batch in batches:
+        for report in batch.reports:
+            if report.patient_id in summaries:
+                responses[report.patient_id] = PredictorAgentResponseSchema(cards=report.cards)
+    # One save for the whole cohort; the cache file holds every patient
+    await cache.put_many_async({patient_id: response.dict() for patient_id, response in responses.items()})
+    return responses
+
+
+async def _run_batch_endpoint(
+    prompts: List[str],
+    client: Optional[AsyncOpenAI] = None,
+    poll_interval: float = float(os.getenv('LLM_BATCH_POLL_INTERVAL', 30)),
+) -> List[BatchPredictorAgentResponseSchema]:
+    client = client or AsyncOpenAI(
+        base_url=os.getenv('LLM_BATCH_BASE_URL') or os.getenv('DEEPSEEK_BASE_URL'),
+        api_key=os.getenv('LLM_BATCH_API_KEY') or os.getenv('DEEPSEEK_API_KEY')
+    )
+    schema = json.dumps(BatchPredictorAgentResponseSchema.model_json_schema())
+    lines = [
+        json.dumps({
+            'custom_id': f'chunk-{i}',
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': {
+                'model': model.model_name,
+                'response_format': {'type': 'json_object'},
+                'messages': [
+                    {'role': 'system', 'content': f'{SYSTEM_PROMPT} Reply with JSON matching this schema: {schema}'},
+                    {'role': 'user', 'content': prompt},
+                ],
+            },
+        }) for i, prompt in enumerate(prompts)
+    ]
+    input_file = await client.files.create(
+        file=('cdpmd-batch.jsonl', '\n'.join(lines).encode()),
+        purpose='batch'
     )
-    return result.data.dict()
+    batch = await client.batches.create(
+        input_file_id=input_file.id,
+        endpoint='/v1/chat/completions',
+        completion_window='24h'
+    )
+    while batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+    if batch.status != 'completed' or not batch.output_file_id:
+        raise RuntimeError(f'LLM batch {batch.id} finished with status {batch.status}')
+
+    output = await client.files.content(batch.output_file_id)
+    results = []
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        try:
+            content = item['response']['body']['choices'][0]['message']['content']
+            results.append(BatchPredictorAgentResponseSchema.model_validate_json(content))
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            print(f"LLM batch result {item.get('custom_id')} skipped: {e}")
+    return results
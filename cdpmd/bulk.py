@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+import httpx
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from cdpmd.schemas import ResourceType
+from cdpmd.fhir_client import FHIRClient
+from cdpmd.fhirpath import index_fields
+from cdpmd.offload import run_cpu, OFFLOAD_MIN_ITEMS
+from cdpmd.utils import patient_id_of, FHIR_DATA_TYPES
+
+
+BULK_DIR = os.getenv('BULK_DIR', 'bulk')
+BULK_BATCH_ROWS = int(os.getenv('BULK_BATCH_ROWS', 50000))
+BULK_POLL_INTERVAL = float(os.getenv('BULK_POLL_INTERVAL', 10))
+BULK_TYPES = tuple(FHIR_DATA_TYPES.values()) + (ResourceType.task.value,)
+
+COLUMNS = ('id', 'patient_id', 'date', 'code', 'value', 'unit', 'resource')
+
+
+class BulkExportError(Exception):
+    """Raised when the server rejects or fails a `$export`."""
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('Bulk ingestion needs pyarrow; install the bulk extra with `uv sync --extra bulk` (or `pip install cdpmd[bulk]`).')
+
+def _columns(lines: List[str]) -> Dict[str, list]:
+    """Parse NDJSON lines into the store's columns."""
+    columns = {name: [] for name in COLUMNS}
+    for line in lines:
+        resource = json.loads(line)
+        date, code = index_fields(resource)
+        quantity = resource.get('valueQuantity') or {}
+        columns['id'].append(resource.get('id'))
+        columns['patient_id'].append(patient_id_of(resource))
+        columns['date'].append(date)
+        columns['code'].append(code)
+        columns['value'].append(float(quantity['value']) if quantity.get('value') is not None else None)
+        columns['unit'].append(quantity.get('unit'))
+        columns['resource'].append(line)
+    return columns
+
+def _write_part(path: str, lines: List[str]) -> int:
+    columns = _columns(lines)
+    table = pa.table({
+        'id': pa.array(columns['id'], pa.string()),
+        'patient_id': pa.array(columns['patient_id'], pa.string()),
+        'date': pa.array(columns['date'], pa.string()),
+        'code': pa.array(columns['code'], pa.string()),
+        'value': pa.array(columns['value'], pa.float64()),
+        'unit': pa.array(columns['unit'], pa.string()),
+        'resource': pa.array(columns['resource'], pa.string()),
+    })
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, path + '.tmp', compression='zstd')
+    os.replace(path + '.tmp', path)
+    return table.num_rows
+
+
+class ColumnarStore:
+    """Parquet files partitioned by resource type: `<directory>/<type>/part-*.parquet`.
+
+    Index columns (`patient_id`, `date`, `code`, `value`, `unit`) sit next
+    to the raw resource JSON, so cohort queries read only the columns they
+    need. Parts are append-only; when a resource appears in several parts
+    the newest one wins.
+    """
+
+    def __init__(self, directory: str = BULK_DIR):
+        _require_pyarrow()
+        self.directory = directory
+        self._parts = 0
+
+    def _part_path(self, resource_type: str) -> str:
+        self._parts += 1
+        return os.path.join(
+            self.directory, resource_type,
+            f'part-{datetime.now().strftime("%Y%m%dT%H%M%S%f")}-{self._parts:05d}.parquet'
+        )
+
+    async def write(self, resource_type: str, lines: List[str]) -> int:
+        """Store one batch of NDJSON lines as a new part, parsed off the event loop."""
+        if not lines:
+            return 0
+        return await run_cpu(_write_part, self._part_path(resource_type), lines, size=len(lines), threshold=OFFLOAD_MIN_ITEMS)
+
+    def parts(self, resource_type: str) -> List[str]:
+        directory = os.path.join(self.directory, resource_type)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.parquet'))
+
+    def table(self, resource_type: str, columns: Optional[List[str]] = None, patient_ids: Optional[Iterable[str]] = None) -> 'pa.Table':
+        """All stored rows of a type, optionally restricted to some columns and patients."""
+        parts = self.parts(resource_type)
+        if not parts:
+            return pa.table({name: pa.array([], pa.float64() if name == 'value' else pa.string()) for name in (columns or COLUMNS)})
+        filters = [('patient_id', 'in', list(patient_ids))] if patient_ids is not None else None
+        return pa.concat_tables(pq.read_table(path, columns=columns, filters=filters) for path in parts)
+
+    def resources(self, resource_type: str, patient_ids: Optional[Iterable[str]] = None) -> Dict[str, List[dict]]:
+        """Latest version of each stored resource, grouped by patient id."""
+        table = self.table(resource_type, ['id', 'patient_id', 'resource'], patient_ids)
+        latest = {}
+        for resource_id, patient_id, resource in zip(*(table.column(name).to_pylist() for name in ('id', 'patient_id', 'resource'))):
+            latest[resource_id] = (patient_id, resource)
+        grouped = defaultdict(list)
+        for patient_id, resource in latest.values():
+            grouped[patient_id].append(json.loads(resource))
+        return grouped
+
+    def patient_records(self, patient_ids: Optional[Iterable[str]] = None) -> List[list]:
+        """Stored data in `get_resources` order, one record per patient, for batch prediction."""
+        patient_ids = list(patient_ids) if patient_ids is not None else None
+        by_type = {resource_type: self.resources(resource_type, patient_ids) for resource_type in FHIR_DATA_TYPES.values()}
+        patients = by_type[ResourceType.patient.value]
+        return [
+            [
+                patients[patient_id][0],
+                by_type[ResourceType.condition.value].get(patient_id, []),
+                by_type[ResourceType.observation.value].get(patient_id, []),
+                by_type[ResourceType.medication_request.value].get(patient_id, []),
+                by_type[ResourceType.encounter.value].get(patient_id, []),
+                by_type[ResourceType.diagnostic_report.value].get(patient_id, []),
+                by_type[ResourceType.risk_assessment.value].get(patient_id, []),
+                by_type[ResourceType.care_plan.value].get(patient_id, []),
+            ]
+            for patient_id in (patient_ids if patient_ids is not None else sorted(patients))
+            if patients.get(patient_id)
+        ]
+
+
+async def start_export(
+    client: FHIRClient,
+    group_id: Optional[str] = None,
+    types: Iterable[str] = BULK_TYPES,
+    since: Optional[str] = None,
+) -> str:
+    """Kick off a Group or Patient level `$export`; returns the status URL."""
+    path = f'/Group/{group_id}/$export' if group_id else '/Patient/$export'
+    params = {'_outputFormat': 'application/fhir+ndjson', '_type': ','.join(types)}
+    if since:
+        params['_since'] = since
+    response = await client.client.get(
+        path,
+        params=params,
+        headers={'Accept': 'application/fhir+json', 'Prefer': 'respond-async'}
+    )
+    if response.status_code != 202 or 'content-location' not in response.headers:
+        raise BulkExportError(f'$export was not accepted ({response.status_code}): {response.text[:500]}')
+    return response.headers['content-location']
+
+async def poll_export(client: FHIRClient, status_url: str, interval: float = BULK_POLL_INTERVAL) -> dict:
+    """Wait for an export to finish and return its manifest, honouring `Retry-After`."""
+    while True:
+        response = await client.client.get(status_url, headers={'Accept': 'application/json'})
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code != 202:
+            raise BulkExportError(f'$export failed ({response.status_code}): {response.text[:500]}')
+        retry_after = response.headers.get('retry-after', '')
+        await asyncio.sleep(float(retry_after) if retry_after.isdigit() else interval)
+
+async def stream_ndjson(http: httpx.AsyncClient, url: str, batch_rows: int = BULK_BATCH_ROWS) -> AsyncIterator[List[str]]:
+    """Lines of an NDJSON output file in batches, without holding the file in memory."""
+    batch = []
+    async with http.stream('GET', url, headers={'Accept': 'application/fhir+ndjson'}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.strip():
+                batch.append(line)
+            if len(batch) >= batch_rows:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+async def bulk_ingest(
+    client: FHIRClient,
+    store: ColumnarStore,
+    group_id: Optional[str] = None,
+    types: Iterable[str] = BULK_TYPES,
+    since: Optional[str] = None,
+    poll_interval: float = BULK_POLL_INTERVAL,
+) -> Dict[str, int]:
+    """Export from the FHIR server into `store`.
+
+    Args:
+        client: Client for the FHIR server.
+        store: Destination store.
+        group_id: Export a Group's patients instead of all patients.
+        types: Resource types to export.
+        since: Only resources changed after this instant, for incremental runs.
+        poll_interval: Seconds between status checks without `Retry-After`.
+
+    Returns:
+        Resource type -> number of resources stored.
+    """
+    _require_pyarrow()
+    started = time.monotonic()
+    status_url = await start_export(client, group_id, types, since)
+    manifest = await poll_export(client, status_url, poll_interval)
+    # Output files without requiresAccessToken are often pre-signed URLs that reject extra auth
+    http = client.client if manifest.get('requiresAccessToken') else httpx.AsyncClient(timeout=client.client.timeout)
+    counts: Dict[str, int] = defaultdict(int)
+    try:
+        for output in manifest.get('output', []):
+            async for lines in stream_ndjson(http, output['url']):
+                counts[output['type']] += await store.write(output['type'], lines)
+    finally:
+        if http is not client.client:
+            await http.aclose()
+    print(f'Bulk export stored {sum(counts.values())} resources in {time.monotonic() - started:.1f}s: {dict(counts)}')
+    return dict(counts)
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description='Ingest a FHIR bulk $export into the local columnar store.')
+    parser.add_argument('--fhir-url', required=True)
+    parser.add_argument('--token', default=os.getenv('BULK_ACCESS_TOKEN'))
+    parser.add_argument('--group', help='Group id for a Group-level export')
+    parser.add_argument('--since', help='Only export resources changed since this instant')
+    parser.add_argument('--out', default=BULK_DIR)
+    args = parser.parse_args()
+    client = FHIRClient.for_bearer_token(args.fhir_url, args.token) if args.token else FHIRClient.for_no_auth(args.fhir_url)
+    async with client:
+        await bulk_ingest(client, ColumnarStore(args.out), args.group, since=args.since)
+
+
+if __name__ == '__main__':
+    asyncio.run(_main())
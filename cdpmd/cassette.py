@@ -0,0 +1,303 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+import urllib.parse
+from collections import defaultdict, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+
+CASSETTE_MODE = os.getenv('CASSETTE_MODE', 'off').lower()
+CASSETTE_DIR = os.getenv('CASSETTE_DIR', 'cassettes')
+CASSETTE_LATENCY_SCALE = float(os.getenv('CASSETTE_LATENCY_SCALE', 1.0))
+# Cassettes allowed to record without a scrubber of their own, e.g. `llm` against synthetic data
+CASSETTE_UNSCRUBBED = {name.strip() for name in os.getenv('CASSETTE_UNSCRUBBED', '').split(',') if name.strip()}
+
+SENSITIVE_HEADERS = {'authorization', 'cookie', 'set-cookie', 'x-api-key', 'api-key'}
+# Bodies are stored decoded, so the transfer headers no longer apply
+TRANSFER_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+PHI_FIELDS = {'name', 'telecom', 'address', 'identifier', 'photo', 'contact', 'text'}
+# Dates reduced to their year, so replayed ages and risk scores still compute
+PHI_DATE_FIELDS = {'birthDate', 'deceasedDateTime'}
+PHI_SEARCH_PARAMS = {'name', 'family', 'given', 'birthdate', 'identifier', 'phone', 'email', 'telecom', 'address'}
+# Bodies of these cassettes are free text (prompts embed whole patient records), which the
+# FHIR-aware default scrubber cannot redact
+SCRUBBER_REQUIRED = {'llm'}
+
+Scrubber = Callable[[dict], dict]
+# (cassette name or None for every cassette, scrubber)
+_scrubbers: List[Tuple[Optional[str], Scrubber]] = []
+
+
+class CassetteMissError(httpx.TransportError):
+    """Raised in replay mode when no recorded interaction matches a request."""
+
+
+def add_scrubber(scrubber: Scrubber, cassette: Optional[str] = None):
+    """Register a hook that sanitises each interaction before it is written.
+
+    A scrubber receives the interaction dict (`method`, `url`, `request_body`,
+    `status`, `headers`, `body`, ...) and returns the version to store.
+
+    Args:
+        scrubber: The hook.
+        cassette: Only apply it to this cassette; None applies it to all.
+    """
+    _scrubbers.append((cassette, scrubber))
+
+def scrubbers_for(name: str) -> List[Scrubber]:
+    return [scrubber for cassette, scrubber in _scrubbers if cassette in (None, name)]
+
+def recordable(name: str) -> bool:
+    """Whether interactions of the `name` cassette may be written, given the scrubbers registered so far."""
+    if name not in SCRUBBER_REQUIRED or name in CASSETTE_UNSCRUBBED:
+        return True
+    if any(cassette == name for cassette, _ in _scrubbers):
+        return True
+    if name not in _refused:
+        print(f'Not recording the {name} cassette: register a scrubber with add_scrubber(..., cassette={name!r}) or list it in CASSETTE_UNSCRUBBED')
+        _refused.add(name)
+    return False
+
+def _mask(value):
+    """Replace every string in `value`, keeping its shape so replayed pages still render."""
+    if isinstance(value, dict):
+        return {key: _mask(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_mask(item) for item in value]
+    return 'REDACTED' if isinstance(value, str) else value
+
+def _mask_date(value):
+    if isinstance(value, str) and value[:4].isdigit():
+        return f'{value[:4]}-01-01'
+    return _mask(value)
+
+def _redact(value):
+    if isinstance(value, dict):
+        if 'resourceType' in value:
+            return {
+                key: _mask(item) if key in PHI_FIELDS else _mask_date(item) if key in PHI_DATE_FIELDS else _redact(item)
+                for key, item in value.items()
+            }
+        return {key: _redact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_redact(item) for item in value]
+    return value
+
+def _redact_url(url: str) -> str:
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    if not any(name.split(':')[0].lower() in PHI_SEARCH_PARAMS for name, _ in query):
+        return url
+    query = [
+        (name, 'REDACTED' if name.split(':')[0].lower() in PHI_SEARCH_PARAMS else value)
+        for name, value in query
+    ]
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+def redact_fhir_phi(interaction: dict) -> dict:
+    """Default scrubber: redact direct identifiers of FHIR resources in JSON bodies and PHI search parameters in URLs.
+
+    Replay then matches redacted requests by method and path.
+    """
+    interaction['url'] = _redact_url(interaction['url'])
+    for key in ('request_body', 'body'):
+        try:
+            interaction[key] = json.dumps(_redact(json.loads(interaction[key])))
+        except (TypeError, ValueError):
+            pass
+    return interaction
+
+add_scrubber(redact_fhir_phi)
+
+
+def _body_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+def _encode(content: bytes) -> dict:
+    try:
+        return {'body': content.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'body': base64.b64encode(content).decode(), 'base64': True}
+
+
+class _DelayedStream(httpx.AsyncByteStream):
+    """Response body that arrives `delay` seconds after the headers, like the recorded one."""
+
+    def __init__(self, content: bytes, delay: float):
+        self.content = content
+        self.delay = delay
+
+    async def __aiter__(self):
+        if self.delay > 0:
+            await asyncio.sleep(self.delay)
+        yield self.content
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """httpx transport recording interactions to, or replaying them from, a JSON-lines cassette.
+
+    Recording stores the sanitised request/response pair with the time to
+    response headers (`latency`) and to the end of the body (`duration`).
+    Replay matches on method, URL and a hash of the request body, falling
+    back to the next unused interaction for the same method and path, and
+    waits the recorded times scaled by `latency_scale`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = 'record',
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        latency_scale: float = 1.0,
+        name: Optional[str] = None,
+    ):
+        """
+        Args:
+            path: Cassette file.
+            mode: `record` or `replay`.
+            transport: Transport used to reach the real server when recording.
+            latency_scale: Multiplier for replayed latencies; 0 replays instantly.
+            name: Cassette name selecting its scrubbers; defaults to the file name.
+        """
+        self.path = path
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.mode = mode
+        self.transport = transport or httpx.AsyncHTTPTransport()
+        self.latency_scale = latency_scale
+        self._exact: Dict[tuple, deque] = defaultdict(deque)
+        self._by_path: Dict[tuple, deque] = defaultdict(deque)
+        if mode == 'replay':
+            self._load()
+
+    def _load(self):
+        with open(self.path) as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                interaction = json.loads(line)
+                self._exact[(interaction['method'], interaction['url'], interaction['request_hash'])].append(interaction)
+                self._by_path[(interaction['method'], interaction['path'])].append(interaction)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.mode == 'replay':
+            return await self._replay(request)
+        return await self._record(request)
+
+    async def _record(self, request: httpx.Request) -> httpx.Response:
+        content = await request.aread()
+        started = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        latency = time.perf_counter() - started
+        # The transport yields the bytes on the wire; reading through a Response decodes gzip/brotli
+        response = httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=response.stream,
+            extensions=response.extensions,
+            request=request,
+        )
+        body = await response.aread()
+        duration = time.perf_counter() - started
+        await response.aclose()
+
+        interaction = {
+            'method': request.method,
+            'url': str(request.url),
+            'path': request.url.path,
+            'request_hash': _body_hash(content),
+            'request_body': content.decode('utf-8', errors='replace'),
+            'status': response.status_code,
+            'headers': [
+                (name, value) for name, value in response.headers.multi_items()
+                if name.lower() not in SENSITIVE_HEADERS | TRANSFER_HEADERS
+            ],
+            'latency': latency,
+            'duration': duration,
+            **_encode(body),
+        }
+        # Scrubbers are resolved per interaction, so ones registered after the transport was built apply
+        if recordable(self.name):
+            stored = dict(interaction)
+            for scrubber in scrubbers_for(self.name):
+                stored = scrubber(stored)
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(stored) + '\n')
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=[(name, value) for name, value in response.headers.multi_items() if name.lower() not in TRANSFER_HEADERS],
+            content=body,
+            request=request,
+        )
+
+    def _take(self, request: httpx.Request, content: bytes) -> Optional[dict]:
+        exact = self._exact.get((request.method, str(request.url), _body_hash(content)))
+        by_path = self._by_path.get((request.method, request.url.path))
+        interaction = exact.popleft() if exact else by_path.popleft() if by_path else None
+        if interaction is not None:
+            # Consumed interactions leave both indexes
+            for queue in (
+                self._exact[(interaction['method'], interaction['url'], interaction['request_hash'])],
+                self._by_path[(interaction['method'], interaction['path'])],
+            ):
+                if any(item is interaction for item in queue):
+                    queue.remove(interaction)
+        return interaction
+
+    async def _replay(self, request: httpx.Request) -> httpx.Response:
+        content = await request.aread()
+        interaction = self._take(request, content)
+        if interaction is None:
+            raise CassetteMissError(f'No recorded interaction for {request.method} {request.url}', request=request)
+        body = base64.b64decode(interaction['body']) if interaction.get('base64') else interaction['body'].encode()
+        latency = interaction['latency'] * self.latency_scale
+        if latency > 0:
+            await asyncio.sleep(latency)
+        return httpx.Response(
+            status_code=interaction['status'],
+            headers=interaction['headers'],
+            stream=_DelayedStream(body, (interaction['duration'] - interaction['latency']) * self.latency_scale),
+            request=request,
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+_transports: Dict[str, CassetteTransport] = {}
+_refused = set()
+
+
+def cassette_transport(name: str, **transport_kwargs) -> Optional[httpx.AsyncBaseTransport]:
+    """Transport for the `name` cassette when `CASSETTE_MODE` is record or replay, else None.
+
+    Replay transports are shared per cassette, so interactions are consumed
+    in order across the short-lived clients the app creates.
+
+    Args:
+        name: Cassette name; stored as `<CASSETTE_DIR>/<name>.jsonl`. Interactions
+            of cassettes in `SCRUBBER_REQUIRED` pass through unrecorded until a
+            scrubber is registered for them, unless listed in `CASSETTE_UNSCRUBBED`.
+        transport_kwargs: Passed to `httpx.AsyncHTTPTransport` when recording.
+    """
+    if CASSETTE_MODE not in ('record', 'replay'):
+        return None
+    path = os.path.join(CASSETTE_DIR, f'{name}.jsonl')
+    if CASSETTE_MODE == 'replay':
+        if name not in _transports:
+            _transports[name] = _SharedTransport(path, 'replay', latency_scale=CASSETTE_LATENCY_SCALE, name=name)
+        return _transports[name]
+    return CassetteTransport(path, 'record', httpx.AsyncHTTPTransport(**transport_kwargs), name=name)
+
+
+class _SharedTransport(CassetteTransport):
+    """Replay transport that outlives the clients using it."""
+
+    async def aclose(self):
+        pass
@@ -0,0 +1,183 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import time
+import urllib.parse
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from cdpmd.schemas import Priority
+from cdpmd.fhir_client import FHIRClient
+from cdpmd.utils import AsyncCache, generate_clinical_summary, create_cards, add_source
+from cdpmd.agent import predictor_query
+
+
+CDS_AI_CARDS = os.getenv('CDS_AI_CARDS', 'false').lower() == 'true'
+CDS_DEADLINE = float(os.getenv('CDS_DEADLINE', 0.5))
+
+CDS_MAX_CLIENTS = int(os.getenv('CDS_MAX_CLIENTS', 32))
+
+PREFETCH = {
+    "patient": "Patient/{{context.patientId}}",
+    "conditions": "Condition?patient={{context.patientId}}",
+    "medications": "MedicationRequest?patient={{context.patientId}}",
+    "observations": "Observation?patient={{context.patientId}}",
+    "encounters": "Encounter?patient={{context.patientId}}",
+    "diagnosticReports": "DiagnosticReport?patient={{context.patientId}}",
+    "riskAssessments": "RiskAssessment?patient={{context.patientId}}",
+    "carePlans": "CarePlan?patient={{context.patientId}}",
+}
+
+cds_cache = AsyncCache(os.getenv('CACHE_TTL'), 'cds_cache.json')
+_pending: Dict[str, asyncio.Task] = {}
+_clients: 'OrderedDict[Tuple[str, str], FHIRClient]' = OrderedDict()
+
+
+def _client_for(fhir_server: str, access_token: str) -> FHIRClient:
+    """Pooled client per (server, token) so repeated hooks reuse open connections."""
+    key = (fhir_server, access_token)
+    if key in _clients:
+        _clients.move_to_end(key)
+        return _clients[key]
+    client = FHIRClient.for_bearer_token(fhir_server.rstrip('/'), access_token)
+    _clients[key] = client
+    while len(_clients) > CDS_MAX_CLIENTS:
+        _, evicted = _clients.popitem(last=False)
+        asyncio.get_running_loop().create_task(evicted.client.aclose())
+    return client
+
+async def _fetch_prefetch(client: FHIRClient, query: str) -> Optional[dict]:
+    path, _, query_string = query.partition('?')
+    if not query_string:
+        resource_type, _, resource_id = path.partition('/')
+        return await client.read_resource(resource_type, resource_id)
+    return await client.search_resource(path, dict(urllib.parse.parse_qsl(query_string)))
+
+async def resolve_prefetch(body: dict, timeout: float = CDS_DEADLINE) -> dict:
+    """Prefetch data for a hook request, fetching the entries the EHR left out.
+
+    Missing (or null) prefetch keys are requested concurrently from the
+    hook's `fhirServer` with its `fhirAuthorization` token. Whatever has not
+    arrived after `timeout` seconds stays None.
+    """
+    prefetch = body.get('prefetch') or {}
+    fhir_data = {key: prefetch.get(key) for key in PREFETCH}
+    missing = [key for key, value in fhir_data.items() if value is None]
+    patient_id = (body.get('context') or {}).get('patientId')
+    fhir_server = body.get('fhirServer')
+    access_token = (body.get('fhirAuthorization') or {}).get('access_token')
+    if not missing or not patient_id or not fhir_server or not access_token:
+        return fhir_data
+
+    client = _client_for(fhir_server, access_token)
+    tasks = {
+        asyncio.create_task(
+            _fetch_prefetch(client, PREFETCH[key].replace('{{context.patientId}}', patient_id))
+        ): key for key in missing
+    }
+    done, not_done = await asyncio.wait(tasks, timeout=max(timeout, 0))
+    for task in not_done:
+        task.cancel()
+    for task in done:
+        if task.exception():
+            print(f"CDS prefetch fallback for {tasks[task]} failed: {task.exception()!r}")
+        else:
+            fhir_data[tasks[task]] = task.result()
+    if not_done:
+        print(f"CDS prefetch fallback timed out for {', '.join(tasks[task] for task in not_done)}")
+    return fhir_data
+
+
+def _version(resource: dict) -> str:
+    # Type, id and version identify a resource's content; without a version, hash the resource
+    version = (resource.get('meta') or {}).get('versionId')
+    if resource.get('id') and version:
+        return f'{resource.get("resourceType")}/{resource["id"]}/{version}'
+    return hashlib.sha256(json.dumps(resource, sort_keys=True, default=str).encode()).hexdigest()
+
+def prefetch_key(fhir_data: dict, fhir_server: Optional[str] = None) -> str:
+    """Stable fingerprint of a hook's prefetch payload: the server, the patient and the version of each resource."""
+    patient = fhir_data.get('patient') or {}
+    versions = sorted(
+        _version(resource)
+        for name, value in fhir_data.items() if name != 'patient'
+        for resource in bundle_resources(value)
+    )
+    parts = [fhir_server, patient.get('id'), _version(patient) if patient else None, versions]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+def bundle_resources(bundle: Optional[dict]) -> List[dict]:
+    """Resources of a searchset Bundle, tolerating bare resources in `entry`."""
+    if not bundle:
+        return []
+    return [entry.get('resource', entry) for entry in bundle.get('entry', []) or []]
+
+async def _compute(key: str, fhir_data: dict) -> dict:
+    # Hook payloads are unauthenticated, so they never reach the per-patient caches of the app
+    response = await predictor_query(
+        fhir_data['patient'],
+        bundle_resources(fhir_data.get('conditions')),
+        bundle_resources(fhir_data.get('medications')),
+        bundle_resources(fhir_data.get('observations')),
+        bundle_resources(fhir_data.get('encounters')),
+        bundle_resources(fhir_data.get('diagnosticReports')),
+        bundle_resources(fhir_data.get('riskAssessments')),
+        bundle_resources(fhir_data.get('carePlans')),
+        priority=Priority.prefetch,
+        shared=False
+    )
+    await cds_cache.put_async(key, response)
+    return response
+
+def _finished(key: str, task: asyncio.Task):
+    _pending.pop(key, None)
+    if not task.cancelled() and task.exception():
+        print(f'CDS background prediction failed: {task.exception()!r}')
+
+def enqueue_prediction(key: str, fhir_data: dict) -> asyncio.Task:
+    """Start (or join) the background prediction for a prefetch payload."""
+    if key not in _pending:
+        task = asyncio.create_task(_compute(key, fhir_data))
+        task.add_done_callback(lambda task: _finished(key, task))
+        _pending[key] = task
+    return _pending[key]
+
+def is_pending(key: str) -> bool:
+    return key in _pending
+
+async def predictor_cards(
+    fhir_data: dict,
+    source_url: str,
+    deadline: float = CDS_DEADLINE,
+    fhir_server: Optional[str] = None,
+) -> dict:
+    """Answer a patient-view hook within `deadline` seconds.
+
+    Precomputed predictor cards are returned when present. Otherwise the
+    prediction is queued at prefetch priority and, if it does not finish
+    in time, the summary card is returned with a refresh link. Without a
+    patient, or when the prediction failed, nothing is pending and the plain
+    summary card is returned.
+    """
+    started = time.monotonic()
+    key = prefetch_key(fhir_data, fhir_server)
+    response = cds_cache.get(key)
+    if response is None and (fhir_data.get('patient') or {}).get('id'):
+        task = enqueue_prediction(key, fhir_data)
+        try:
+            response = await asyncio.wait_for(
+                asyncio.shield(task),
+                timeout=max(deadline - (time.monotonic() - started), 0)
+            )
+        except Exception:
+            response = None
+    if response is not None:
+        return await add_source(copy.deepcopy(response), source_url)
+
+    summary = await generate_clinical_summary(fhir_data)
+    refresh_url = f'{source_url}cds-services/predictor/cards/{key}' if is_pending(key) else None
+    return await create_cards(summary, source_url, refresh_url=refresh_url)
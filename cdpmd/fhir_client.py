@@ -1,6 +1,7 @@
 from pprint import pprint
 import base64
 import json
+import urllib.parse
 import httpx
 from fhir.resources.patient import Patient
 from fhir.resources.condition import Condition
@@ -19,6 +20,9 @@ from fhir.resources.diagnosticreport import DiagnosticReport
 from fhir.resources.riskassessment import RiskAssessment
 from fhir.resources.careplan import CarePlan
 
+from cdpmd.offload import run_cpu
+from cdpmd.cassette import cassette_transport
+
 
 class FHIRClient:
     def __init__(self, base_url: str, auth=None, headers=None):
@@ -28,6 +32,7 @@ class FHIRClient:
             headers=headers or {},
             base_url=base_url,
             http2=True,  # Enable HTTP/2 for better performance
+            transport=cassette_transport('fhir', http2=True),
             timeout=httpx.Timeout(10.0)  # Set reasonable timeout
         )
 
@@ -84,17 +89,30 @@ class FHIRClient:
         response = await self.client.get(url)
         response.raise_for_status()
         
-        data = response.json()
+        data = await run_cpu(json.loads, response.content, size=len(response.content))
         
         if resource_id:
             return data
         return [entry["resource"] for entry in data.get("entry", [])]
 
+    async def read_page(self, resource_type: str, params: dict | None = None, url: str | None = None):
+        """One page of a search and the URL of the next one, from the Bundle's `next` link.
+
+        Pass `url` to follow a `next` link returned by a previous call.
+        """
+        response = await self.client.get(url or self._construct_url(resource_type, params=params))
+        response.raise_for_status()
+
+        data = await run_cpu(json.loads, response.content, size=len(response.content))
+
+        next_url = next((link.get("url") for link in data.get("link", []) if link.get("relation") == "next"), None)
+        return [entry["resource"] for entry in data.get("entry", [])], next_url
+
     async def search_resource(self, resource_type: str, params: dict):
         url = self._construct_url(resource_type)
         response = await self.client.get(url, params=params)
         response.raise_for_status()
-        return response.json()
+        return await run_cpu(json.loads, response.content, size=len(response.content))
 
     async def create_resource(self, resource_type: str, data: dict):
         url = self._construct_url(resource_type)
@@ -120,6 +138,5 @@ class FHIRClient:
         if resource_id:
             path += f"/{resource_id}"
         if params:
-            for k, v in params.items():
-                path += f'?{k}={v}'
+            path += f'?{urllib.parse.urlencode(params)}'
         return path
\ No newline at end of file
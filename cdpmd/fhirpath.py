@@ -0,0 +1,205 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+Accessor = Callable[[dict], List[Any]]
+
+_AGGREGATES = {
+    'first()': 'vals = vals[:1]',
+    'last()': 'vals = vals[-1:]',
+    'exists()': 'vals = [bool(vals)]',
+    'count()': 'vals = [len(vals)]',
+}
+
+
+def _split(expression: str) -> List[str]:
+    """Split a path on dots that are not inside parentheses."""
+    parts, depth, current = [], 0, ''
+    for char in expression:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == '.' and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    parts.append(current)
+    return [part.strip() for part in parts if part.strip()]
+
+def _emit_field(lines: List[str], indent: str, source: str, target: str, name: str) -> str:
+    """Emit a loop binding `target` to each value of element `name`; returns the inner indent."""
+    lines.append(f'{indent}if type({source}) is dict:')
+    lines.append(f'{indent}    _x = {source}.get({name!r})')
+    lines.append(f'{indent}    if _x is not None:')
+    lines.append(f'{indent}        for {target} in (_x if type(_x) is list else (_x,)):')
+    return indent + '            '
+
+def _emit_match(lines: List[str], indent: str, value: str, expected: str):
+    """Emit `return True` when `value` equals `expected`; codeable concepts match on any coding code."""
+    lines.append(f'{indent}if type({value}) is dict:')
+    lines.append(f'{indent}    _c = {value}.get("coding")')
+    lines.append(f'{indent}    if _c is not None:')
+    lines.append(f'{indent}        for _cd in _c:')
+    lines.append(f'{indent}            if _cd.get("code") == {expected!r}:')
+    lines.append(f'{indent}                return True')
+    lines.append(f'{indent}        if {value}.get("text") == {expected!r}:')
+    lines.append(f'{indent}            return True')
+    lines.append(f'{indent}    elif {value}.get("code") == {expected!r}:')
+    lines.append(f'{indent}        return True')
+    lines.append(f'{indent}elif str({value}) == {expected!r}:')
+    lines.append(f'{indent}    return True')
+
+def _compile_where(argument: str, namespace: dict) -> str:
+    """Compile `path=value` into a predicate in `namespace`; returns its name."""
+    path, _, expected = argument.partition('=')
+    expected = expected.strip().strip('\'"')
+    name = f'_where{len(namespace)}'
+    lines = [f'def {name}(v0):']
+    indent, current = '    ', 'v0'
+    for depth, field in enumerate(_split(path), start=1):
+        if not field.isidentifier():
+            raise ValueError(f'Unsupported where() path {path!r}')
+        indent = _emit_field(lines, indent, current, f'v{depth}', field)
+        current = f'v{depth}'
+    _emit_match(lines, indent, current, expected)
+    lines.append('    return False')
+    exec('\n'.join(lines), namespace)
+    return name
+
+def compile_path(expression: str) -> Tuple[str, Accessor]:
+    """Compile a FHIRPath-style expression into (resource type, accessor).
+
+    Supported segments are element names, `where(path=value)` (codeable
+    concepts match on any coding code), `first()`, `last()`, `exists()`
+    and `count()`, e.g. `Observation.where(code=4548-4).valueQuantity.value`.
+    The accessor is generated Python source with one nested loop per
+    segment, so evaluating it costs about as much as a hand-written walk.
+    """
+    resource_type, *segments = _split(expression)
+    namespace: Dict[str, Any] = {}
+    lines = ['def accessor(resource):', '    vals = [resource]']
+    stage: List[str] = []
+
+    def flush():
+        lines.append('    _out = []')
+        if lines[1:] == ['    vals = [resource]', '    _out = []']:
+            # First stage: walk the resource itself, no loop needed
+            lines[1] = '    v0 = resource'
+            indent = '    '
+        else:
+            lines.append('    for v0 in vals:')
+            indent = '        '
+        current = 'v0'
+        for depth, segment in enumerate(stage, start=1):
+            if segment.startswith('where('):
+                lines.append(f'{indent}if {_compile_where(segment[len("where("):-1], namespace)}({current}):')
+                indent += '    '
+            else:
+                indent = _emit_field(lines, indent, current, f'v{depth}', segment)
+                current = f'v{depth}'
+        lines.append(f'{indent}_out.append({current})')
+        lines.append('    vals = _out')
+        stage.clear()
+
+    for segment in segments:
+        if segment in _AGGREGATES:
+            if stage:
+                flush()
+            lines.append(f'    {_AGGREGATES[segment]}')
+        elif (segment.startswith('where(') and segment.endswith(')')) or segment.isidentifier():
+            stage.append(segment)
+        else:
+            raise ValueError(f'Unsupported FHIRPath segment {segment!r} in {expression!r}')
+    if stage:
+        flush()
+    lines.append('    return vals')
+    exec('\n'.join(lines), namespace)
+    return resource_type, namespace['accessor']
+
+
+class ExtractionRules:
+    """Named path expressions compiled once and evaluated in one pass over resources."""
+
+    def __init__(self, rules: Dict[str, str]):
+        """
+        Args:
+            rules: Result name -> path expression.
+        """
+        self.rules = rules
+        self._by_type: Dict[str, List[Tuple[str, Accessor]]] = {}
+        for name, expression in rules.items():
+            resource_type, accessor = compile_path(expression)
+            self._by_type.setdefault(resource_type, []).append((name, accessor))
+
+    def run(
+        self,
+        resources: Iterable[dict],
+        resource_type: Optional[str] = None,
+        results: Optional[Dict[str, List[Any]]] = None,
+    ) -> Dict[str, List[Any]]:
+        """Evaluate every rule against `resources`.
+
+        Args:
+            resources: FHIR resources (or Bundle entries wrapping them).
+            resource_type: Type to assume for resources without `resourceType`.
+            results: Results from a previous call to extend.
+
+        Returns:
+            Result name -> extracted values, in resource order.
+        """
+        if results is None:
+            results = {name: [] for name in self.rules}
+        for resource in resources:
+            if 'resource' in resource and 'resourceType' not in resource:
+                resource = resource['resource']
+            for name, accessor in self._by_type.get(resource.get('resourceType') or resource_type, ()):
+                results[name].extend(accessor(resource))
+        return results
+
+
+SUMMARY_RULES = ExtractionRules({
+    'gender': 'Patient.gender',
+    'birth_date': 'Patient.birthDate',
+    'given_name': 'Patient.name.first().given.first()',
+    'family_name': 'Patient.name.first().family',
+    'conditions': 'Condition.code.text',
+    'medications': 'MedicationRequest.medicationCodeableConcept.text',
+    'hba1c': 'Observation.where(code=4548-4).valueQuantity.value',
+    'encounters': 'Encounter.count()',
+    'diagnostic_reports': 'DiagnosticReport.count()',
+    'risk_assessments': 'RiskAssessment.count()',
+    'care_plans': 'CarePlan.count()',
+})
+
+# Clinically relevant date and primary code of each resource type, used to index stored resources
+DATE_PATHS = {
+    'Patient': 'Patient.birthDate',
+    'Condition': 'Condition.onsetDateTime',
+    'Observation': 'Observation.effectiveDateTime',
+    'MedicationRequest': 'MedicationRequest.authoredOn',
+    'Encounter': 'Encounter.period.start',
+    'DiagnosticReport': 'DiagnosticReport.effectiveDateTime',
+    'RiskAssessment': 'RiskAssessment.occurrenceDateTime',
+    'CarePlan': 'CarePlan.period.start',
+    'Task': 'Task.authoredOn',
+}
+CODE_PATHS = {
+    'Condition': 'Condition.code.coding.first().code',
+    'Observation': 'Observation.code.coding.first().code',
+    'MedicationRequest': 'MedicationRequest.medicationCodeableConcept.coding.first().code',
+    'Encounter': 'Encounter.type.first().coding.first().code',
+    'DiagnosticReport': 'DiagnosticReport.code.coding.first().code',
+    'CarePlan': 'CarePlan.category.first().coding.first().code',
+    'Task': 'Task.code.coding.first().code',
+}
+_DATE_ACCESSORS = {resource_type: compile_path(path)[1] for resource_type, path in DATE_PATHS.items()}
+_CODE_ACCESSORS = {resource_type: compile_path(path)[1] for resource_type, path in CODE_PATHS.items()}
+
+
+def index_fields(resource: dict) -> Tuple[Optional[str], Optional[str]]:
+    """(date, code) of a resource for indexing; either may be None."""
+    resource_type = resource.get('resourceType')
+    dates = _DATE_ACCESSORS[resource_type](resource) if resource_type in _DATE_ACCESSORS else []
+    codes = _CODE_ACCESSORS[resource_type](resource) if resource_type in _CODE_ACCESSORS else []
+    return (str(dates[0]) if dates else None, str(codes[0]) if codes else None)
@@ -0,0 +1,161 @@
+import gzip
+import hashlib
+import json
+import os
+import tomllib
+from importlib import metadata
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from cdpmd.offload import run_cpu
+
+
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 5))
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/fhir+json', 'application/javascript', 'image/svg+xml')
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+def app_version() -> str:
+    """Version of the app from the package metadata, or from pyproject.toml when the project is not installed."""
+    try:
+        return metadata.version('cdpmd')
+    except metadata.PackageNotFoundError:
+        # `uv sync` does not install the project itself
+        try:
+            with open(os.path.join(os.path.dirname(__file__), '..', 'pyproject.toml'), 'rb') as file:
+                return tomllib.load(file)['project']['version']
+        except (OSError, KeyError, tomllib.TOMLDecodeError):
+            return 'unknown'
+
+# Part of every ETag, so a deploy that changes templates invalidates cached pages,
+# while restarts and other workers of the same release keep validating them.
+# Builds set it to the commit (see the Dockerfile); otherwise the app version is used.
+ETAG_VERSION = os.getenv('ETAG_VERSION') or app_version()
+
+
+def etag(*parts) -> str:
+    """Strong ETag over JSON-serialisable `parts`."""
+    digest = hashlib.sha256(json.dumps([ETAG_VERSION, *parts], sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+def _opaque(tag: str) -> str:
+    # Compressed variants carry the encoding as a suffix; they validate the same content
+    tag = tag.strip().removeprefix('W/')
+    for encoding in ENCODINGS:
+        tag = tag.replace(f'-{encoding}"', '"')
+    return tag
+
+def not_modified(request: Request, tag: str) -> Optional[Response]:
+    """A 304 for a GET whose `If-None-Match` already names `tag`, else None."""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    header = request.headers.get('if-none-match')
+    if not header:
+        return None
+    if header.strip() == '*' or _opaque(tag) in {_opaque(candidate) for candidate in header.split(',')}:
+        return Response(status_code=304, headers=validator_headers(tag))
+    return None
+
+def validator_headers(tag: str) -> dict:
+    # Pages carry PHI: browsers may keep them but must revalidate, shared caches must not
+    return {'etag': tag, 'cache-control': 'private, no-cache'}
+
+def with_etag(response: Response, tag: str) -> Response:
+    response.headers.update(validator_headers(tag))
+    return response
+
+
+def _negotiate(accept_encoding: str) -> Optional[str]:
+    """Preferred supported encoding of an `Accept-Encoding` header."""
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if weights.get(encoding, weights.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+def _mark_variant(headers: MutableHeaders, encoding: str):
+    headers.add_vary_header('accept-encoding')
+    tag = headers.get('etag')
+    if tag and tag.endswith('"') and not tag.startswith('W/'):
+        headers['etag'] = f'{tag[:-1]}-{encoding}"'
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing single-body responses with brotli or gzip.
+
+    Bodies below `COMPRESS_MIN_BYTES`, of other content types, already
+    encoded or streamed in several chunks are sent unchanged. Brotli is
+    offered only when the optional `brotli` package is installed. A strong
+    ETag gets the encoding as a suffix, since the bytes differ per encoding.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        encoding = _negotiate(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+            if message['type'] != 'http.response.body' or passthrough:
+                return await send(message)
+            if start is not None:
+                headers = MutableHeaders(raw=start['headers'])
+                body = message.get('body', b'')
+                if (
+                    message.get('more_body', False)
+                    or len(body) < self.minimum_size
+                    or 'content-encoding' in headers
+                    or not headers.get('content-type', '').startswith(COMPRESSIBLE_TYPES)
+                ):
+                    passthrough = True
+                    if start['status'] == 304:
+                        # Revalidations answer with the validator of the variant the client holds
+                        _mark_variant(headers, encoding)
+                    await send(start)
+                    start = None
+                    return await send(message)
+                body = await run_cpu(compress, body, encoding, size=len(body))
+                headers['content-encoding'] = encoding
+                headers['content-length'] = str(len(body))
+                _mark_variant(headers, encoding)
+                await send(start)
+                start = None
+                await send({'type': 'http.response.body', 'body': body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,175 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import logfire
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_scope: ContextVar[Optional[dict]] = ContextVar('cdpmd_request_scope', default=None)
+_collectors: List[Callable[[], None]] = []
+_registry: List['Metric'] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """Base class for in-process metrics rendered in Prometheus text format."""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {value}')
+        return lines
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> per-bucket counts (+Inf last), sum, count
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, ("le", le))} {cumulative}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('cdpmd_request_seconds', 'HTTP request latency.', ('route', 'method', 'status'))
+STAGE_SECONDS = Histogram('cdpmd_stage_seconds', 'Latency of one stage of a request.', ('route', 'stage'))
+CACHE_REQUESTS = Counter('cdpmd_cache_requests_total', 'Cache lookups by outcome.', ('cache', 'outcome'))
+
+
+def add_collector(collector: Callable[[], None]):
+    """Register a callback that refreshes gauges right before `/metrics` is rendered."""
+    _collectors.append(collector)
+
+def render_prometheus() -> str:
+    for collector in _collectors:
+        collector()
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def current_route() -> str:
+    """Route template of the request being handled, e.g. `/patients/{patient_id}`."""
+    scope = _scope.get()
+    if scope is None:
+        return 'background'
+    if 'endpoint' not in scope:
+        return 'unmatched'
+    names = {str(value): name for name, value in (scope.get('path_params') or {}).items()}
+    return '/'.join(
+        '{' + names[segment] + '}' if segment in names else segment
+        for segment in scope.get('path', '').split('/')
+    )
+
+@contextmanager
+def stage(name: str, **attributes) -> Iterator[None]:
+    """Time one stage of the current request as a logfire span and a histogram sample."""
+    route = current_route()
+    started = time.perf_counter()
+    try:
+        with logfire.span('{route} {stage}', route=route, stage=name, **attributes):
+            yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, route=route, stage=name)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency and exposing the scope to `stage`."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        token = _scope.set(scope)
+        status = {'code': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                route=current_route(),
+                method=scope.get('method', ''),
+                status=status['code']
+            )
+            _scope.reset(token)
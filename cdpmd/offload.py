@@ -0,0 +1,46 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from cdpmd.profiler import current_profile
+
+
+OFFLOAD_EXECUTOR = os.getenv('OFFLOAD_EXECUTOR', 'thread').lower()
+OFFLOAD_WORKERS = int(os.getenv('OFFLOAD_WORKERS', min(8, os.cpu_count() or 1)))
+OFFLOAD_MIN_BYTES = int(os.getenv('OFFLOAD_MIN_BYTES', 256 * 1024))
+OFFLOAD_MIN_ITEMS = int(os.getenv('OFFLOAD_MIN_ITEMS', 500))
+
+_executor: Optional[Executor] = None
+
+
+def get_executor() -> Optional[Executor]:
+    """Shared executor for CPU-bound stages; None when `OFFLOAD_EXECUTOR=none`."""
+    global _executor
+    if _executor is None and OFFLOAD_EXECUTOR in ('thread', 'process'):
+        if OFFLOAD_EXECUTOR == 'process':
+            _executor = ProcessPoolExecutor(max_workers=OFFLOAD_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=OFFLOAD_WORKERS, thread_name_prefix='cdpmd-cpu')
+    return _executor
+
+async def run_cpu(func: Callable, *args, size: int = 0, threshold: int = OFFLOAD_MIN_BYTES, **kwargs) -> Any:
+    """Run `func` off the event loop when the work is big enough to matter.
+
+    Args:
+        func: Callable to run. Must be picklable (module level) for the process pool.
+        size: Size of the work, in the same unit as `threshold`.
+        threshold: Work below this size runs inline, where the executor
+            hand-off would cost more than it saves.
+    """
+    executor = get_executor()
+    if executor is None or size < threshold:
+        return func(*args, **kwargs)
+    profile = current_profile()
+    if profile is not None and OFFLOAD_EXECUTOR == 'thread':
+        # Worker thread samples belong to the request being profiled
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(profile.track, func, *args, **kwargs)
+        )
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,101 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from cdpmd.schemas import ResourceType
+from cdpmd.fhir_client import FHIRClient
+from cdpmd.metrics import stage, CACHE_REQUESTS
+
+
+PATIENT_PAGE_SIZE = int(os.getenv('PATIENT_PAGE_SIZE', 50))
+PATIENT_PAGE_TTL = float(os.getenv('PATIENT_PAGE_TTL', 300))
+PATIENT_PAGE_SESSIONS = int(os.getenv('PATIENT_PAGE_SESSIONS', 1000))
+SESSION_KEY = 'patient_pages'
+
+
+def session_key(session: dict, meldrx_base_url: str) -> str:
+    """Key of the page cache of a browser session and workspace, created on first use."""
+    if SESSION_KEY not in session:
+        session[SESSION_KEY] = uuid.uuid4().hex
+    return hashlib.sha256(f'{session[SESSION_KEY]}:{meldrx_base_url}'.encode()).hexdigest()
+
+
+class PatientPages:
+    """Pages of the workspace's patient list, fetched with `_count` and cached per session.
+
+    A page is fetched by following the Bundle `next` link of the page
+    before it, so any page can be reached without the server supporting
+    offsets. Expired or evicted pages are refetched from the nearest cached
+    page that still has its link. The least recently used sessions are
+    dropped beyond `max_sessions`.
+    """
+
+    def __init__(self, page_size: int = PATIENT_PAGE_SIZE, ttl: float = PATIENT_PAGE_TTL, max_sessions: int = PATIENT_PAGE_SESSIONS):
+        """
+        Args:
+            page_size: Patients requested per page (`_count`).
+            ttl: Seconds a fetched page is served from the cache.
+            max_sessions: Sessions whose pages are kept.
+        """
+        self.page_size = page_size
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.name = 'patient_pages'
+        # Session key -> page number -> (expiration, patients, next URL)
+        self._sessions: OrderedDict[str, Dict[int, Tuple[float, List[dict], Optional[str]]]] = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _pages(self, key: str) -> Dict[int, Tuple[float, List[dict], Optional[str]]]:
+        if key in self._sessions:
+            self._sessions.move_to_end(key)
+        else:
+            self._sessions[key] = {}
+            while len(self._sessions) > self.max_sessions:
+                evicted, _ = self._sessions.popitem(last=False)
+                self._locks.pop(evicted, None)
+        return self._sessions[key]
+
+    async def page(self, client: FHIRClient, key: str, number: int) -> Tuple[List[dict], bool]:
+        """Patients of page `number` (from 0) and whether another page follows.
+
+        Args:
+            client: Client for the workspace's FHIR server.
+            key: Session key, from `session_key`.
+            number: Page number.
+        """
+        # Concurrent scroll requests of one session share a fetch
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            pages = self._pages(key)
+            now = time.time()
+            cached = pages.get(number)
+            if cached is not None and now < cached[0]:
+                CACHE_REQUESTS.inc(cache=self.name, outcome='hit')
+                return cached[1], cached[2] is not None
+            if any(n < number and url is None and now < expiration for n, (expiration, _, url) in pages.items()):
+                return [], False
+            CACHE_REQUESTS.inc(cache=self.name, outcome='miss')
+
+            # Start from the closest earlier page whose next link we still hold
+            start = max((n for n, (_, _, url) in pages.items() if n < number and url), default=-1)
+            url = pages[start][2] if start >= 0 else None
+            for current in range(start + 1, number + 1):
+                with stage(f'fhir.{ResourceType.patient.value}'):
+                    patients, next_url = await client.read_page(
+                        ResourceType.patient.value,
+                        params={'_count': self.page_size},
+                        url=url
+                    )
+                pages[current] = (now + self.ttl, patients, next_url)
+                if next_url is None:
+                    break
+                url = next_url
+            if number not in pages:
+                return [], False
+            return pages[number][1], pages[number][2] is not None
+
+
+patient_pages = PatientPages()
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Tuple
+
+from cdpmd.schemas import Priority
+from cdpmd.utils import fhir_cache, get_resources
+from cdpmd.agent import cache as predictor_cache, predictor_query
+from cdpmd.risk import prescreen
+from cdpmd.metrics import Counter
+
+
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'true').lower() == 'true'
+PREFETCH_PREDICTIONS = os.getenv('PREFETCH_PREDICTIONS', 'false').lower() == 'true'
+PREFETCH_SESSION_CONCURRENCY = int(os.getenv('PREFETCH_SESSION_CONCURRENCY', 2))
+PREFETCH_SESSION_RATE = int(os.getenv('PREFETCH_SESSION_RATE', 20))
+PREFETCH_MAX_CONCURRENCY = int(os.getenv('PREFETCH_MAX_CONCURRENCY', 8))
+PREFETCH_SESSIONS = int(os.getenv('PREFETCH_SESSIONS', 1000))
+
+PREFETCH_REQUESTS = Counter('cdpmd_prefetch_requests_total', 'Speculative prefetch triggers by outcome.', ('outcome',))
+
+CACHED, PENDING, LIMITED, STARTED, DISABLED = 'cached', 'pending', 'limited', 'started', 'disabled'
+
+
+class Prefetcher:
+    """Warms the FHIR cache, and optionally the prediction, of a patient before it is opened.
+
+    Triggers for a patient already cached or being prefetched are dropped.
+    Each session may run `session_concurrency` prefetches at once and start
+    `session_rate` per minute; all sessions share `max_concurrency` FHIR
+    fetches. Predictions are queued at `Priority.prefetch`, so they never
+    delay an interactive request.
+    """
+
+    def __init__(
+        self,
+        predictions: bool = PREFETCH_PREDICTIONS,
+        session_concurrency: int = PREFETCH_SESSION_CONCURRENCY,
+        session_rate: int = PREFETCH_SESSION_RATE,
+        max_concurrency: int = PREFETCH_MAX_CONCURRENCY,
+        max_sessions: int = PREFETCH_SESSIONS,
+    ):
+        """
+        Args:
+            predictions: Also queue a background prediction after the FHIR fetch.
+            session_concurrency: Prefetches a session may run at once.
+            session_rate: Prefetches a session may start per minute.
+            max_concurrency: FHIR prefetches running at once across sessions.
+            max_sessions: Sessions whose limits are tracked.
+        """
+        self.predictions = predictions
+        self.session_concurrency = session_concurrency
+        self.session_rate = session_rate
+        self.max_sessions = max_sessions
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # (server, patient id) -> (session key, prefetch task, FHIR fetch)
+        self._pending: Dict[Tuple[str, str], Tuple[str, asyncio.Task, asyncio.Future]] = {}
+        # Session key -> start times within the last minute
+        self._starts: OrderedDict[str, deque] = OrderedDict()
+
+    def _allowed(self, session: str) -> bool:
+        running = sum(1 for owner, _, _ in self._pending.values() if owner == session)
+        if running >= self.session_concurrency:
+            return False
+        starts = self._starts.pop(session, None) or deque()
+        self._starts[session] = starts
+        while len(self._starts) > self.max_sessions:
+            self._starts.popitem(last=False)
+        now = time.monotonic()
+        while starts and now - starts[0] > 60:
+            starts.popleft()
+        if len(starts) >= self.session_rate:
+            return False
+        starts.append(now)
+        return True
+
+    def trigger(self, session: str, access_token: str, meldrx_base_url: str, patient_id: str, prescreen_first: bool = True) -> str:
+        """Start a prefetch unless it is unnecessary or over the session's limits.
+
+        Args:
+            session: Session key, from `session_key`.
+            access_token: Token for the FHIR server.
+            meldrx_base_url: FHIR server URL.
+            patient_id: Patient to prefetch.
+            prescreen_first: Skip the prediction when the risk pre-screen settles the patient.
+
+        Returns:
+            The outcome: `cached`, `pending`, `limited`, `started` or `disabled`.
+        """
+        key = (meldrx_base_url, patient_id)
+        if not PREFETCH_ENABLED:
+            outcome = DISABLED
+        elif key in self._pending:
+            outcome = PENDING
+        elif fhir_cache.fresh(patient_id) and (not self.predictions or predictor_cache.fresh(patient_id)):
+            outcome = CACHED
+        elif not self._allowed(session):
+            outcome = LIMITED
+        else:
+            fetched = asyncio.get_running_loop().create_future()
+            task = asyncio.create_task(self._prefetch(access_token, meldrx_base_url, patient_id, prescreen_first, fetched))
+            task.add_done_callback(lambda task: self._finished(key, task))
+            self._pending[key] = (session, task, fetched)
+            outcome = STARTED
+        PREFETCH_REQUESTS.inc(outcome=outcome)
+        return outcome
+
+    async def _prefetch(self, access_token: str, meldrx_base_url: str, patient_id: str, prescreen_first: bool, fetched: asyncio.Future):
+        try:
+            async with self._semaphore:
+                resources = await get_resources(access_token, meldrx_base_url, patient_id)
+        finally:
+            if not fetched.done():
+                fetched.set_result(None)
+        if not self.predictions or predictor_cache.fresh(patient_id):
+            return
+        patient, conditions, observations, medications, *_ = resources
+        if prescreen_first and not prescreen(conditions, observations, medications).needs_llm:
+            return
+        await predictor_query(*resources, priority=Priority.prefetch)
+
+    def _finished(self, key: Tuple[str, str], task: asyncio.Task):
+        self._pending.pop(key, None)
+        if not task.cancelled() and task.exception():
+            print(f'Prefetch of {key[1]} failed: {task.exception()!r}')
+
+    async def join(self, meldrx_base_url: str, patient_id: str):
+        """Wait for an in-flight prefetch's FHIR fetch, so the caller reads the cache instead of refetching."""
+        pending = self._pending.get((meldrx_base_url, patient_id))
+        if pending is not None:
+            await asyncio.shield(pending[2])
+
+
+prefetcher = Prefetcher()
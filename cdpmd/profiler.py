@@ -0,0 +1,194 @@
+import asyncio
+import hmac
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_SAMPLE_EVERY = int(os.getenv('PROFILE_SAMPLE_EVERY', 0))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 200))
+
+_active: ContextVar[Optional['RequestProfile']] = ContextVar('cdpmd_profile', default=None)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class RequestProfile:
+    """Stack samples of one request, written in collapsed (flame graph) format."""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started_at = datetime.now()
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.task = asyncio.current_task()
+        # Worker threads currently running offloaded work for this request
+        self.threads: Set[int] = set()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.name = '{}-{}.folded'.format(
+            self.started_at.strftime('%Y%m%dT%H%M%S%f'),
+            re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        )
+
+    def sample(self, frames: Dict[int, object]):
+        if asyncio.current_task(self.loop) is self.task and self.loop_thread in frames:
+            self.stacks[_collapse(frames[self.loop_thread])] += 1
+            self.samples += 1
+        for thread_id in list(self.threads):
+            if thread_id in frames:
+                self.stacks['[worker];' + _collapse(frames[thread_id])] += 1
+                self.samples += 1
+
+    def track(self, func: Callable, *args, **kwargs):
+        """Run `func` in a worker thread while attributing its samples to this request."""
+        thread_id = threading.get_ident()
+        self.threads.add(thread_id)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.threads.discard(thread_id)
+
+    def save(self, directory: str = PROFILE_DIR) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.name)
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+        _prune(directory)
+        return path
+
+
+class Sampler:
+    """Daemon thread sampling every active profile at a fixed interval."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.profiles: Set[RequestProfile] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self.profiles.add(profile)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='cdpmd-profiler', daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: RequestProfile):
+        with self._lock:
+            self.profiles.discard(profile)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                profiles = list(self.profiles)
+                if not profiles:
+                    # Stop sampling entirely while nothing is being profiled
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            for profile in profiles:
+                profile.sample(frames)
+
+
+sampler = Sampler(PROFILE_INTERVAL)
+
+
+def current_profile() -> Optional[RequestProfile]:
+    """Profile of the request being handled, if it is being profiled."""
+    return _active.get()
+
+def is_authorized(token: Optional[str]) -> bool:
+    """Whether `token` matches `PROFILE_TOKEN`; always False when no token is configured."""
+    return bool(PROFILE_TOKEN and token) and hmac.compare_digest(token, PROFILE_TOKEN)
+
+def _prune(directory: str):
+    files = sorted(
+        (os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.folded')),
+        key=os.path.getmtime
+    )
+    for path in files[:max(len(files) - PROFILE_MAX_FILES, 0)]:
+        os.remove(path)
+
+def list_profiles(directory: str = PROFILE_DIR) -> List[str]:
+    """Saved profile file names, newest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted((name for name in os.listdir(directory) if name.endswith('.folded')), reverse=True)
+
+def profile_path(name: str, directory: str = PROFILE_DIR) -> Optional[str]:
+    """Path of a saved profile, or None for unknown or unsafe names."""
+    if os.path.basename(name) != name or not name.endswith('.folded'):
+        return None
+    path = os.path.join(directory, name)
+    return path if os.path.isfile(path) else None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests on demand.
+
+    A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>`, or
+    when it is the N-th request with `PROFILE_SAMPLE_EVERY=N`. The saved
+    file name is returned in the `X-Profile-Id` response header. With
+    neither configured the middleware is a single attribute check per
+    request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_EVERY > 0
+        self._requests = itertools.count(1)
+
+    def _wants_profile(self, scope) -> bool:
+        if scope.get('path', '').startswith('/profiles'):
+            return False
+        if PROFILE_SAMPLE_EVERY > 0 and next(self._requests) % PROFILE_SAMPLE_EVERY == 0:
+            return True
+        headers = dict(scope.get('headers') or [])
+        # Only a header: query strings end up in access logs, history and Referer headers
+        return is_authorized(headers.get(b'x-profile', b'').decode() or None)
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope['type'] != 'http' or not self._wants_profile(scope):
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile(scope.get('path', ''))
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [(b'x-profile-id', profile.name.encode())]
+            await send(message)
+
+        token = _active.set(profile)
+        sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.remove(profile)
+            _active.reset(token)
+            try:
+                profile.save()
+            except OSError as e:
+                print(f'Failed to save profile {profile.name}: {e!r}')
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple, Union
+
+from cdpmd.fhirpath import index_fields
+
+
+REPLICA_ENABLED = os.getenv('REPLICA_ENABLED', 'false').lower() == 'true'
+REPLICA_PATH = os.getenv('REPLICA_PATH', 'replica.sqlite3')
+REPLICA_FULL_SYNC = float(os.getenv('REPLICA_FULL_SYNC', 24 * 3600))
+# Seconds a synced (type, patient) is served locally before the next incremental sync
+REPLICA_FRESHNESS = {
+    'Patient': 24 * 3600,
+    'Condition': 3600,
+    'CarePlan': 24 * 3600,
+    'RiskAssessment': 3600,
+    'MedicationRequest': 900,
+    'Encounter': 900,
+    'DiagnosticReport': 900,
+    'Observation': 300,
+    # Tasks are edited from the app itself, so always read them from the server
+    'Task': 0,
+    **json.loads(os.getenv('REPLICA_FRESHNESS', '{}')),
+}
+# Margin for clock skew between us and the server when syncing with _lastUpdated
+SYNC_OVERLAP = 60
+# Types whose deletions an incremental `_lastUpdated` search cannot see, so every sync is a full one
+FULL_SYNC_TYPES = {'Patient', 'Task'}
+
+FRESH, INCREMENTAL, FULL = 'fresh', 'incremental', 'full'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    server TEXT NOT NULL,
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    date TEXT,
+    code TEXT,
+    resource TEXT NOT NULL,
+    PRIMARY KEY (server, type, id)
+);
+CREATE INDEX IF NOT EXISTS resources_patient ON resources (server, type, patient_id, date, code);
+CREATE TABLE IF NOT EXISTS sync_state (
+    server TEXT NOT NULL,
+    type TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    full_synced_at REAL NOT NULL,
+    watermark TEXT NOT NULL,
+    PRIMARY KEY (server, type, patient_id)
+);
+"""
+
+
+class Replica:
+    """Local SQLite copy of fetched resources, indexed by (type, patient, date, code).
+
+    Each (server, type, patient) remembers when it was last synced. Within
+    the type's freshness window reads are served locally; after it the next
+    read syncs incrementally with `_lastUpdated`, and every
+    `REPLICA_FULL_SYNC` seconds fully, which also drops deleted resources.
+    """
+
+    def __init__(self, path: str = REPLICA_PATH, freshness: Optional[dict] = None, full_sync: float = REPLICA_FULL_SYNC):
+        """
+        Args:
+            path: SQLite database file.
+            freshness: Resource type -> seconds served locally after a sync.
+            full_sync: Seconds between full syncs of a (type, patient).
+        """
+        self.freshness = freshness or REPLICA_FRESHNESS
+        self.full_sync = full_sync
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    async def _run(self, func, *args):
+        # SQLite calls leave the event loop; the lock serialises them on the shared connection
+        def locked():
+            with self._lock:
+                return func(*args)
+        return await asyncio.to_thread(locked)
+
+    def _plan(self, server: str, resource_type: str, patient_id: str) -> Tuple[str, Optional[str]]:
+        row = self._connection.execute(
+            'SELECT synced_at, full_synced_at, watermark FROM sync_state WHERE server = ? AND type = ? AND patient_id = ?',
+            (server, resource_type, patient_id)
+        ).fetchone()
+        now = time.time()
+        if row is not None and now - row[0] < self.freshness.get(resource_type, 0):
+            return FRESH, None
+        if row is None or resource_type in FULL_SYNC_TYPES or now - row[1] >= self.full_sync:
+            return FULL, None
+        return INCREMENTAL, row[2]
+
+    async def plan(self, server: str, resource_type: str, patient_id: str) -> Tuple[str, Optional[str]]:
+        """How to serve a read: (`fresh`, None), (`incremental`, since) or (`full`, None)."""
+        return await self._run(self._plan, server, resource_type, patient_id)
+
+    def _read(self, server: str, resource_type: str, patient_id: str) -> List[dict]:
+        rows = self._connection.execute(
+            'SELECT resource FROM resources WHERE server = ? AND type = ? AND patient_id = ? ORDER BY date, id',
+            (server, resource_type, patient_id)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    async def read(self, server: str, resource_type: str, patient_id: str) -> Union[dict, List[dict], None]:
+        """Stored resources of a patient; the Patient resource itself for type `Patient`."""
+        resources = await self._run(self._read, server, resource_type, patient_id)
+        if resource_type == 'Patient':
+            return resources[0] if resources else None
+        return resources
+
+    def _write(self, server: str, resource_type: str, patient_id: str, resources: List[dict], full: bool):
+        started = time.time()
+        watermark = datetime.fromtimestamp(started - SYNC_OVERLAP, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        with self._connection:
+            if full:
+                self._connection.execute(
+                    'DELETE FROM resources WHERE server = ? AND type = ? AND patient_id = ?',
+                    (server, resource_type, patient_id)
+                )
+            rows = []
+            for resource in resources:
+                date, code = index_fields(resource)
+                rows.append((server, resource_type, resource.get('id'), patient_id, date, code, json.dumps(resource)))
+            self._connection.executemany('INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self._connection.execute(
+                """INSERT INTO sync_state VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (server, type, patient_id) DO UPDATE SET
+                    synced_at = excluded.synced_at,
+                    full_synced_at = CASE WHEN ? THEN excluded.full_synced_at ELSE full_synced_at END,
+                    watermark = excluded.watermark""",
+                (server, resource_type, patient_id, started, started, watermark, full)
+            )
+
+    async def write(self, server: str, resource_type: str, patient_id: str, resources: Union[dict, List[dict], None], full: bool = True):
+        """Store a server response; a full sync replaces what was stored for the (type, patient)."""
+        if resources is None:
+            return
+        if isinstance(resources, dict):
+            resources = [resources]
+        await self._run(self._write, server, resource_type, patient_id, resources, full)
+
+    def _invalidate(self, patient_id: str, resource_types: Optional[List[str]]):
+        query = 'UPDATE sync_state SET synced_at = 0 WHERE patient_id = ?'
+        params = [patient_id]
+        if resource_types:
+            query += f' AND type IN ({",".join("?" * len(resource_types))})'
+            params.extend(resource_types)
+        with self._connection:
+            self._connection.execute(query, params)
+
+    async def invalidate(self, patient_id: str, resource_types: Optional[List[str]] = None):
+        """Make the next read of these types sync (incrementally) instead of reading locally."""
+        await self._run(self._invalidate, patient_id, list(resource_types or []))
+
+
+replica: Optional[Replica] = Replica() if REPLICA_ENABLED else None
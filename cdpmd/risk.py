@@ -0,0 +1,173 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from cdpmd.schemas import (
+    PredictorAgentResponseSchema, PredictorCardDetails, Indicator,
+    RiskScreenResult
+)
+
+
+HBA1C_CODES = {'4548-4', '17856-6', '59261-8'}
+EGFR_CODES = {'33914-3', '48642-3', '48643-1', '62238-1', '77147-7', '98979-8'}
+GLUCOSE_CODES = {'2339-0', '2345-7', '15074-8', '41653-7', '14749-6', '99504-3'}
+HYPOGLYCEMIA_CODES = {'302866003', '237633009', '190448007', 'E16.0', 'E16.1', 'E16.2', 'E11.649', 'E11.641'}
+HYPOGLYCEMIA_MG_DL = 70.0
+MMOL_TO_MG_DL = 18.0
+
+MEDICATION_CLASSES = {
+    'insulin': ('insulin', 'glargine', 'lispro', 'aspart', 'detemir', 'degludec', 'nph'),
+    'sulfonylurea': ('glipizide', 'glyburide', 'glibenclamide', 'glimepiride', 'gliclazide'),
+    'metformin': ('metformin',),
+    'sglt2': ('gliflozin',),
+    'glp1': ('glutide', 'exenatide', 'tirzepatide'),
+}
+
+FEATURES = (
+    'hba1c_latest', 'hba1c_slope', 'egfr_latest', 'hypo_events',
+    'insulin', 'sulfonylurea', 'metformin', 'sglt2', 'glp1',
+)
+# Thresholds (upper bounds) for the score contribution of each feature
+HBA1C_BANDS = np.array([7.0, 8.0, 9.0, 10.0])
+EGFR_BANDS = np.array([30.0, 45.0, 60.0])
+
+
+def _codes(concept: Optional[dict]) -> set:
+    return {coding.get('code') for coding in (concept or {}).get('coding', []) or []}
+
+def _series(observations: List[dict], codes: set, glucose: bool = False) -> tuple:
+    """Values and day offsets (since epoch) of observations carrying one of `codes`."""
+    values, days = [], []
+    for obs in observations:
+        if not _codes(obs.get('code')) & codes:
+            continue
+        quantity = obs.get('valueQuantity') or {}
+        value = quantity.get('value')
+        if value is None:
+            continue
+        unit = str(quantity.get('unit') or quantity.get('code') or '').lower()
+        when = obs.get('effectiveDateTime') or obs.get('issued') or ''
+        try:
+            day = np.datetime64(when[:10], 'D').astype(np.int64)
+        except ValueError:
+            day = np.int64(0)
+        values.append(float(value) * (MMOL_TO_MG_DL if glucose and unit.startswith('mmol') else 1))
+        days.append(day)
+    values = np.asarray(values, dtype=np.float64)
+    days = np.asarray(days, dtype=np.float64)
+    order = np.argsort(days, kind='stable')
+    return values[order], days[order]
+
+def _medication_text(medication: dict) -> str:
+    concept = medication.get('medicationCodeableConcept') or {}
+    parts = [concept.get('text') or '']
+    parts += [coding.get('display') or '' for coding in concept.get('coding', []) or []]
+    parts.append((medication.get('medicationReference') or {}).get('display') or '')
+    return ' '.join(parts).lower()
+
+def extract_features(
+    conditions: Optional[List[dict]],
+    observations: Optional[List[dict]],
+    medications: Optional[List[dict]],
+) -> np.ndarray:
+    """Feature vector (ordered as `FEATURES`) for one patient; missing labs are NaN."""
+    conditions = conditions or []
+    observations = observations or []
+    medications = medications or []
+    features = np.full(len(FEATURES), np.nan)
+
+    hba1c, hba1c_days = _series(observations, HBA1C_CODES)
+    if hba1c.size:
+        features[0] = hba1c[-1]
+    if hba1c.size >= 2 and np.ptp(hba1c_days) > 0:
+        # Percentage points per year
+        features[1] = np.polyfit(hba1c_days / 365.25, hba1c, 1)[0]
+
+    egfr, _ = _series(observations, EGFR_CODES)
+    if egfr.size:
+        features[2] = egfr[-1]
+
+    glucose, _ = _series(observations, GLUCOSE_CODES, glucose=True)
+    coded_events = sum(1 for condition in conditions if _codes(condition.get('code')) & HYPOGLYCEMIA_CODES)
+    features[3] = coded_events + np.count_nonzero(glucose < HYPOGLYCEMIA_MG_DL)
+
+    texts = [_medication_text(medication) for medication in medications]
+    for i, keywords in enumerate(MEDICATION_CLASSES.values(), start=4):
+        features[i] = float(any(keyword in text for text in texts for keyword in keywords))
+    return features
+
+def risk_scores(features: np.ndarray) -> np.ndarray:
+    """Score one feature vector or a (patients, FEATURES) matrix; 0 means nothing actionable."""
+    features = np.atleast_2d(features)
+    hba1c, slope, egfr, hypo = features[:, 0], features[:, 1], features[:, 2], features[:, 3]
+    insulin, sulfonylurea, metformin = features[:, 4], features[:, 5], features[:, 6]
+
+    score = np.where(np.isnan(hba1c), 0, np.searchsorted(HBA1C_BANDS, np.nan_to_num(hba1c), side='right'))
+    score = score + np.where(np.nan_to_num(slope) >= 0.5, 1, 0)
+    score = score + np.where(np.isnan(egfr), 0, len(EGFR_BANDS) - np.searchsorted(EGFR_BANDS, np.nan_to_num(egfr), side='right'))
+    hypo_risk_meds = np.maximum(insulin, sulfonylurea)
+    score = score + np.minimum(hypo, 3) * (1 + np.nan_to_num(hypo_risk_meds))
+    score = score + np.where((np.nan_to_num(egfr, nan=np.inf) < 30) & (metformin > 0), 3, 0)
+    return score.astype(np.float64)
+
+def _card(summary: str, detail: str, indicator: Indicator) -> PredictorCardDetails:
+    return PredictorCardDetails(summary=summary, detail=detail, indicator=indicator.value, suggestions=[])
+
+def _cards(features: np.ndarray) -> List[PredictorCardDetails]:
+    values: Dict[str, float] = dict(zip(FEATURES, features.tolist()))
+    cards = []
+    hba1c = values['hba1c_latest']
+    if not np.isnan(hba1c):
+        indicator = Indicator.critical if hba1c >= 9 else Indicator.warning if hba1c >= 7 else Indicator.info
+        trend = ''
+        if not np.isnan(values['hba1c_slope']):
+            trend = f" HbA1c is changing by {values['hba1c_slope']:+.1f} percentage points per year."
+        cards.append(_card('Glycemic control', f'Latest HbA1c is {hba1c:.1f}%.{trend}', indicator))
+    else:
+        cards.append(_card('Glycemic control', 'No HbA1c result is available; consider ordering one.', Indicator.warning))
+
+    egfr = values['egfr_latest']
+    if not np.isnan(egfr):
+        indicator = Indicator.critical if egfr < 30 else Indicator.warning if egfr < 60 else Indicator.info
+        detail = f'Latest eGFR is {egfr:.0f} mL/min/1.73m2.'
+        if egfr < 30 and values['metformin']:
+            indicator = Indicator.critical
+            detail += ' Metformin is contraindicated below 30 mL/min/1.73m2.'
+        cards.append(_card('Kidney function', detail, indicator))
+
+    if values['hypo_events']:
+        on_risk_meds = values['insulin'] or values['sulfonylurea']
+        cards.append(_card(
+            'Hypoglycemia',
+            f"{values['hypo_events']:.0f} hypoglycemic event(s) recorded"
+            + (' while on insulin or a sulfonylurea.' if on_risk_meds else '.'),
+            Indicator.critical if on_risk_meds else Indicator.warning
+        ))
+    return cards
+
+def prescreen(
+    conditions: Optional[List[dict]],
+    observations: Optional[List[dict]],
+    medications: Optional[List[dict]],
+    threshold: float = 2.0,
+) -> RiskScreenResult:
+    """Score a patient locally and decide whether the LLM analysis is worth running.
+
+    Args:
+        conditions: Condition resources.
+        observations: Observation resources.
+        medications: MedicationRequest resources.
+        threshold: Minimum score that sends the patient to the LLM.
+
+    Returns:
+        The score, the gating decision and rule-based cards usable as a fallback.
+    """
+    features = extract_features(conditions, observations, medications)
+    score = float(risk_scores(features)[0])
+    cards = _cards(features)
+    actionable = any(card.indicator != Indicator.info.value for card in cards)
+    return RiskScreenResult(
+        score=score,
+        needs_llm=score >= threshold or actionable,
+        response=PredictorAgentResponseSchema(cards=cards),
+    )
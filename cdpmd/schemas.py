@@ -2,6 +2,7 @@ from typing import Literal
 from enum import Enum
 from dataclasses import dataclass
 from uuid import uuid4
+from datetime import datetime
 import random
 
 from pydantic import BaseModel, Field
@@ -38,6 +39,11 @@ class ActionType(Enum):
     update = 'update'
     delete = 'delete'
 
+class Priority(Enum):
+    interactive = 'interactive'
+    prefetch = 'prefetch'
+    batch = 'batch'
+
 class CardDetailsLinkType(Enum):
     absolute = 'absolute'
     smart = 'smart'
@@ -95,6 +101,39 @@ class PredictorCardDetails(BaseModel):
 class PredictorAgentResponseSchema(BaseModel):
     cards: list[PredictorCardDetails]
 
+class PatientPredictorReport(BaseModel):
+    patient_id: str
+    cards: list[PredictorCardDetails]
+
+class BatchPredictorAgentResponseSchema(BaseModel):
+    reports: list[PatientPredictorReport]
+
+class LLMCallRecord(BaseModel):
+    patient_id: str | None = None
+    started_at: datetime = Field(default_factory=datetime.now)
+    priority: str = Priority.interactive.value
+    cache_outcome: Literal['hit', 'miss'] = 'hit'
+    analysis: Literal['full', 'delta', 'unchanged'] | None = None
+    changed_resources: int | None = None
+    prompt_chars: int = 0
+    prompt_tokens_estimate: int = 0
+    section_chars: dict[str, int] = Field(default_factory=dict)
+    section_tokens_estimate: dict[str, int] = Field(default_factory=dict)
+    input_tokens: int | None = None
+    output_tokens: int | None = None
+    model_requests: int = 0
+    rate_limit_retries: int = 0
+    queue_seconds: float = 0.0
+    time_to_first_token: float | None = None
+    model_seconds: float | None = None
+    retry_seconds: float = 0.0
+    total_seconds: float | None = None
+
+class RiskScreenResult(BaseModel):
+    score: float
+    needs_llm: bool
+    response: PredictorAgentResponseSchema
+
 
 predictor_dummy_data = PredictorAgentResponseSchema(**{
     'cards': [
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+from cdpmd.fhir_client import FHIRClient
+from cdpmd.paging import patient_pages, PATIENT_PAGE_SESSIONS, PATIENT_PAGE_TTL
+
+
+SEARCH_RESULTS = int(os.getenv('SEARCH_RESULTS', 10))
+SEARCH_MAX_PAGES = int(os.getenv('SEARCH_MAX_PAGES', 200))
+# Seconds before a failed build of a session's index is retried
+SEARCH_RETRY_AFTER = float(os.getenv('SEARCH_RETRY_AFTER', 30))
+
+_TOKEN = re.compile(r'[a-z0-9-]+')
+
+
+def normalize(text: str) -> List[str]:
+    """Lowercase, accent-free tokens of `text`."""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return _TOKEN.findall(text)
+
+def _grams(token: str) -> Set[str]:
+    # Leading padding turns the first grams into prefix grams: '  s', ' sm'
+    padded = f'  {token}'
+    return {padded[start:start + 3] for start in range(len(padded) - 2)}
+
+def patient_tokens(patient: dict) -> List[str]:
+    """Searchable tokens of a Patient: names, identifier values and birth date."""
+    text = []
+    for name in patient.get('name') or []:
+        text += name.get('prefix') or []
+        text += name.get('given') or []
+        text.append(name.get('family') or '')
+        text.append(name.get('text') or '')
+    text += [identifier.get('value') or '' for identifier in patient.get('identifier') or []]
+    text.append(patient.get('birthDate') or '')
+    return list(dict.fromkeys(normalize(' '.join(text))))
+
+
+class PatientIndex:
+    """Trigram index over patient tokens, updated one patient at a time.
+
+    Each token is indexed by its trigrams plus two padded prefix grams, so
+    one- and two-letter terms match token prefixes and longer terms match
+    anywhere in a token. Candidates from the grams are checked against the
+    tokens, and patients must match every term of a query.
+    """
+
+    def __init__(self):
+        self.patients: Dict[str, dict] = {}
+        self._tokens: Dict[str, List[str]] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        # Monotonic time every page was indexed, and before which no build is started
+        self.built_at: Optional[float] = None
+        self.retry_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self.patients)
+
+    def complete(self, ttl: float = PATIENT_PAGE_TTL) -> bool:
+        """Whether every page was indexed within the last `ttl` seconds."""
+        return self.built_at is not None and time.monotonic() - self.built_at < ttl
+
+    def add(self, patients: Iterable[dict]):
+        """Index patients, replacing earlier versions of the same ids."""
+        for patient in patients:
+            patient_id = patient.get('id')
+            if not patient_id:
+                continue
+            self.remove(patient_id)
+            tokens = patient_tokens(patient)
+            self.patients[patient_id] = patient
+            self._tokens[patient_id] = tokens
+            for token in tokens:
+                for gram in _grams(token):
+                    self._grams.setdefault(gram, set()).add(patient_id)
+
+    def remove(self, patient_id: str):
+        for token in self._tokens.pop(patient_id, []):
+            for gram in _grams(token):
+                ids = self._grams.get(gram)
+                if ids is not None:
+                    ids.discard(patient_id)
+                    if not ids:
+                        del self._grams[gram]
+        self.patients.pop(patient_id, None)
+
+    def _term_matches(self, term: str) -> Set[str]:
+        if len(term) < 3:
+            return set(self._grams.get(f'  {term}'[-3:], ()))
+        grams = [term[start:start + 3] for start in range(len(term) - 2)]
+        candidates = set.intersection(*(self._grams.get(gram, set()) for gram in grams))
+        return {patient_id for patient_id in candidates if any(term in token for token in self._tokens[patient_id])}
+
+    def search(self, query: str, limit: int = SEARCH_RESULTS) -> List[dict]:
+        """Patients matching every term of `query`, prefix matches first."""
+        terms = normalize(query)
+        if not terms:
+            return []
+        matches = None
+        for term in sorted(terms, key=len, reverse=True):
+            found = self._term_matches(term)
+            matches = found if matches is None else matches & found
+            if not matches:
+                return []
+
+        def rank(patient_id: str):
+            tokens = self._tokens[patient_id]
+            prefixes = sum(any(token.startswith(term) for token in tokens) for term in terms)
+            return (-prefixes, tokens)
+        return [self.patients[patient_id] for patient_id in sorted(matches, key=rank)[:limit]]
+
+
+class PatientSearch:
+    """Search indexes per session, filled from the pages of the patient list.
+
+    Pages loaded by the list are indexed as they arrive; the first search of
+    a session also walks the remaining pages in the background, answering
+    from what is indexed so far until it is done. A complete index is rebuilt
+    into a fresh one after `ttl` seconds, so removed patients drop out, and
+    a failed build is retried only after `retry_after` seconds.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = PATIENT_PAGE_SESSIONS,
+        max_pages: int = SEARCH_MAX_PAGES,
+        ttl: float = PATIENT_PAGE_TTL,
+        retry_after: float = SEARCH_RETRY_AFTER,
+    ):
+        self.max_sessions = max_sessions
+        self.max_pages = max_pages
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self._indexes: OrderedDict[str, PatientIndex] = OrderedDict()
+        self._builds: Dict[str, asyncio.Task] = {}
+
+    def index(self, key: str) -> PatientIndex:
+        if key in self._indexes:
+            self._indexes.move_to_end(key)
+        else:
+            self._indexes[key] = PatientIndex()
+            while len(self._indexes) > self.max_sessions:
+                self._indexes.popitem(last=False)
+        return self._indexes[key]
+
+    def add(self, key: str, patients: Iterable[dict]):
+        self.index(key).add(patients)
+
+    async def _build(self, client: FHIRClient, key: str, index: PatientIndex):
+        async with client:
+            for number in range(self.max_pages):
+                patients, more = await patient_pages.page(client, key, number)
+                index.add(patients)
+                if not more:
+                    break
+        index.built_at = time.monotonic()
+        # A rebuild replaces the expired index only once it is complete
+        self._indexes[key] = index
+        self._indexes.move_to_end(key)
+        while len(self._indexes) > self.max_sessions:
+            self._indexes.popitem(last=False)
+
+    def ensure_built(self, client_factory, key: str) -> Optional[asyncio.Task]:
+        """Start indexing every page of the session's patient list, once.
+
+        Args:
+            client_factory: Returns a FHIR client; called only when a build starts.
+            key: Session key, from `session_key`.
+        """
+        index = self.index(key)
+        if index.complete(self.ttl) or time.monotonic() < index.retry_at:
+            return None
+        build = self._builds.get(key)
+        if build is None or build.done():
+            # Searches keep answering from an expired index while its replacement is built
+            target = PatientIndex() if index.built_at is not None else index
+            build = asyncio.ensure_future(self._build(client_factory(), key, target))
+            build.add_done_callback(lambda task: self._finished(key, task))
+            self._builds[key] = build
+        return build
+
+    def _finished(self, key: str, build: asyncio.Task):
+        if self._builds.get(key) is build:
+            del self._builds[key]
+        if not build.cancelled() and build.exception():
+            print(f'Patient index build failed: {build.exception()!r}')
+            self.index(key).retry_at = time.monotonic() + self.retry_after
+
+    def search(self, key: str, query: str, limit: int = SEARCH_RESULTS) -> List[dict]:
+        return self.index(key).search(query, limit)
+
+
+patient_search = PatientSearch()
@@ -0,0 +1,136 @@
+import hmac
+import os
+from typing import Dict, List, Optional, Set
+
+import logfire
+
+from cdpmd.schemas import ResourceType
+from cdpmd.fhir_client import FHIRClient
+from cdpmd.utils import fhir_cache, patient_id_of
+from cdpmd.agent import cache as predictor_cache
+from cdpmd.replica import replica
+from cdpmd.timeline import timeline_cache, invalidate_timelines
+from cdpmd.tasks import task_cache
+
+
+SUBSCRIPTION_SECRET = os.getenv('SUBSCRIPTION_SECRET')
+SUBSCRIPTION_TYPES = (
+    ResourceType.observation.value,
+    ResourceType.condition.value,
+    ResourceType.medication_request.value,
+    ResourceType.task.value,
+)
+# Resource types whose changes alter the data sent to the predictor
+PREDICTOR_INPUT_TYPES = {
+    ResourceType.patient.value,
+    ResourceType.condition.value,
+    ResourceType.observation.value,
+    ResourceType.medication_request.value,
+    ResourceType.encounter.value,
+    ResourceType.diagnostic_report.value,
+    ResourceType.risk_assessment.value,
+    ResourceType.care_plan.value,
+}
+SUBSCRIPTION_REASON = 'CDPMD cache invalidation'
+
+
+def subscription_resource(resource_type: str, endpoint: str, secret: Optional[str] = SUBSCRIPTION_SECRET) -> dict:
+    """R4 rest-hook Subscription notifying `endpoint` with the changed resource."""
+    channel = {
+        'type': 'rest-hook',
+        'endpoint': endpoint,
+        'payload': 'application/fhir+json',
+    }
+    if secret:
+        channel['header'] = [f'Authorization: Bearer {secret}']
+    return {
+        'resourceType': 'Subscription',
+        'status': 'requested',
+        'reason': SUBSCRIPTION_REASON,
+        'criteria': f'{resource_type}?',
+        'channel': channel,
+    }
+
+async def register_subscriptions(
+    client: FHIRClient,
+    endpoint: str,
+    resource_types: tuple = SUBSCRIPTION_TYPES,
+) -> List[dict]:
+    """Create the rest-hook Subscriptions of a workspace, skipping ones that already exist.
+
+    Args:
+        client: Client for the workspace's FHIR server.
+        endpoint: Absolute URL of the notification route.
+        resource_types: Resource types to subscribe to.
+
+    Returns:
+        The created Subscription resources.
+    """
+    existing = await client.search_resource('Subscription', {'url': endpoint})
+    subscribed = {
+        subscription.get('criteria', '').rstrip('?')
+        for subscription in (entry.get('resource') or {} for entry in existing.get('entry') or [])
+        if (subscription.get('channel') or {}).get('endpoint') == endpoint
+        and subscription.get('status') not in ('off', 'error')
+    }
+    created = []
+    for resource_type in resource_types:
+        if resource_type not in subscribed:
+            created.append(await client.create_resource('Subscription', subscription_resource(resource_type, endpoint)))
+    return created
+
+
+def is_authorized(authorization: Optional[str]) -> bool:
+    """Whether a notification carries the shared secret; always False when none is configured."""
+    if not SUBSCRIPTION_SECRET:
+        return False
+    return hmac.compare_digest(authorization or '', f'Bearer {SUBSCRIPTION_SECRET}')
+
+def changed_patients(notification: Optional[dict]) -> Dict[str, Set[str]]:
+    """Patient id -> resource types changed, from an R4 resource payload or a notification Bundle."""
+    if not notification:
+        return {}
+    if notification.get('resourceType') == 'Bundle':
+        resources = [entry.get('resource') or {} for entry in notification.get('entry') or []]
+    else:
+        resources = [notification]
+    changes: Dict[str, Set[str]] = {}
+    for resource in resources:
+        patient_id = patient_id_of(resource)
+        if patient_id:
+            changes.setdefault(patient_id, set()).add(resource['resourceType'])
+    return changes
+
+async def handle_notification(notification: Optional[dict]) -> Dict[str, List[str]]:
+    """Invalidate the cache entries of every patient a notification touches.
+
+    Changes to predictor inputs drop the patient's FHIR record and
+    prediction; the next view refetches and re-analyses only the delta.
+    Task changes drop only the patient's cached Tasks.
+
+    Returns:
+        Patient id -> names of the caches invalidated.
+    """
+    invalidated = {}
+    for patient_id, resource_types in changed_patients(notification).items():
+        caches = []
+        if replica:
+            await replica.invalidate(patient_id, sorted(resource_types))
+            caches.append('replica')
+        if resource_types & PREDICTOR_INPUT_TYPES:
+            if await fhir_cache.invalidate(patient_id):
+                caches.append(fhir_cache.name)
+            if await predictor_cache.invalidate(patient_id):
+                caches.append(predictor_cache.name)
+        if ResourceType.observation.value in resource_types and await invalidate_timelines(patient_id):
+            caches.append(timeline_cache.name)
+        if ResourceType.task.value in resource_types and task_cache.invalidate(patient_id):
+            caches.append(task_cache.name)
+        invalidated[patient_id] = caches
+        logfire.info(
+            'subscription notification for {patient_id}',
+            patient_id=patient_id,
+            resource_types=sorted(resource_types),
+            invalidated=caches,
+        )
+    return invalidated
@@ -0,0 +1,91 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from cdpmd.schemas import ResourceType
+from cdpmd.metrics import CACHE_REQUESTS, stage
+from cdpmd.utils import get_meldrx_client
+
+
+TASK_CACHE_TTL = float(os.getenv('TASK_CACHE_TTL', 300))
+TASK_CACHE_PATIENTS = int(os.getenv('TASK_CACHE_PATIENTS', 5000))
+
+
+class TaskCache:
+    """Tasks per (server, patient), patched write-through from the app's own Task writes.
+
+    A read after `ttl` seconds, or after a Subscription notification
+    invalidated the patient, refetches the Tasks from the server. Reads
+    bypass the replica, whose incremental syncs cannot see deleted Tasks.
+    """
+
+    def __init__(self, ttl: float = TASK_CACHE_TTL, max_patients: int = TASK_CACHE_PATIENTS):
+        self.ttl = ttl
+        self.max_patients = max_patients
+        self.name = 'task_cache'
+        # (server, patient id) -> (expiration, Task id -> Task)
+        self._entries: OrderedDict[Tuple[str, str], Tuple[float, Dict[str, dict]]] = OrderedDict()
+
+    def cached(self, meldrx_base_url: str, patient_id: str) -> Optional[Dict[str, dict]]:
+        """Task id -> Task of a patient, or None when not cached or expired."""
+        entry = self._entries.get((meldrx_base_url, patient_id))
+        if entry is None or time.time() >= entry[0]:
+            return None
+        self._entries.move_to_end((meldrx_base_url, patient_id))
+        return entry[1]
+
+    def _put(self, meldrx_base_url: str, patient_id: str, tasks: List[dict]):
+        self._entries[(meldrx_base_url, patient_id)] = (time.time() + self.ttl, {task['id']: task for task in tasks})
+        self._entries.move_to_end((meldrx_base_url, patient_id))
+        while len(self._entries) > self.max_patients:
+            self._entries.popitem(last=False)
+
+    async def tasks(self, access_token: str, meldrx_base_url: str, patient_id: str) -> List[dict]:
+        """The patient's Tasks, from the cache or read through from the server."""
+        cached = self.cached(meldrx_base_url, patient_id)
+        if cached is not None:
+            CACHE_REQUESTS.inc(cache=self.name, outcome='hit')
+            return list(cached.values())
+        CACHE_REQUESTS.inc(cache=self.name, outcome='miss')
+        try:
+            async with get_meldrx_client(access_token, meldrx_base_url) as client:
+                with stage(f'fhir.{ResourceType.task.value}'):
+                    tasks = await client.read_resource(ResourceType.task.value, params={'patient': patient_id})
+        except httpx.HTTPStatusError as e:
+            print(f"FHIR API error for {ResourceType.task.value}: {e}")
+            return []
+        self._put(meldrx_base_url, patient_id, tasks)
+        return tasks
+
+    def find(self, meldrx_base_url: str, patient_id: str, focus: str) -> Optional[dict]:
+        """Cached Task of a patient whose focus is the `focus` reference."""
+        for task in (self.cached(meldrx_base_url, patient_id) or {}).values():
+            if (task.get('focus') or {}).get('reference') == focus:
+                return task
+        return None
+
+    def upsert(self, meldrx_base_url: str, patient_id: str, task: dict):
+        """Store a Task returned by a create or update; a no-op when the patient is not cached."""
+        cached = self.cached(meldrx_base_url, patient_id)
+        if cached is not None:
+            cached[task['id']] = task
+
+    def remove(self, meldrx_base_url: str, patient_id: str, task_id: str):
+        cached = self.cached(meldrx_base_url, patient_id)
+        if cached is not None:
+            cached.pop(task_id, None)
+
+    def invalidate(self, patient_id: str) -> bool:
+        """Drop a patient's Tasks on every server; returns whether any were cached."""
+        keys = [key for key in self._entries if key[1] == patient_id]
+        for key in keys:
+            del self._entries[key]
+        if keys:
+            CACHE_REQUESTS.inc(cache=self.name, outcome='invalidated')
+        return bool(keys)
+
+
+task_cache = TaskCache()
@@ -0,0 +1,137 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cdpmd.risk import GLUCOSE_CODES, HBA1C_CODES, MMOL_TO_MG_DL, _codes
+from cdpmd.utils import AsyncCache
+
+
+# Series name -> (codes, values in mmol/L are converted to mg/dL, unit)
+TIMELINE_SERIES = {
+    'glucose': (GLUCOSE_CODES, True, 'mg/dL'),
+    'hba1c': (HBA1C_CODES, False, '%'),
+}
+# Window name -> days before the latest reading, None for the whole history
+TIMELINE_WINDOWS = {'14d': 14, '90d': 90, '1y': 365, 'all': None}
+TIMELINE_DEFAULT_WIDTH = int(os.getenv('TIMELINE_DEFAULT_WIDTH', 600))
+TIMELINE_MAX_WIDTH = int(os.getenv('TIMELINE_MAX_WIDTH', 2000))
+# Widths are rounded to this step so resized charts share cache entries
+TIMELINE_WIDTH_STEP = 50
+
+timeline_cache = AsyncCache(os.getenv('TIMELINE_CACHE_TTL') or os.getenv('CACHE_TTL') or None, 'timeline_cache.json')
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Largest-Triangle-Three-Buckets downsampling of a series sorted by `x`.
+
+    Keeps the first and last points and, from each of `threshold - 2` equal
+    buckets in between, the point forming the largest triangle with the
+    point kept from the previous bucket and the mean of the next one, so
+    peaks and dips survive the reduction.
+
+    Args:
+        x: Sorted x values.
+        y: y values.
+        threshold: Number of points to keep.
+
+    Returns:
+        The kept x and y values.
+    """
+    n = x.size
+    if threshold >= n or threshold < 3:
+        return x, y
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    counts = np.diff(edges)
+    # Bucket means, shifted by one: the "next bucket" of the last bucket is the last point
+    next_x = np.append(np.add.reduceat(x[:n - 1], edges[:-1])[1:] / counts[1:], x[-1])
+    next_y = np.append(np.add.reduceat(y[:n - 1], edges[:-1])[1:] / counts[1:], y[-1])
+
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        px, py = x[previous], y[previous]
+        areas = np.abs((px - next_x[bucket]) * (y[start:stop] - py) - (px - x[start:stop]) * (next_y[bucket] - py))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return x[kept], y[kept]
+
+def series_points(observations: Optional[List[dict]], series: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Timestamps (epoch seconds) and values of a series, sorted by time."""
+    codes, glucose, _ = TIMELINE_SERIES[series]
+    times, values = [], []
+    for obs in observations or []:
+        if not _codes(obs.get('code')) & codes:
+            continue
+        quantity = obs.get('valueQuantity') or {}
+        value = quantity.get('value')
+        when = obs.get('effectiveDateTime') or obs.get('issued')
+        if value is None or not when:
+            continue
+        unit = str(quantity.get('unit') or quantity.get('code') or '').lower()
+        # Offsets are dropped; a few hours do not move a point on a months-wide chart
+        times.append(when[:19])
+        values.append(float(value) * (MMOL_TO_MG_DL if glucose and unit.startswith('mmol') else 1))
+    try:
+        times = np.array(times, dtype='datetime64[s]').astype(np.float64)
+    except ValueError:
+        parsed = []
+        for when in times:
+            try:
+                parsed.append(np.datetime64(when, 's').astype(np.float64))
+            except ValueError:
+                parsed.append(np.nan)
+        times = np.array(parsed, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(times)
+    times, values = times[valid], values[valid]
+    order = np.argsort(times, kind='stable')
+    return times[order], values[order]
+
+def downsample(observations: Optional[List[dict]], series: str, window: str, width: int) -> Dict:
+    """Chart-ready timeline of a series: at most one point per horizontal pixel.
+
+    Args:
+        observations: The patient's Observations.
+        series: Key of `TIMELINE_SERIES`.
+        window: Key of `TIMELINE_WINDOWS`.
+        width: Chart width in pixels.
+
+    Returns:
+        The series' unit, total and kept point counts, value range and
+        `[epoch seconds, value]` points.
+    """
+    times, values = series_points(observations, series)
+    days = TIMELINE_WINDOWS[window]
+    if days is not None and times.size:
+        start = np.searchsorted(times, times[-1] - days * 86400, side='left')
+        times, values = times[start:], values[start:]
+    kept_times, kept_values = lttb(times, values, width)
+    return {
+        'series': series,
+        'window': window,
+        'unit': TIMELINE_SERIES[series][2],
+        'total': int(times.size),
+        'min': float(values.min()) if values.size else None,
+        'max': float(values.max()) if values.size else None,
+        'points': [[int(time), round(float(value), 2)] for time, value in zip(kept_times, kept_values)],
+    }
+
+def chart_width(width: Optional[str]) -> int:
+    """Requested chart width, rounded to `TIMELINE_WIDTH_STEP` and clamped."""
+    try:
+        width = int(float(width))
+    except (TypeError, ValueError):
+        width = TIMELINE_DEFAULT_WIDTH
+    width = int(round(width / TIMELINE_WIDTH_STEP)) * TIMELINE_WIDTH_STEP
+    return max(TIMELINE_WIDTH_STEP * 2, min(width, TIMELINE_MAX_WIDTH))
+
+def timeline_key(patient_id: str, meldrx_base_url: str, series: str, window: str, width: int) -> str:
+    # The patient id leads, so a notification without the server can still drop its timelines
+    return f'{patient_id}:{meldrx_base_url}:{series}:{window}:{width}'
+
+async def invalidate_timelines(patient_id: str) -> bool:
+    """Drop every cached timeline of a patient, on every server; returns whether there was one."""
+    return await timeline_cache.invalidate_prefix(f'{patient_id}:') > 0
@@ -1,16 +1,22 @@
 from fasthtml.common import *
 
+from cdpmd.fhirpath import SUMMARY_RULES
+from cdpmd.schemas import ResourceType
 from cdpmd.utils import calculate_age
 
 
 def about_patient(patient: dict):
+    extracted = SUMMARY_RULES.run([patient], ResourceType.patient.value)
+    given_name = next(iter(extracted['given_name']), '')
+    family_name = next(iter(extracted['family_name']), '')
+    gender = next(iter(extracted['gender']), 'unknown')
     return Div(
         Span(
-            f'{patient['name'][0]['given'][0]} {patient['name'][0]['family']} ',
+            f'{given_name} {family_name} ',
             cls='has-text-weight-bold is-size-2'
         ),
         Span(
-            f'-- {str(patient['gender']).capitalize()} -- {calculate_age(str(patient['birthDate']))} years old',
+            f'-- {str(gender).capitalize()} -- {calculate_age(str(patient["birthDate"]))} years old',
             cls='is-size-4 has-text-weight-medium'
         ),
         cls='mb-5',
@@ -5,12 +5,12 @@ from cdpmd.ui.patients_list import patients_list
 from cdpmd.ui.patient_space import patient_space
 
 
-def auth_home(patients: list[dict]):
+def auth_home(patients: list[dict], next_page: int | None = None):
     return Div(
         header(),
         Div(
             Div(
-                patients_list(patients=patients),
+                patients_list(patients=patients, next_page=next_page),
                 patient_space(),
                 cls='grid is-gap-3',
                 id="patient-details"
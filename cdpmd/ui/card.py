@@ -65,7 +65,7 @@ def card(card: PredictorCardDetails, patient_id: str | None):
                                                 resourceId=action.resourceId
                                             ),
                                             hx_post=f'/actions/{patient_id}',
-                                            hx_target='#task_bar',
+                                            hx_swap='none',
                                             hx_disabled_elt='this',
                                         ),
                                         cls='action',
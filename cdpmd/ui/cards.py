@@ -1,12 +1,14 @@
 from fasthtml.common import *
 
 from cdpmd.ui.card import card
+from cdpmd.ui.fragments import fragment_cache, card_key
 from cdpmd.schemas import PredictorAgentResponseSchema
 
 
 def cards(response: PredictorAgentResponseSchema, patient_id: str | None):
     return Div(
         *[
-            card(card_details, patient_id) for card_details in response.cards
+            fragment_cache.render(card_key(card_details, patient_id), card, card_details, patient_id)
+            for card_details in response.cards
         ],
     )
\ No newline at end of file
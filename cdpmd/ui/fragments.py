@@ -0,0 +1,66 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from fasthtml.common import *
+
+from cdpmd.metrics import CACHE_REQUESTS
+from cdpmd.schemas import PredictorCardDetails
+
+
+FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', 5000))
+# Generated ids that are not rendered, so cards differing only in them share HTML
+CARD_UNRENDERED_FIELDS = {'uuid': True, 'suggestions': {'__all__': {'uuid'}}}
+
+
+class FragmentCache:
+    """LRU of rendered HTML fragments, embedded in FT trees as `NotStr`.
+
+    Rendering may run on offload threads, so entries are guarded by a lock.
+    """
+
+    def __init__(self, max_entries: int = FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.name = 'fragments'
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, key: str, component: Callable, *args, **kwargs) -> NotStr:
+        """HTML of `component(*args, **kwargs)`, built only when `key` is not cached."""
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+        if html is not None:
+            CACHE_REQUESTS.inc(cache=self.name, outcome='hit')
+            return NotStr(html)
+        CACHE_REQUESTS.inc(cache=self.name, outcome='miss')
+        html = to_xml(component(*args, **kwargs))
+        with self._lock:
+            self._entries[key] = html
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return NotStr(html)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def card_key(card: PredictorCardDetails, patient_id: str | None) -> str:
+    """Hash of everything a card renders."""
+    content = card.model_dump_json(exclude=CARD_UNRENDERED_FIELDS)
+    return 'card:' + hashlib.sha256(f'{patient_id}:{content}'.encode()).hexdigest()
+
+def task_key(task: dict) -> str:
+    """Task id and `meta.versionId`, or a hash of the Task when the server sends no version."""
+    version = (task.get('meta') or {}).get('versionId')
+    if version:
+        return f'task:{task.get("id")}:{version}'
+    return 'task:' + hashlib.sha256(json.dumps(task, sort_keys=True, default=str).encode()).hexdigest()
+
+
+fragment_cache = FragmentCache()
@@ -4,13 +4,20 @@ from cdpmd.ui.loader import loader
 
 
 def patient_row(patient: dict):
-    return Button(
-        f"{patient['name'][0]['prefix'][0]} {patient['name'][0]['given'][0]} {patient['name'][0]['family']}",
-        loader(),
-        hx_get=f'/patients/{patient['id']}',
-        hx_target='#patient-details-grid',
-        hx_indicator='#loader',
-        cls='button is-text is-medium is-fullwidth is-justify-content-left has-text-weight-normal',
-        hx_disabled_elt='this',
-        style='text-decoration: none;'
+    return Div(
+        Button(
+            f"{patient['name'][0]['prefix'][0]} {patient['name'][0]['given'][0]} {patient['name'][0]['family']}",
+            loader(),
+            hx_get=f'/patients/{patient['id']}',
+            hx_target='#patient-details-grid',
+            hx_indicator='#loader',
+            cls='button is-text is-medium is-fullwidth is-justify-content-left has-text-weight-normal',
+            hx_disabled_elt='this',
+            style='text-decoration: none;'
+        ),
+        # Warms the caches before the click; the button must not inherit these attributes
+        hx_post=f'/prefetch/{patient['id']}',
+        hx_trigger='mouseenter once, focusin once, intersect once delay:1s',
+        hx_swap='none',
+        hx_disinherit='*',
     )
\ No newline at end of file
@@ -4,21 +4,47 @@ from cdpmd.ui.loader import loader
 from cdpmd.ui.patient_row import patient_row
 
 
-def patients_list(patients: list[dict]):
+def patient_rows(patients: list[dict], next_page: int | None = None):
+    return (
+        *[
+            Li(
+                patient_row(patient),
+                cls='my-3 is-size-4',
+            ) for patient in patients
+        ],
+        Li(
+            Span(cls='button is-loading is-text is-fullwidth', style='border: none;'),
+            hx_get=f'/patient-list?page={next_page}',
+            hx_trigger='intersect once',
+            hx_swap='outerHTML',
+        ) if next_page is not None else None,
+    )
+
+def patients_list(patients: list[dict], next_page: int | None = None):
     return Div(
         P(
             'Patients',
             cls='is-size-3 has-text-weight-medium'
         ),
+        Input(
+            type='search',
+            name='q',
+            placeholder='Search by name, identifier or birth date',
+            hx_get='/search/patients',
+            hx_trigger='input changed delay:150ms, search',
+            hx_target='#patient-search-results',
+            cls='input',
+            autocomplete='off',
+        ),
+        Ul(
+            id='patient-search-results',
+            cls='my-3',
+            style='list-style-type: none;',
+        ),
         Ul(
-            *[
-                Li(
-                    patient_row(patient),
-                    cls='my-3 is-size-4',
-                ) for patient in patients
-            ],
+            *patient_rows(patients, next_page),
             cls='my-5'
         ),
         cls='cell is-col-span-3',
         style='overflow-y:auto;'
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,14 @@
+from fasthtml.common import *
+
+from cdpmd.offload import run_cpu, OFFLOAD_MIN_ITEMS
+from cdpmd.metrics import stage
+
+
+def render_component(component, *args, **kwargs) -> str:
+    return to_xml(component(*args, **kwargs))
+
+async def render(component, *args, size: int = 0, **kwargs) -> HTMLResponse:
+    """Build and serialise `component(*args, **kwargs)`, off the event loop for large trees."""
+    with stage('render'):
+        html = await run_cpu(render_component, component, *args, size=size, threshold=OFFLOAD_MIN_ITEMS, **kwargs)
+    return HTMLResponse(html)
\ No newline at end of file
@@ -2,10 +2,20 @@ from typing import Literal
 
 from fasthtml.common import *
 
+from cdpmd.schemas import ActionType
 from cdpmd.ui.task_card import task_card
+from cdpmd.ui.fragments import fragment_cache, task_key
 
 
-def task_bar(tasks: list[dict] | None):
+def task_item(task: dict, oob: bool = False):
+    return Li(
+        fragment_cache.render(task_key(task), task_card, task),
+        cls='my-3 is-size-4',
+        id=f'task-{task["id"]}',
+        hx_swap_oob='true' if oob else None,
+    )
+
+def task_bar(tasks: list[dict] | None, oob: bool = False):
     return Div(
         P(
             'Tasks',
@@ -13,17 +23,31 @@ def task_bar(tasks: list[dict] | None):
         ),
         Ul(
             *[
-                Li(
-                    task_card(task),
-                    cls='my-3 is-size-4'
-                ) for task in tasks
+                task_item(task) for task in tasks
             ],
             cls='my-5',
             style='list-style-type: none;',
+            id='task-list',
         ) if tasks != None and len(tasks) >= 1 else Div(
             'No pending task',
             cls='is-size-5 my-5',
         ),
         cls='cell is-col-span-4',
-        id='task_bar'
-    )
\ No newline at end of file
+        id='task_bar',
+        hx_swap_oob='true' if oob else None,
+    )
+
+def task_bar_change(
+    action_type: Literal[ActionType.create.value, ActionType.update.value, ActionType.delete.value],
+    task: dict,
+    tasks: list[dict] | None,
+    full: bool = False
+):
+    # Out-of-band swaps of the one changed card; the whole bar when the list appears or empties
+    if full or not tasks:
+        return task_bar(tasks, oob=True)
+    if action_type == ActionType.delete.value:
+        return Li(id=f'task-{task["id"]}', hx_swap_oob='delete')
+    if action_type == ActionType.update.value:
+        return task_item(task, oob=True)
+    return Div(task_item(task), hx_swap_oob='beforeend:#task-list')
@@ -31,7 +31,7 @@ def task_card(task: dict):
                     resourceId=task['id'],
                 ),
                 cls='card-footer-item button is-danger has-text-weight-normal',
-                hx_target='#task_bar',
+                hx_swap='none',
                 hx_disabled_elt='this',
             ),
             cls='card-footer'
@@ -0,0 +1,78 @@
+from datetime import datetime, timezone
+
+from fasthtml.common import *
+from fasthtml.svg import Polyline, Text
+
+from cdpmd.timeline import TIMELINE_SERIES, TIMELINE_WINDOWS
+
+
+CHART_HEIGHT = 160
+CHART_PADDING = 4
+WIDTH_VALS = 'js:{width: document.getElementById("timeline-chart").clientWidth}'
+
+
+def _date(seconds: int) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%d')
+
+def timeline_chart(timeline: dict, width: int, height: int = CHART_HEIGHT):
+    points = timeline['points']
+    if not points:
+        return P(f'No {timeline["series"]} readings in this window', cls='is-size-6 has-text-grey my-5')
+    start, end = points[0][0], points[-1][0]
+    low, high = timeline['min'], timeline['max']
+    x_scale = (width - 2 * CHART_PADDING) / ((end - start) or 1)
+    y_scale = (height - 2 * CHART_PADDING) / ((high - low) or 1)
+    coordinates = ' '.join(
+        f'{CHART_PADDING + (time - start) * x_scale:.1f},{height - CHART_PADDING - (value - low) * y_scale:.1f}'
+        for time, value in points
+    )
+    return Div(
+        Svg(
+            Polyline(points=coordinates, fill='none', stroke='hsl(229, 53%, 53%)', stroke_width='1.5'),
+            Text(f'{high:g} {timeline["unit"]}', x=CHART_PADDING, y=12, font_size='11'),
+            Text(f'{low:g} {timeline["unit"]}', x=CHART_PADDING, y=height - CHART_PADDING - 2, font_size='11'),
+            viewBox=f'0 0 {width} {height}',
+            width='100%',
+            height=height,
+            preserveAspectRatio='none',
+        ),
+        P(
+            f'{_date(start)} – {_date(end)} · {len(points)} of {timeline["total"]} readings',
+            cls='is-size-7 has-text-grey'
+        ),
+    )
+
+def timeline_panel(patient_id: str, series: str = 'glucose', window: str = '90d', timeline: dict | None = None, width: int = 0):
+    url = f'/patients/{patient_id}/timeline'
+    return Div(
+        Div(
+            *[
+                Button(
+                    'Glucose' if name == 'glucose' else 'HbA1c',
+                    hx_get=f'{url}?series={name}&window={window}',
+                    cls='button is-small' + (' is-link' if name == series else ''),
+                ) for name in TIMELINE_SERIES
+            ],
+            *[
+                Button(
+                    name,
+                    hx_get=f'{url}?series={series}&window={name}',
+                    cls='button is-small' + (' is-link is-light' if name == window else ''),
+                ) for name in TIMELINE_WINDOWS
+            ],
+            cls='buttons mb-2'
+        ),
+        Div(
+            timeline_chart(timeline, width),
+            id='timeline-chart',
+        ) if timeline is not None else Div(
+            hx_get=f'{url}?series={series}&window={window}',
+            hx_trigger='load',
+            id='timeline-chart',
+        ),
+        hx_vals=WIDTH_VALS,
+        hx_target='#timeline',
+        hx_swap='outerHTML',
+        id='timeline',
+        cls='mb-5'
+    )
@@ -6,6 +6,8 @@ import hashlib
 from datetime import datetime
 import time
 import os
+import asyncio
+import threading
 import httpx
 
 from httpx import AsyncClient
@@ -24,8 +26,19 @@ from fhir.resources.task import Task
 
 from cdpmd.schemas import ResourceType, Link, CardDetailsLink, CardDetailsLinkType
 from cdpmd.fhir_client import FHIRClient
+from cdpmd.fhirpath import ExtractionRules, SUMMARY_RULES
+from cdpmd.offload import run_cpu, OFFLOAD_MIN_ITEMS
+from cdpmd.metrics import stage, CACHE_REQUESTS
+from cdpmd.replica import replica, FRESH, INCREMENTAL, FULL
 
 
+def write_json(path: str, data: Any):
+    """Atomically replace `path` with `data` serialised as JSON."""
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, "w") as file:
+        json.dump(data, file, default=str)
+    os.replace(tmp_path, path)
+
 class AsyncCache:
     def __init__(self, ttl: Optional[float] = 300, cache_file: str = "cache.json"):
         """
@@ -35,8 +48,10 @@ class AsyncCache:
             cache_file: Path to the JSON file for storing the cache.
         """
         self.cache_file = cache_file
+        self.name = os.path.splitext(os.path.basename(cache_file))[0]
         self.ttl = float(ttl) if ttl is not None else None
         self.cache: Dict[str, Tuple[float, Any]] = self._load_cache()
+        self._save_lock = asyncio.Lock()
 
     def _load_cache(self) -> Dict[str, Tuple[float, Any]]:
         """Load cache from the JSON file."""
@@ -51,8 +66,13 @@ class AsyncCache:
 
     def _save_cache(self):
         """Save cache to the JSON file."""
-        with open(self.cache_file, "w") as file:
-            json.dump(self.cache, file, default=str)
+        write_json(self.cache_file, dict(self.cache))
+
+    async def _save_cache_async(self):
+        """Save cache to the JSON file without serialising on the event loop."""
+        async with self._save_lock:
+            # Cache files grow with every patient, so any non-empty write leaves the loop
+            await run_cpu(write_json, self.cache_file, dict(self.cache), size=len(self.cache), threshold=1)
 
     def __call__(self, func: Callable) -> Callable:
         @wraps(func)
@@ -64,17 +84,21 @@ class AsyncCache:
                 expiration, cached_value = self.cache[key]
 
                 if self.ttl is None or time.time() < expiration:
+                    CACHE_REQUESTS.inc(cache=self.name, outcome='hit')
                     return cached_value
 
                 # Remove expired entry
+                CACHE_REQUESTS.inc(cache=self.name, outcome='expired')
                 del self.cache[key]
-                self._save_cache()
+                await self._save_cache_async()
+            else:
+                CACHE_REQUESTS.inc(cache=self.name, outcome='miss')
 
             # Execute and cache result
             result = await func(*args, **kwargs)
             expiration = time.time() + self.ttl if self.ttl else None
             self.cache[key] = (expiration, result)
-            self._save_cache()
+            await self._save_cache_async()
             return result
 
         return wrapper
@@ -84,6 +108,61 @@ class AsyncCache:
         patient_id = args[0]['id']
         return patient_id
 
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the unexpired value stored under `key`, or `default`."""
+        if key in self.cache:
+            expiration, cached_value = self.cache[key]
+            if self.ttl is None or time.time() < expiration:
+                CACHE_REQUESTS.inc(cache=self.name, outcome='hit')
+                return cached_value
+        CACHE_REQUESTS.inc(cache=self.name, outcome='miss')
+        return default
+
+    def put(self, key: str, value: Any):
+        """Store `value` under `key` as if it had been returned by the wrapped function."""
+        expiration = time.time() + self.ttl if self.ttl else None
+        self.cache[key] = (expiration, value)
+        self._save_cache()
+
+    async def put_async(self, key: str, value: Any):
+        """Like `put`, but saves the cache file off the event loop."""
+        expiration = time.time() + self.ttl if self.ttl else None
+        self.cache[key] = (expiration, value)
+        await self._save_cache_async()
+
+    async def put_many_async(self, items: Dict[str, Any]):
+        """Like `put_async` for several entries, saving the cache file once."""
+        expiration = time.time() + self.ttl if self.ttl else None
+        for key, value in items.items():
+            self.cache[key] = (expiration, value)
+        if items:
+            await self._save_cache_async()
+
+    async def invalidate(self, key: str) -> bool:
+        """Drop the entry stored under `key`; returns whether there was one."""
+        if self.cache.pop(key, None) is None:
+            return False
+        CACHE_REQUESTS.inc(cache=self.name, outcome='invalidated')
+        await self._save_cache_async()
+        return True
+
+    async def invalidate_prefix(self, prefix: str) -> int:
+        """Drop every entry whose key starts with `prefix`, saving the file once; returns how many there were."""
+        keys = [key for key in self.cache if key.startswith(prefix)]
+        for key in keys:
+            del self.cache[key]
+            CACHE_REQUESTS.inc(cache=self.name, outcome='invalidated')
+        if keys:
+            await self._save_cache_async()
+        return len(keys)
+
+    def fresh(self, key: str) -> bool:
+        """Whether an unexpired entry is stored under `key`, without counting a lookup."""
+        if key not in self.cache:
+            return False
+        expiration, _ = self.cache[key]
+        return self.ttl is None or time.time() < expiration
+
     def clear(self):
         """Clear all cached entries and save the empty cache to the file."""
         self.cache.clear()
@@ -114,8 +193,10 @@ class AsyncFhirCache:
             cache_file: Path to the JSON file for storing the cache.
         """
         self.cache_file = cache_file
+        self.name = os.path.splitext(os.path.basename(cache_file))[0]
         self.ttl = float(ttl) if ttl is not None else None
         self.cache: Dict[str, Tuple[float, Any]] = self._load_cache()
+        self._save_lock = asyncio.Lock()
 
     def _load_cache(self) -> Dict[str, Tuple[float, Any]]:
         """Load cache from the JSON file."""
@@ -130,8 +211,13 @@ class AsyncFhirCache:
 
     def _save_cache(self):
         """Save cache to the JSON file."""
-        with open(self.cache_file, "w") as file:
-            json.dump(self.cache, file, default=str)
+        write_json(self.cache_file, dict(self.cache))
+
+    async def _save_cache_async(self):
+        """Save cache to the JSON file without serialising on the event loop."""
+        async with self._save_lock:
+            # Cache files grow with every patient, so any non-empty write leaves the loop
+            await run_cpu(write_json, self.cache_file, dict(self.cache), size=len(self.cache), threshold=1)
 
     def __call__(self, func: Callable) -> Callable:
         @wraps(func)
@@ -143,17 +229,21 @@ class AsyncFhirCache:
                 expiration, cached_value = self.cache[key]
 
                 if self.ttl is None or time.time() < expiration:
+                    CACHE_REQUESTS.inc(cache=self.name, outcome='hit')
                     return cached_value
 
                 # Remove expired entry
+                CACHE_REQUESTS.inc(cache=self.name, outcome='expired')
                 del self.cache[key]
-                self._save_cache()
+                await self._save_cache_async()
+            else:
+                CACHE_REQUESTS.inc(cache=self.name, outcome='miss')
 
             # Execute and cache result
             result = await func(*args, **kwargs)
             expiration = time.time() + self.ttl if self.ttl else None
             self.cache[key] = (expiration, result)
-            self._save_cache()
+            await self._save_cache_async()
             return result
 
         return wrapper
@@ -163,6 +253,21 @@ class AsyncFhirCache:
         patient_id = args[-1]
         return patient_id
 
+    async def invalidate(self, key: str) -> bool:
+        """Drop the entry stored under `key`; returns whether there was one."""
+        if self.cache.pop(key, None) is None:
+            return False
+        CACHE_REQUESTS.inc(cache=self.name, outcome='invalidated')
+        await self._save_cache_async()
+        return True
+
+    def fresh(self, key: str) -> bool:
+        """Whether an unexpired entry is stored under `key`, without counting a lookup."""
+        if key not in self.cache:
+            return False
+        expiration, _ = self.cache[key]
+        return self.ttl is None or time.time() < expiration
+
     def clear(self):
         """Clear all cached entries and save the empty cache to the file."""
         self.cache.clear()
@@ -208,26 +313,41 @@ async def new_get_resource(
     meldrx_base_url: str,
     patient_id: str
 ) -> Union[FHIRResource, List[FHIRResource], None]:
-    """Retrieves FHIR resources from the server with patient context awareness."""
-    
+    """Retrieves FHIR resources from the server with patient context awareness.
+
+    With the local replica enabled, fresh resources are read from it and
+    stale ones are synced (incrementally where possible) before returning.
+    """
+    plan, since = await replica.plan(meldrx_base_url, resource_type, patient_id) if replica else (FULL, None)
+    if plan == FRESH:
+        with stage(f'replica.{resource_type}'):
+            return await replica.read(meldrx_base_url, resource_type, patient_id)
+
     async with get_meldrx_client(access_token, meldrx_base_url) as client:
         resource_id = patient_id if resource_type == ResourceType.patient.value else None
+        params = {'patient': patient_id} if resource_type != ResourceType.patient.value else None
+        if since:
+            params['_lastUpdated'] = f'gt{since}'
         
         try:
-            resource = await client.read_resource(
-                resource_type=resource_type,
-                resource_id=resource_id,
-                params={
-                    'patient': patient_id
-                } if resource_type != ResourceType.patient.value else None
-            )
-            
-            return resource
+            with stage(f'fhir.{resource_type}'):
+                resource = await client.read_resource(
+                    resource_type=resource_type,
+                    resource_id=resource_id,
+                    params=params
+                )
             
         except httpx.HTTPStatusError as e:
             print(f"FHIR API error for {resource_type}: {e}")
             return None
 
+    if replica:
+        await replica.write(meldrx_base_url, resource_type, patient_id, resource, full=plan == FULL)
+        if plan == INCREMENTAL:
+            # Only the changes came back; the full set is in the replica
+            resource = await replica.read(meldrx_base_url, resource_type, patient_id)
+    return resource
+
 @fhir_cache
 async def get_resources(
     access_token: str,
@@ -313,8 +433,14 @@ async def make_task(
     ],
     patient_id: str,
     access_token: str,
-    meldrx_base_url: str
-) -> None:
+    meldrx_base_url: str,
+    task_id: Optional[str] = None
+) -> Optional[dict]:
+    """Create a Task focused on `resource_type/resource_id`, or replace Task `task_id` with it.
+
+    Returns:
+        The Task as stored by the server, or None if the write failed.
+    """
     json_obj = {
         'description': description,
         'intent': 'order',
@@ -329,7 +455,14 @@ async def make_task(
     }
     async with get_meldrx_client(access_token, meldrx_base_url) as client:
         try:
-            response = await client.create_resource(
+            if task_id:
+                json_obj['id'] = task_id
+                return await client.update_resource(
+                    resource_type=ResourceType.task.value,
+                    resource_id=task_id,
+                    data=json_obj
+                )
+            return await client.create_resource(
                 resource_type=ResourceType.task.value,
                 data=json_obj
             )
@@ -337,16 +470,18 @@ async def make_task(
             print(f"FHIR API error for {ResourceType.task.value}: {e}")
             return None
 
-async def delete_task(resource_id: str, access_token: str, meldrx_base_url: str) -> None:
+async def delete_task(resource_id: str, access_token: str, meldrx_base_url: str) -> bool:
+    """Delete a Task; returns whether the server accepted it."""
     async with get_meldrx_client(access_token, meldrx_base_url) as client:
         try:
-            response = await client.delete_resource(
+            await client.delete_resource(
                 ResourceType.task.value,
                 resource_id
             )
         except httpx.HTTPStatusError as e:
             print(f"FHIR API error for {ResourceType.task.value}: {e}")
-            return None
+            return False
+    return True
 
 async def add_source(
     response_dict: dict,
@@ -373,7 +508,66 @@ def calculate_age(date_of_birth: str) -> int:
     return age
 
 
+FHIR_DATA_TYPES = {
+    'patient': ResourceType.patient.value,
+    'conditions': ResourceType.condition.value,
+    'medications': ResourceType.medication_request.value,
+    'observations': ResourceType.observation.value,
+    'encounters': ResourceType.encounter.value,
+    'diagnosticReports': ResourceType.diagnostic_report.value,
+    'riskAssessments': ResourceType.risk_assessment.value,
+    'carePlans': ResourceType.care_plan.value,
+}
+
+def extract_fhir_data(fhir_data: dict, rules: ExtractionRules = SUMMARY_RULES) -> Dict[str, list]:
+    """Run `rules` over every resource in CDS-prefetch shaped data.
+
+    Values may be a single resource, a searchset Bundle, a list of resources
+    or None.
+    """
+    results = None
+    for key, resource_type in FHIR_DATA_TYPES.items():
+        data = fhir_data.get(key)
+        if not data:
+            continue
+        if isinstance(data, dict):
+            data = (data.get('entry') or []) if 'entry' in data or data.get('resourceType') == 'Bundle' else [data]
+        results = rules.run(data, resource_type, results)
+    return results or {name: [] for name in rules.rules}
+
+def patient_id_of(resource: dict) -> Optional[str]:
+    """Id of the patient a resource belongs to, from its subject/for/patient reference."""
+    if resource.get('resourceType') == ResourceType.patient.value:
+        return resource.get('id')
+    for field in ('subject', 'for', 'patient', 'beneficiary'):
+        reference = (resource.get(field) or {}).get('reference') or ''
+        if reference.startswith('Patient/'):
+            return reference.split('/', 1)[1].split('/_history', 1)[0]
+    return None
+
+def count_resources(fhir_data: dict) -> int:
+    """Number of resources in CDS-prefetch shaped data, used to size CPU work."""
+    count = 0
+    for data in fhir_data.values():
+        if isinstance(data, list):
+            count += len(data)
+        elif isinstance(data, dict):
+            count += len(data.get('entry') or []) if 'entry' in data else 1
+    return count
+
+def count_actions(response: dict) -> int:
+    """Number of suggested actions in a predictor response, used to size CPU work."""
+    return sum(
+        len(suggestion.get('actions') or [])
+        for card in response.get('cards') or []
+        for suggestion in card.get('suggestions') or []
+    )
+
 async def generate_clinical_summary(fhir_data: dict) -> str:
+    """Generate a clinical summary, off the event loop for large records."""
+    return await run_cpu(build_clinical_summary, fhir_data, size=count_resources(fhir_data), threshold=OFFLOAD_MIN_ITEMS)
+
+def build_clinical_summary(fhir_data: dict) -> str:
     """
     Generate a clinical summary from a set of FHIR resources.
     
@@ -386,11 +580,11 @@ async def generate_clinical_summary(fhir_data: dict) -> str:
         str: A clinical summary string.
     """
     summary_parts = []
+    extracted = extract_fhir_data(fhir_data)
     
     # Patient demographics
-    patient = fhir_data.get("patient", {})
-    gender = patient.get("gender", "unknown")
-    birth_date = patient.get("birthDate", "unknown")
+    gender = next(iter(extracted['gender']), "unknown")
+    birth_date = next(iter(extracted['birth_date']), "unknown")
     age = "unknown"
     if birth_date != "unknown":
         try:
@@ -402,63 +596,34 @@ async def generate_clinical_summary(fhir_data: dict) -> str:
     summary_parts.append(f"The patient is a {age}-year-old {gender}.")
     
     # Conditions: list all condition names (using text from code element)
-    conditions = fhir_data.get("conditions", {}).get('entry', [])
-    condition_names = []
-    for cond in conditions:
-        code = cond.get("code", {})
-        # Try to get a human-readable text description
-        condition_text = code.get("text")
-        if condition_text:
-            condition_names.append(condition_text)
-    if condition_names:
-        summary_parts.append("History of " + ", ".join(condition_names) + ".")
+    if extracted['conditions']:
+        summary_parts.append("History of " + ", ".join(extracted['conditions']) + ".")
     
     # Medications: list current medications (using medicationCodeableConcept text)
-    medications = fhir_data.get("medications", {}).get("entry", [])
-    med_names = []
-    for med in medications:
-        med_concept = med.get("medicationCodeableConcept", {})
-        med_text = med_concept.get("text")
-        if med_text:
-            med_names.append(med_text)
-    if med_names:
-        summary_parts.append("Currently on " + ", ".join(med_names) + ".")
+    if extracted['medications']:
+        summary_parts.append("Currently on " + ", ".join(extracted['medications']) + ".")
     
-    # Observations: Focus on key labs like HbA1c (LOINC 4548-4) and/or blood glucose (e.g., LOINC 2339-0)
-    observations = fhir_data.get("observations", {}).get('entry', [])
-    hba1c_values = []
-    for obs in observations:
-        code = obs.get("code", {})
-        codings = code.get("coding", [])
-        for coding in codings:
-            if coding.get("code") == "4548-4":
-                # Assume valueQuantity holds the lab value
-                value = obs.get("valueQuantity", {}).get("value")
-                if value is not None:
-                    hba1c_values.append(value)
-    if hba1c_values:
-        latest_hba1c = hba1c_values[-1]
+    # Observations: Focus on key labs like HbA1c (LOINC 4548-4)
+    if extracted['hba1c']:
+        latest_hba1c = extracted['hba1c'][-1]
         summary_parts.append(f"Recent HbA1c is {latest_hba1c}%.")
     else:
         summary_parts.append("No recent HbA1c or glucose monitoring data available.")
     
     # Encounters and DiagnosticReports can be used to provide context if needed.
-    encounters = fhir_data.get("encounters", [])
+    encounters = sum(extracted['encounters'])
     if encounters:
-        summary_parts.append(f"{len(encounters)} recent encounter(s) available for review.")
+        summary_parts.append(f"{encounters} recent encounter(s) available for review.")
     
-    diagnostic_reports = fhir_data.get("diagnosticReports", [])
-    if diagnostic_reports:
+    if extracted['diagnostic_reports']:
         summary_parts.append("Relevant diagnostic reports are present.")
     
     # Risk assessments (if available) can be noted
-    risk_assessments = fhir_data.get("riskAssessments", [])
-    if risk_assessments:
+    if extracted['risk_assessments']:
         summary_parts.append("Risk assessments data is available.")
     
     # Care plans, goals, and tasks might provide additional treatment context
-    care_plans = fhir_data.get("carePlans", [])
-    if care_plans:
+    if extracted['care_plans']:
         summary_parts.append("Current care plan details have been provided.")
     
     # Combine summary parts into a single summary string
@@ -471,8 +636,25 @@ async def create_cards(
     clinical_summary: str,
     source_url: str,
     source_label: str = 'Chronic Disease Progressive Model for Diabetes (CDPMD)',
-    source_icon: str = 'https://imgs.search.brave.com/MXd2gYPBb_8uzLekNa80ujdvyMZP8a33lPsO2Cw4m7c/rs:fit:860:0:0:0/g:ce/aHR0cHM6Ly90My5m/dGNkbi5uZXQvanBn/LzAxLzg1LzY2Lzk2/LzM2MF9GXzE4NTY2/OTY0MV9STDA1UG1Y/TTgyUXBwYVJCUVZz/dXk0SkRWcnpoenNh/SC5qcGc'
+    source_icon: str = 'https://imgs.search.brave.com/MXd2gYPBb_8uzLekNa80ujdvyMZP8a33lPsO2Cw4m7c/rs:fit:860:0:0:0/g:ce/aHR0cHM6Ly90My5m/dGNkbi5uZXQvanBn/LzAxLzg1LzY2Lzk2/LzM2MF9GXzE4NTY2/OTY0MV9STDA1UG1Y/TTgyUXBwYVJCUVZz/dXk0SkRWcnpoenNh/SC5qcGc',
+    refresh_url: str | None = None
 ) -> dict:
+    links = [
+        CardDetailsLink(
+            label='Get AI generated predictions',
+            url=f'{source_url}launch',
+            type=CardDetailsLinkType.smart.value
+        ).dict()
+    ]
+    if refresh_url:
+        clinical_summary += ' AI generated predictions are being prepared and will be shown when this patient is reopened.'
+        links.append(
+            CardDetailsLink(
+                label='Refresh AI generated predictions',
+                url=refresh_url,
+                type=CardDetailsLinkType.absolute.value
+            ).dict()
+        )
     return {
         'cards': [
             {
@@ -480,13 +662,7 @@ async def create_cards(
                 'detail': clinical_summary,
                 'indicator': 'info',
                 'source': Link(label=source_label, url=source_url, icon=source_icon).dict(),
-                'links': [
-                    CardDetailsLink(
-                        label='Get AI generated predictions',
-                        url=f'{source_url}launch',
-                        type=CardDetailsLinkType.smart.value
-                    ).dict()
-                ]
+                'links': links
             }
         ]
     }
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+import logfire
+
+
+LOOP_WATCHDOG = os.getenv('LOOP_WATCHDOG', 'false').lower() == 'true'
+LOOP_WATCHDOG_INTERVAL = float(os.getenv('LOOP_WATCHDOG_INTERVAL', 0.1))
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv('LOOP_WATCHDOG_THRESHOLD', 0.25))
+
+
+class LoopWatchdog:
+    """Measures event-loop scheduling lag and attributes stalls to the blocking code.
+
+    A heartbeat coroutine records how late each wake-up is. A daemon thread
+    notices when the heartbeat stops; once the loop has been stuck for
+    `threshold` seconds it captures the loop thread's stack and the running
+    task, which are reported to logfire when the loop recovers.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25):
+        """
+        Args:
+            interval: Heartbeat period in seconds.
+            threshold: Lag in seconds that counts as a stall.
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._last_beat = time.monotonic()
+        self._captured: Optional[dict] = None
+        self._stopped = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._lag = logfire.metric_histogram(
+            'event_loop.lag', unit='s', description='Delay between scheduled and actual event loop wake-ups'
+        )
+        self._stalls = logfire.metric_counter(
+            'event_loop.stalls', unit='1', description='Event loop stalls longer than the watchdog threshold'
+        )
+
+    def start(self):
+        """Start watching the running loop; call from inside it."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = self._loop.create_task(self._heartbeat())
+        threading.Thread(target=self._monitor, name='cdpmd-loop-watchdog', daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - self._last_beat - self.interval, 0.0)
+            self._lag.record(lag)
+            captured, self._captured = self._captured, None
+            if lag >= self.threshold:
+                self._stalls.add(1)
+                logfire.warn(
+                    'event loop blocked for {lag_seconds:.3f}s',
+                    lag_seconds=lag,
+                    task=(captured or {}).get('task'),
+                    stack=(captured or {}).get('stack'),
+                )
+
+    def _monitor(self):
+        while not self._stopped.wait(self.interval / 2):
+            if self._captured is not None:
+                continue
+            if time.monotonic() - self._last_beat - self.interval < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            task = asyncio.current_task(self._loop)
+            self._captured = {
+                'stack': ''.join(traceback.format_stack(frame)) if frame else None,
+                'task': repr(task.get_coro()) if task else None,
+            }
+
+
+watchdog: Optional[LoopWatchdog] = None
+
+
+def start_watchdog():
+    """Startup hook: start the watchdog when `LOOP_WATCHDOG=true`."""
+    global watchdog
+    if LOOP_WATCHDOG and watchdog is None:
+        watchdog = LoopWatchdog(LOOP_WATCHDOG_INTERVAL, LOOP_WATCHDOG_THRESHOLD)
+        watchdog.start()
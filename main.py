@@ -3,7 +3,9 @@ import logging
 import sys
 import json
 import hashlib
+import copy
 import os
+import time
 from typing import Literal
 import urllib.parse
 from datetime import datetime
@@ -25,19 +27,47 @@ from cdpmd.schemas import (
 )
 from cdpmd.ui.ordinary_home import ordinary_home
 from cdpmd.ui.auth_home import auth_home
+from cdpmd.ui.patients_list import patient_rows
 from cdpmd.ui.patient_space_content import patient_space_content
-from cdpmd.ui.task_bar import task_bar
+from cdpmd.ui.task_bar import task_bar_change
+from cdpmd.ui.timeline import timeline_panel
+from cdpmd.ui.fragments import card_key, task_key
 from cdpmd.ui.about_page import about_page
 from cdpmd.ui.privacy_policy_page import privacy_policy_page
 from cdpmd.ui.terms_of_service_page import terms_of_service_page
 from cdpmd.ui.contact_page import contact_page
+from cdpmd.ui.render import render
 from cdpmd.utils import (
     get_meldrx_client, generate_clinical_summary, create_cards,
-    make_task, new_get_resource, delete_task, get_resources
+    make_task, delete_task, get_resources, add_source,
+    count_actions, calculate_age
+)
+from cdpmd.offload import run_cpu, OFFLOAD_MIN_ITEMS
+from cdpmd.agent import predictor_query, llm_calls
+from cdpmd.cds import (
+    CDS_AI_CARDS, CDS_DEADLINE, PREFETCH, cds_cache, predictor_cards,
+    is_pending, resolve_prefetch
+)
+from cdpmd.risk import prescreen
+from cdpmd.paging import patient_pages, session_key
+from cdpmd.search import patient_search
+from cdpmd.prefetch import prefetcher
+from cdpmd.tasks import task_cache
+from cdpmd.http_cache import CompressionMiddleware, etag, not_modified, with_etag
+from cdpmd.timeline import (
+    TIMELINE_SERIES, TIMELINE_WINDOWS, timeline_cache, timeline_key, chart_width, downsample
+)
+from cdpmd.watchdog import start_watchdog
+from cdpmd.metrics import MetricsMiddleware, stage, render_prometheus
+from cdpmd.profiler import ProfilingMiddleware, is_authorized, list_profiles, profile_path
+from cdpmd.subscriptions import (
+    register_subscriptions, handle_notification, is_authorized as is_subscription_authorized, SUBSCRIPTION_SECRET
 )
-from cdpmd.agent import predictor_query
 
-logfire.configure(token=os.getenv('LOGFIRE_TOKEN'))
+RISK_PRESCREEN = os.getenv('RISK_PRESCREEN', 'true').lower() == 'true'
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))
+
+logfire.configure(token=os.getenv('LOGFIRE_TOKEN'), send_to_logfire='if-token-present')
 logfire.instrument_httpx(capture_all=True)
 
 app, route = fast_app(
@@ -50,7 +80,9 @@ app, route = fast_app(
         MarkdownJS(),
         Link(rel="icon", type="image/png", href="https://imgs.search.brave.com/MXd2gYPBb_8uzLekNa80ujdvyMZP8a33lPsO2Cw4m7c/rs:fit:860:0:0:0/g:ce/aHR0cHM6Ly90My5m/dGNkbi5uZXQvanBn/LzAxLzg1LzY2Lzk2/LzM2MF9GXzE4NTY2/OTY0MV9STDA1UG1Y/TTgyUXBwYVJCUVZz/dXk0SkRWcnpoenNh/SC5qcGc"),
     ),
-    pico=False
+    pico=False,
+    on_startup=[start_watchdog],
+    middleware=[Middleware(MetricsMiddleware), Middleware(ProfilingMiddleware), Middleware(CompressionMiddleware)]
 )
 setup_toasts(app)
 
@@ -99,47 +131,147 @@ async def index(request: Request):
         access_token=request.cookies['access_token'],
         meldrx_base_url=request.cookies['meldrx_base_url'],
     )
-    return Title('CDPMD - Chronic Disease Progressive Model for Diabetes'), auth_home(await meldrx_client.read_resource(ResourceType.patient.value))
+    key = session_key(request.session, request.cookies['meldrx_base_url'])
+    async with meldrx_client:
+        patients, more = await patient_pages.page(meldrx_client, key, 0)
+    patient_search.add(key, patients)
+    return Title('CDPMD - Chronic Disease Progressive Model for Diabetes'), auth_home(patients, 1 if more else None)
+
+@app.route('/patient-list')
+async def patient_list_page(request: Request):
+    try:
+        number = max(int(request.query_params.get('page', 0)), 0)
+        key = session_key(request.session, request.cookies['meldrx_base_url'])
+        async with get_meldrx_client(request.cookies['access_token'], request.cookies['meldrx_base_url']) as meldrx_client:
+            patients, more = await patient_pages.page(meldrx_client, key, number)
+        patient_search.add(key, patients)
+    except Exception as e:
+        print(e)
+        return add_toast(request.session, 'An error occured. Try reloading this page!', 'error')
+    return await render(patient_rows, patients, number + 1 if more else None, size=len(patients))
+
+@app.route('/search/patients')
+async def search_patients(request: Request):
+    try:
+        access_token = request.cookies['access_token']
+        meldrx_base_url = request.cookies['meldrx_base_url']
+    except KeyError:
+        return Response(status_code=401)
+    key = session_key(request.session, meldrx_base_url)
+    # Answers from what is indexed so far while the rest of the list loads
+    patient_search.ensure_built(lambda: get_meldrx_client(access_token, meldrx_base_url), key)
+    with stage('search'):
+        patients = patient_search.search(key, request.query_params.get('q', ''))
+    return await render(patient_rows, patients, size=len(patients))
 
 @app.route('/patients/{patient_id}')
 async def details(request: Request, patient_id: str):
     try:
         access_token = request.cookies['access_token']
         meldrx_base_url = request.cookies['meldrx_base_url']
-        (
-            patient,
-            conditions,
-            observations,
-            medications,
-            encounters,
-            diagnostic_reports,
-            risk_assessments,
-            care_plans
-        ) = await get_resources(access_token, meldrx_base_url, patient_id)
-        response = await predictor_query(
+        with stage('fhir'):
+            await prefetcher.join(meldrx_base_url, patient_id)
+            (
+                patient,
+                conditions,
+                observations,
+                medications,
+                encounters,
+                diagnostic_reports,
+                risk_assessments,
+                care_plans
+            ) = await get_resources(access_token, meldrx_base_url, patient_id)
+        with stage('prescreen'):
+            screen = prescreen(conditions, observations, medications)
+        response = screen.response.dict()
+        if screen.needs_llm or not RISK_PRESCREEN:
+            prediction = asyncio.ensure_future(predictor_query(
+                patient,
+                conditions,
+                observations,
+                medications,
+                encounters,
+                diagnostic_reports,
+                risk_assessments,
+                care_plans
+            ))
+            prediction.add_done_callback(lambda task: task.cancelled() or task.exception())
+            try:
+                # Shielded so a slow prediction still lands in the cache for the next view
+                with stage('llm'):
+                    response = await asyncio.wait_for(asyncio.shield(prediction), timeout=LLM_TIMEOUT)
+            except Exception as e:
+                print(f'Serving risk pre-screen cards: {e!r}')
+        tasks = await task_cache.tasks(access_token, meldrx_base_url, patient_id)
+        size = count_actions(response) + len(tasks or [])
+        with stage('validation'):
+            prediction = await run_cpu(PredictorAgentResponseSchema.model_validate, response, size=size, threshold=OFFLOAD_MIN_ITEMS)
+        tag = etag(
             patient,
-            conditions,
-            observations,
-            medications,
-            encounters,
-            diagnostic_reports,
-            risk_assessments,
-            care_plans
-        )
-        tasks = await new_get_resource(
-            ResourceType.task.value,
-            access_token,
-            meldrx_base_url,
-            patient_id
+            # The rendered age changes on birthdays without the Patient changing
+            calculate_age(str(patient['birthDate'])) if patient.get('birthDate') else None,
+            [card_key(card, patient_id) for card in prediction.cards],
+            [task_key(task) for task in tasks or []]
         )
     except Exception as e:
         print(e)
         return add_toast(request.session, 'An error occured. Try reloading this page!', 'error')
-    return patient_space_content(
-        response=PredictorAgentResponseSchema(**response),
+    if (unchanged := not_modified(request, tag)) is not None:
+        return unchanged
+    return with_etag(await render(
+        patient_space_content,
+        response=prediction,
         patient=patient,
-        tasks=tasks
+        tasks=tasks,
+        size=size
+    ), tag)
+
+@app.route('/prefetch/{patient_id}', methods=['POST'])
+async def prefetch(request: Request, patient_id: str):
+    try:
+        access_token = request.cookies['access_token']
+        meldrx_base_url = request.cookies['meldrx_base_url']
+    except KeyError:
+        return Response(status_code=401)
+    outcome = prefetcher.trigger(
+        session_key(request.session, meldrx_base_url),
+        access_token,
+        meldrx_base_url,
+        patient_id,
+        prescreen_first=RISK_PRESCREEN
     )
+    return Response(status_code=204, headers={'x-prefetch': outcome})
+
+@app.route('/patients/{patient_id}/timeline')
+async def timeline(request: Request, patient_id: str):
+    series = request.query_params.get('series', 'glucose')
+    window = request.query_params.get('window', '90d')
+    if series not in TIMELINE_SERIES or window not in TIMELINE_WINDOWS:
+        return Response('Unknown series or window', status_code=400)
+    try:
+        access_token = request.cookies['access_token']
+        meldrx_base_url = request.cookies['meldrx_base_url']
+    except KeyError:
+        return Response(status_code=401)
+    width = chart_width(request.query_params.get('width'))
+    key = timeline_key(patient_id, meldrx_base_url, series, window, width)
+    timeline = timeline_cache.get(key)
+    if timeline is None:
+        try:
+            with stage('fhir'):
+                observations = (await get_resources(access_token, meldrx_base_url, patient_id))[2]
+        except Exception as e:
+            print(e)
+            return add_toast(request.session, 'An error occured. Try reloading this page!', 'error')
+        with stage('downsample'):
+            timeline = await run_cpu(
+                downsample, observations, series, window, width,
+                size=len(observations or []), threshold=OFFLOAD_MIN_ITEMS
+            )
+        await timeline_cache.put_async(key, timeline)
+    if request.query_params.get('format') == 'json':
+        return JSONResponse(timeline)
+    return await render(timeline_panel, patient_id, series, window, timeline, width, size=len(timeline['points']))
 
 @app.route('/actions/{patient_id}')
 async def manage_tasks(request: Request, patient_id: str):
@@ -150,73 +282,154 @@ async def manage_tasks(request: Request, patient_id: str):
         body = await request.body()
         query_dict = urllib.parse.parse_qs(body.decode())
         query_dict = {k: v[0] for k, v in query_dict.items()}
-        if query_dict['action_type'] == ActionType.create.value or query_dict['action_type'] == ActionType.update.value:
-            await make_task(
-                query_dict['description'],
-                query_dict['resourceId'],
-                query_dict['resource_type'],
-                patient_id,
-                access_token,
-                meldrx_base_url
-            )
-        else:
-            await delete_task(
-                query_dict['resourceId'],
-                access_token,
-                meldrx_base_url,
-            )
-        tasks = await new_get_resource(
-            ResourceType.task.value,
-            access_token,
-            meldrx_base_url,
-            patient_id
-        )
+        action_type = query_dict['action_type']
+        # Only a list we already hold can be patched; otherwise the whole bar is re-read
+        full = task_cache.cached(meldrx_base_url, patient_id) is None
+        with stage('task_write', action_type=action_type):
+            if action_type == ActionType.create.value or action_type == ActionType.update.value:
+                existing = None
+                if action_type == ActionType.update.value:
+                    await task_cache.tasks(access_token, meldrx_base_url, patient_id)
+                    existing = task_cache.find(
+                        meldrx_base_url,
+                        patient_id,
+                        f"{query_dict['resource_type']}/{query_dict['resourceId']}"
+                    )
+                task = await make_task(
+                    query_dict['description'],
+                    query_dict['resourceId'],
+                    query_dict['resource_type'],
+                    patient_id,
+                    access_token,
+                    meldrx_base_url,
+                    task_id=existing['id'] if existing else None
+                )
+                if task is None:
+                    raise RuntimeError(f'Task {action_type} failed for {patient_id}')
+                task_cache.upsert(meldrx_base_url, patient_id, task)
+                action_type = ActionType.update.value if existing else ActionType.create.value
+            else:
+                if not await delete_task(
+                    query_dict['resourceId'],
+                    access_token,
+                    meldrx_base_url,
+                ):
+                    raise RuntimeError(f'Task delete failed for {patient_id}')
+                task = {'id': query_dict['resourceId']}
+                task_cache.remove(meldrx_base_url, patient_id, task['id'])
+        tasks = await task_cache.tasks(access_token, meldrx_base_url, patient_id)
     except Exception as e:
         print(e)
         return add_toast(request.session, 'An error occured. Try reloading this page!', 'error', True)
-    return task_bar(tasks)
+    # A first task replaces the empty placeholder, so the whole bar is swapped
+    full = full or (action_type == ActionType.create.value and len(tasks) == 1)
+    return await render(task_bar_change, action_type, task, tasks, full, size=len(tasks) if full else 1)
 
 @app.route('/cds-services/')
 async def cds_services(request: Request):
-    return {
+    tag = etag(PREFETCH)
+    if (unchanged := not_modified(request, tag)) is not None:
+        return unchanged
+    return with_etag(JSONResponse({
         "services": [
             {
                 "hook": "patient-view",
                 "title": "Chronic Disease Progressive Model For Diabetes (CDPMD)",
                 "description": "A clinical decision support system for managing diabetes.",
                 "id": "predictor",
-                "prefetch": {
-                    "patient": "Patient/{{context.patientId}}",
-                    "conditions": "Condition?patient={{context.patientId}}",
-                    "medications": "MedicationRequest?patient={{context.patientId}}",
-                    "observations": "Observation?patient={{context.patientId}}",
-                    "encounters": "Encounter?patient={{context.patientId}}",
-                    "diagnosticReports": "DiagnosticReport?patient={{context.patientId}}",
-                    "riskAssessments": "RiskAssessment?patient={{context.patientId}}",
-                    "carePlans": "CarePlan?patient={{context.patientId}}",
-                }
+                "prefetch": PREFETCH
             }
         ]
-    }
+    }), tag)
 
 
 @app.route('/cds-services/predictor')
 async def predictor(request: Request):
+    started = time.monotonic()
     body = await request.body()
-    body = json.loads(body.decode())
-    fhir_data = {}
-    fhir_data['patient'] = body.get('prefetch', {}).get('patient', None)
-    fhir_data['conditions'] = body.get('prefetch', {}).get('conditions', None)
-    fhir_data['medications'] = body.get('prefetch', {}).get('medications', None)
-    fhir_data['observations'] = body.get('prefetch', {}).get('observations', None)
-    fhir_data['encounters'] = body.get('prefetch', {}).get('encounters', None)
-    fhir_data['diagnosticReports'] = body.get('prefetch', {}).get('diagnosticReports', None)
-    fhir_data['riskAssessments'] = body.get('prefetch', {}).get('riskAssessments', None)
-    fhir_data['carePlans'] = body.get('prefetch', {}).get('carePlans', None)
+    with stage('decode'):
+        body = await run_cpu(json.loads, body, size=len(body))
+    with stage('prefetch'):
+        fhir_data = await resolve_prefetch(body, CDS_DEADLINE)
+    if CDS_AI_CARDS:
+        return await predictor_cards(
+            fhir_data,
+            str(request.base_url),
+            CDS_DEADLINE - (time.monotonic() - started),
+            fhir_server=body.get('fhirServer')
+        )
     summary = await generate_clinical_summary(fhir_data)
     return await create_cards(summary, str(request.base_url))
+
+@app.route('/cds-services/predictor/cards/{key}')
+async def precomputed_cards(request: Request, key: str):
+    response = cds_cache.get(key)
+    if response is None:
+        if not is_pending(key):
+            return JSONResponse({'error': 'Unknown prediction'}, status_code=404)
+        return JSONResponse({'status': 'pending'}, status_code=202)
+    tag = etag(key, str(request.base_url), response)
+    if (unchanged := not_modified(request, tag)) is not None:
+        return unchanged
+    return with_etag(JSONResponse(await add_source(copy.deepcopy(response), str(request.base_url))), tag)
     
 
+@app.route('/subscriptions/notify', methods=['POST'])
+async def subscription_notification(request: Request):
+    # Without a shared secret anyone could purge the caches, so notifications are disabled
+    if not SUBSCRIPTION_SECRET:
+        return Response(status_code=404)
+    if not is_subscription_authorized(request.headers.get('authorization')):
+        return Response(status_code=401)
+    body = await request.body()
+    # Handshake and heartbeat notifications may have no payload
+    notification = await run_cpu(json.loads, body, size=len(body)) if body.strip() else None
+    with stage('invalidate'):
+        invalidated = await handle_notification(notification)
+    return JSONResponse({'invalidated': invalidated})
+
+@app.route('/subscriptions/register', methods=['POST'])
+async def subscription_registration(request: Request):
+    if not SUBSCRIPTION_SECRET:
+        return JSONResponse({'error': 'SUBSCRIPTION_SECRET is not configured'}, status_code=503)
+    try:
+        async with get_meldrx_client(request.cookies['access_token'], request.cookies['meldrx_base_url']) as client:
+            created = await register_subscriptions(client, str(request.url_for('subscription_notification')))
+    except Exception as e:
+        print(e)
+        return JSONResponse({'error': 'Could not register subscriptions'}, status_code=502)
+    return JSONResponse({'created': [subscription.get('id') for subscription in created]})
+
+@app.route('/metrics')
+async def metrics():
+    return Response(render_prometheus(), media_type='text/plain; version=0.0.4')
+
+@app.route('/metrics/llm')
+async def llm_metrics(request: Request):
+    # Records name patients, so they are served only to holders of the profiling token
+    if not is_authorized(request.headers.get('x-profile')):
+        return Response(status_code=404)
+    patient_id = request.query_params.get('patient_id')
+    try:
+        limit = max(int(request.query_params.get('limit', 100)), 0)
+    except ValueError:
+        return JSONResponse({'error': 'limit must be an integer'}, status_code=400)
+    records = llm_calls.query(patient_id, limit)
+    return JSONResponse([record.model_dump(mode='json') for record in records])
+
+@app.route('/profiles')
+async def profiles(request: Request):
+    if not is_authorized(request.headers.get('x-profile')):
+        return Response(status_code=404)
+    return JSONResponse(list_profiles())
+
+@app.route('/profiles/{name}')
+async def download_profile(request: Request, name: str):
+    path = profile_path(name)
+    if path is None or not is_authorized(request.headers.get('x-profile')):
+        return Response(status_code=404)
+    return FileResponse(path, media_type='text/plain', filename=name)
+
 @app.route('/about')
 async def about():
     return Title('About'), about_page()